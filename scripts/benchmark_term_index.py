@@ -0,0 +1,58 @@
+"""Compare matching terms with the term index and with scans of the table.
+
+Usage: python scripts/benchmark_term_index.py [NUMBER_OF_TERMS ...]
+"""
+import sys
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from zippy.pipeline.model.rank_message import get_weights
+from zippy.pipeline.model.text_index import CHAR_MATCH, TOKEN_MATCH, TermIndex
+
+ALPHABET = list("abcdefghijklmnopqrstuvwxyz0123456789")
+# terms of a typical email
+SEARCH_SIZE = 30
+REPEAT = 5
+
+
+def random_terms(rng, size):
+    """Return random words."""
+    return ["".join(rng.choice(ALPHABET, rng.integers(3, 10))) for _ in range(size)]
+
+
+def best_time(function, number):
+    """Return best time of a call in milliseconds."""
+    return min(timeit.repeat(function, number=number, repeat=REPEAT)) / number * 1000
+
+
+def benchmark(size):
+    """Print times of matching terms of an email in a table of the size."""
+    rng = np.random.default_rng(0)
+    table = pd.DataFrame({"term": random_terms(rng, size), "weight": rng.random(size)})
+    search = list(rng.choice(table.term, SEARCH_SIZE // 2)) + random_terms(
+        rng, SEARCH_SIZE // 2
+    )
+
+    build = best_time(lambda: TermIndex(table), 1)
+    index = TermIndex(table)
+    for mode in (CHAR_MATCH, TOKEN_MATCH):
+        scan = best_time(lambda: get_weights(search, table, mode=mode), 3)
+        indexed = best_time(lambda: index.weight(search, table, mode), 20)
+        print(
+            f"{size:>8} {mode:>6} {scan:>10.3f} {indexed:>10.3f} "
+            f"{scan / indexed:>8.1f}x {build:>10.1f}"
+        )
+
+
+def main(sizes):
+    """Run the benchmark for tables of every size."""
+    header = ("terms", "mode", "scan ms", "index ms", "speedup", "build ms")
+    print("{:>8} {:>6} {:>10} {:>10} {:>9} {:>10}".format(*header))
+    for size in sizes:
+        benchmark(size)
+
+
+if __name__ == "__main__":
+    main([int(size) for size in sys.argv[1:]] or [1000, 10000, 100000])
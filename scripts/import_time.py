@@ -0,0 +1,89 @@
+"""Report time spent importing a module and the heavy modules it imports.
+
+Usage: python scripts/import_time.py [--module MODULE] [--top TOP] [--strict]
+
+The module is imported in a new interpreter with ``-X importtime``. With
+``--strict``, the script fails if one of ``HEAVY_MODULES`` was imported, so a
+dependency imported at module level again shows up in CI.
+"""
+import argparse
+import os
+import pathlib
+import re
+import subprocess
+import sys
+
+from typing import List, NamedTuple
+
+ROOT = pathlib.Path(__file__).parents[1]
+# modules only needed once a model is loaded or trained
+HEAVY_MODULES = ("tensorflow", "keras", "nltk", "sklearn", "scipy")
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+class ImportTime(NamedTuple):
+    """Time spent importing a module, in microseconds."""
+
+    module: str
+    self_time: int
+    cumulative: int
+    depth: int
+
+
+def import_times(module: str) -> List[ImportTime]:
+    """Import the module in a new interpreter and return time of every import."""
+    env = dict(os.environ, PYTHONPATH=str(ROOT))
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME.match(line)
+        if match:
+            self_time, cumulative, indent, name = match.groups()
+            times.append(
+                ImportTime(name, int(self_time), int(cumulative), len(indent) // 2)
+            )
+    return times
+
+
+def main():
+    """Print the slowest imports of the module and heavy modules imported."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="zippy.client.main")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--strict", action="store_true")
+    args = parser.parse_args()
+
+    times = import_times(args.module)
+    end = next(i for i, time_ in enumerate(times) if time_.module == args.module)
+    total = times[end]
+    # imports of the module are listed right before it, one level deeper
+    start = end
+    while start > 0 and times[start - 1].depth > total.depth:
+        start -= 1
+    direct = [time_ for time_ in times[start:end] if time_.depth == total.depth + 1]
+    print(f"{args.module} imported in {total.cumulative / 1000:.1f} ms\n")
+    print("{:>10} {:>10}  {}".format("self ms", "total ms", "module"))
+    # slowest first
+    for time_ in sorted(direct, key=lambda time_: -time_.cumulative)[: args.top]:
+        print(
+            f"{time_.self_time / 1000:>10.1f} {time_.cumulative / 1000:>10.1f}"
+            f"  {time_.module}"
+        )
+
+    imported = {time_.module.split(".")[0] for time_ in times[start:end]}
+    heavy = [module for module in HEAVY_MODULES if module in imported]
+    print(f"\nHeavy modules imported: {', '.join(heavy) or 'none'}")
+    if args.strict and heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Tests for the analyzer of texts."""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from zippy.pipeline.features.analyzer import get_analyzer, load_stop_words
+
+text = pytest.importorskip("sklearn.feature_extraction.text")
+
+TEXTS = [
+    "Suit up! It's going to be LEGEN... wait for it... DARY!",
+    "Please send the report by tomorrow, the report is due.",
+    "Réunion à 10h: café & croissants",
+    "a b c",
+]
+
+
+def fit_count_vectorizer(texts):
+    """Return terms and counts found by a vectorizer fitted on the texts."""
+    vectorizer = text.CountVectorizer(stop_words=list(load_stop_words("english")))
+    counts = vectorizer.fit_transform(texts).toarray()
+    return pd.DataFrame(counts, columns=list(vectorizer.get_feature_names_out()))
+
+
+@pytest.mark.parametrize("texts", [[document] for document in TEXTS[:3]] + [TEXTS])
+def test_terms_like_count_vectorizer(texts):
+    """Test that terms and their counts are the same as with a fitted vectorizer."""
+    expected = fit_count_vectorizer(texts)
+    analyzer = get_analyzer()
+
+    assert analyzer.vocabulary(texts) == list(expected.columns)
+    pd.testing.assert_frame_equal(analyzer.term_matrix(texts), expected)
+
+
+@pytest.mark.parametrize("texts", [["a b c"], ["the and of"], [""], [np.nan]])
+def test_no_terms_raise_like_count_vectorizer(texts):
+    """Test that texts without terms raise the error the callers expect."""
+    with pytest.raises(ValueError):
+        fit_count_vectorizer(texts)
+    with pytest.raises(ValueError):
+        get_analyzer().vocabulary(texts)
+    with pytest.raises(ValueError):
+        get_analyzer().term_matrix(texts)
+
+
+def test_shared_by_threads():
+    """Test that threads using the analyzer at once get their own terms."""
+    analyzer = get_analyzer()
+    texts = TEXTS[:3] * 200
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        counts = list(executor.map(analyzer.counts, texts))
+
+    assert counts == analyzer.counts_batch(texts)
+    assert counts[1]["report"] == 2
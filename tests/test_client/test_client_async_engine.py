@@ -0,0 +1,178 @@
+"""Test asyncio engine for mailboxes."""
+# pylint: disable=redefined-outer-name
+import asyncio
+import logging
+import threading
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from imapclient import IMAPClient
+
+from zippy.client.async_engine import MailboxEngine
+from zippy.client.main import EmailAuthUser, ProcessedMessage
+from zippy.client.pool import IMAPConnectionPool
+from zippy.utils.metrics import Metrics
+
+USER1 = EmailAuthUser("test1@localhost.org", "test1")
+USER2 = EmailAuthUser("test2@localhost.org", "test2")
+
+
+def make_client(uids):
+    """Return mocked client with given unprocessed mails."""
+    client = MagicMock(IMAPClient)
+    client.search.return_value = uids
+    client.fetch.side_effect = lambda fetch_uids, data: {
+        uid: {b"RFC822": f"Subject: mail {uid}\r\n\r\nbody".encode()}
+        for uid in fetch_uids
+    }
+    return client
+
+
+@pytest.fixture
+def clients():
+    """Mocked clients of users."""
+    return {
+        USER1.email_address: make_client([3, 1, 2]),
+        USER2.email_address: make_client([7]),
+    }
+
+
+@pytest.fixture
+def engine(clients):
+    """Engine using mocked clients."""
+    pool = IMAPConnectionPool(
+        lambda user: clients[user.email_address],
+        host="localhost.org",
+        logger=MagicMock(logging.Logger),
+    )
+    engine = MailboxEngine([USER1, USER2], pool, logger=MagicMock(logging.Logger))
+    yield engine
+    engine.shutdown()
+
+
+def run(coroutine):
+    """Run coroutine on a new event loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def test_engine_keeps_order_of_mails_per_user(engine, clients):
+    """Test that mails are ranked, acted and trained on in fetched order."""
+    events = []
+
+    def rank(uid, email_message):
+        events.append(("rank", uid))
+        return ProcessedMessage({}, uid, False, False)
+
+    def act(client, processed_msgs, logger):  # pylint: disable=unused-argument
+        events.append(("act", list(processed_msgs)))
+
+    def train(processed_msgs):
+        events.append(("train", list(processed_msgs)))
+
+    with patch("zippy.client.main.rank_mail", side_effect=rank), patch(
+        "zippy.client.main.apply_actions", side_effect=act
+    ), patch("zippy.client.async_engine.online_train_all", side_effect=train):
+        assert run(engine.run_once()) == [True, True]
+
+    user1_events = [event for event in events if event[-1] != 7 and event[-1] != [7]]
+    assert user1_events == [
+        ("rank", 3),
+        ("rank", 1),
+        ("rank", 2),
+        ("act", [3, 1, 2]),
+        ("train", [3, 1, 2]),
+    ]
+    assert ("train", [7]) in events
+    clients[USER1.email_address].fetch.assert_called_once_with([3, 1, 2], [b"RFC822"])
+
+
+def test_engine_processes_users_concurrently(engine, clients):
+    """Test that a slow mailbox does not hold up the other mailboxes."""
+    user2_done = threading.Event()
+
+    def slow_fetch(uids, data):  # pylint: disable=unused-argument
+        # completes only if mailbox of the second user is processed meanwhile
+        assert user2_done.wait(5)
+        return {}
+
+    clients[USER1.email_address].fetch.side_effect = slow_fetch
+
+    def train(processed_msgs):
+        if 7 in processed_msgs:
+            user2_done.set()
+
+    with patch(
+        "zippy.client.main.rank_mail",
+        return_value=ProcessedMessage({}, 0, False, False),
+    ), patch("zippy.client.main.apply_actions"), patch(
+        "zippy.client.async_engine.online_train_all", side_effect=train
+    ):
+        run(engine.run_once())
+
+    assert user2_done.is_set()
+
+
+def test_engine_discards_broken_session(engine, clients):
+    """Test that session is not reused after connection error."""
+    clients[USER2.email_address].search.side_effect = OSError("broken pipe")
+
+    with patch(
+        "zippy.client.main.rank_mail",
+        return_value=ProcessedMessage({}, 0, False, False),
+    ), patch("zippy.client.main.apply_actions"), patch(
+        "zippy.client.async_engine.online_train_all"
+    ):
+        assert run(engine.run_once()) == [True, False]
+
+    clients[USER2.email_address].logout.assert_called_once_with()
+    assert len(engine.pool) == 1
+
+
+def test_engine_trains_chunk_by_chunk(engine, clients):
+    """Test that each chunk is acted and trained on before next is fetched."""
+    engine.chunk_size = 2
+    events = []
+
+    with patch(
+        "zippy.client.main.rank_mail",
+        side_effect=lambda uid, msg: ProcessedMessage({}, uid, False, False),
+    ), patch(
+        "zippy.client.main.apply_actions",
+        side_effect=lambda client, msgs, logger: events.append(("act", list(msgs))),
+    ), patch(
+        "zippy.client.async_engine.online_train_all",
+        side_effect=lambda msgs: events.append(("train", list(msgs))),
+    ):
+        engine.users = [USER1]
+        assert run(engine.run_once()) == [True]
+
+    assert events == [
+        ("act", [3, 1]),
+        ("train", [3, 1]),
+        ("act", [2]),
+        ("train", [2]),
+    ]
+
+
+def test_engine_times_stages_of_mails(engine):
+    """Test that stages of the engine are timed like those of the client."""
+    engine.chunk_size = 2
+    metrics = Metrics(enabled=True, logger=MagicMock(logging.Logger))
+    with patch("zippy.client.main.METRICS", metrics), patch(
+        "zippy.client.main.rank_mail",
+        side_effect=lambda uid, msg: ProcessedMessage({}, uid, False, False),
+    ), patch("zippy.client.main.apply_actions"), patch(
+        "zippy.client.async_engine.online_train_all"
+    ):
+        engine.users = [USER1]
+        assert run(engine.run_once()) == [True]
+
+    summaries = metrics.summaries()
+    for stage in ("mail.fetch", "mail.rank", "mail.act"):
+        assert summaries[stage].count == 2
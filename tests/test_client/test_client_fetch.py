@@ -0,0 +1,136 @@
+"""Test fetching emails from the server."""
+import base64
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from imapclient import IMAPClient
+from imapclient.response_types import BodyData
+
+from zippy.client import fetch
+from zippy.pipeline.data.parse_email import get_text_from_email
+
+HEADERS = (
+    b"From: test1@email.com\r\n"
+    b"To: test2@email.com\r\n"
+    b"Subject: Suit up, Ted.\r\n"
+    b"Message-ID: <id1@email.com>\r\n\r\n"
+)
+HEADERS_KEY = b"BODY[HEADER.FIELDS (FROM TO SUBJECT DATE MESSAGE-ID)]"
+
+TEXT = b"It's going to be legen, wait for it, dary. Legendary!"
+
+PLAIN = BodyData.create(
+    (b"TEXT", b"PLAIN", (b"CHARSET", b"us-ascii"), None, None, b"7BIT", 53, 1)
+)
+WITH_ATTACHMENT = BodyData.create(
+    (
+        (
+            (b"TEXT", b"PLAIN", (b"CHARSET", b"utf-8"), None, None, b"7BIT", 53, 1),
+            (b"TEXT", b"HTML", (b"CHARSET", b"utf-8"), None, None, b"7BIT", 99, 2),
+            b"ALTERNATIVE",
+        ),
+        (b"APPLICATION", b"PDF", (b"NAME", b"a.pdf"), None, None, b"BASE64", 10 ** 7),
+        (
+            b"TEXT",
+            b"PLAIN",
+            (b"FORMAT", b"flowed", b"CHARSET", b"utf-8"),
+            None,
+            None,
+            b"BASE64",
+            40,
+            1,
+        ),
+        b"MIXED",
+    )
+)
+
+
+def test_find_text_parts_of_single_part_email():
+    """Test body of non-multipart email is the first section."""
+    assert fetch.find_text_parts(PLAIN) == [fetch.TextPart("1", "7bit", "us-ascii", 53)]
+
+
+def test_find_text_parts_skips_attachments_and_html():
+    """Test only text/plain sections are found, including nested ones."""
+    assert fetch.find_text_parts(WITH_ATTACHMENT) == [
+        fetch.TextPart("1.1", "7bit", "utf-8", 53),
+        fetch.TextPart("3", "base64", "utf-8", 40),
+    ]
+
+
+def test_plan_sections_within_limit():
+    """Test that number of bytes fetched never exceeds the limit."""
+    parts = fetch.find_text_parts(WITH_ATTACHMENT)
+    assert fetch.plan_sections(parts, 1000) == (("1.1", 53), ("3", 40))
+    assert fetch.plan_sections(parts, 60) == (("1.1", 53), ("3", 7))
+    assert fetch.plan_sections(parts, 53) == (("1.1", 53),)
+    assert fetch.plan_sections(parts, 0) == ()
+
+
+def test_decode_truncated_base64_text():
+    """Test that base64 cut in the middle of a quantum is decoded."""
+    part = fetch.TextPart("1", "base64", "utf-8", 100)
+    encoded = base64.encodebytes("Legendary ✓".encode())
+    assert fetch.decode_text(encoded, part) == "Legendary ✓"
+    assert fetch.decode_text(encoded[:10], part) == "Legend"
+
+
+def test_fetch_partial_fetches_only_text_sections():
+    """Test that only headers and text/plain sections are fetched."""
+    client = MagicMock(IMAPClient)
+    encoded = base64.b64encode(b"Suit up!")
+    client.fetch.side_effect = [
+        {
+            1: {b"BODYSTRUCTURE": PLAIN, HEADERS_KEY: HEADERS},
+            2: {b"BODYSTRUCTURE": WITH_ATTACHMENT, HEADERS_KEY: HEADERS},
+        },
+        {1: {b"BODY[1]<0>": TEXT}},
+        {2: {b"BODY[1.1]<0>": TEXT, b"BODY[3]<0>": encoded}},
+    ]
+
+    messages = fetch.fetch_partial(client, [1, 2])
+
+    assert client.fetch.call_args_list[0][0] == (
+        [1, 2],
+        [b"BODYSTRUCTURE", b"BODY.PEEK" + HEADERS_KEY[4:]],
+    )
+    assert client.fetch.call_args_list[1][0] == ([1], [b"BODY.PEEK[1]<0.53>"])
+    assert client.fetch.call_args_list[2][0] == (
+        [2],
+        [b"BODY.PEEK[1.1]<0.53>", b"BODY.PEEK[3]<0.40>"],
+    )
+
+    assert messages[1]["Subject"] == "Suit up, Ted."
+    assert messages[1]["Message-ID"] == "<id1@email.com>"
+    assert get_text_from_email(messages[1]) == TEXT.decode().lower()
+    assert get_text_from_email(messages[2]) == (TEXT + b"Suit up!").decode().lower()
+
+
+def test_fetch_partial_groups_emails_with_same_structure():
+    """Test that emails with same text sections are fetched in one command."""
+    client = MagicMock(IMAPClient)
+    client.fetch.side_effect = [
+        {uid: {b"BODYSTRUCTURE": PLAIN, HEADERS_KEY: HEADERS} for uid in (1, 2, 3)},
+        {uid: {b"BODY[1]<0>": TEXT} for uid in (1, 2, 3)},
+    ]
+
+    messages = fetch.fetch_partial(client, [1, 2, 3], max_text_bytes=10)
+
+    assert client.fetch.call_count == 2
+    assert client.fetch.call_args_list[1][0] == ([1, 2, 3], [b"BODY.PEEK[1]<0.10>"])
+    assert list(messages) == [1, 2, 3]
+
+
+def test_get_fetcher():
+    """Test fetcher is selected from config."""
+    assert fetch.get_fetcher({}) is fetch.fetch_full
+    assert fetch.get_fetcher({"fetch_mode": "full"}) is fetch.fetch_full
+
+    fetcher = fetch.get_fetcher({"fetch_mode": "partial", "max_text_bytes": 10})
+    assert fetcher.func is fetch.fetch_partial
+    assert fetcher.keywords == {"max_text_bytes": 10}
+
+    with pytest.raises(ValueError):
+        fetch.get_fetcher({"fetch_mode": "everything"})
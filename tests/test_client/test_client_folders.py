@@ -0,0 +1,77 @@
+"""Test registry of folders of the sessions."""
+# pylint: disable=redefined-outer-name
+import logging
+
+from unittest.mock import MagicMock, call
+
+import pytest
+
+from imapclient import IMAPClient
+from imapclient.exceptions import IMAPClientError
+
+from zippy.client.folders import FolderRegistry, is_trycreate
+
+FOLDERS = [((b"\\HasNoChildren",), b".", "INBOX"), ((), b".", "INBOX.Important")]
+
+
+@pytest.fixture
+def client():
+    """Session with the inbox and the important folder."""
+    client = MagicMock(IMAPClient)
+    client.list_folders.return_value = FOLDERS
+    return client
+
+
+@pytest.fixture
+def registry():
+    """Empty registry."""
+    return FolderRegistry()
+
+
+def test_only_missing_folders_are_created(registry, client):
+    """Test that folders are listed once and only missing ones are created."""
+    logger = MagicMock(logging.Logger)
+    folders = ["INBOX.Important", "INBOX.Urgent"]
+
+    assert registry.ensure(client, folders, logger) == ["INBOX.Urgent"]
+    assert registry.ensure(client, folders, logger) == []
+
+    client.list_folders.assert_called_once_with()
+    client.create_folder.assert_called_once_with("INBOX.Urgent")
+
+
+def test_sessions_are_listed_separately(registry, client):
+    """Test that folders of one session are not used for another."""
+    other_client = MagicMock(IMAPClient)
+    other_client.list_folders.return_value = []
+
+    assert "INBOX" in registry.folders(client)
+    assert registry.folders(other_client) == set()
+
+
+def test_move_creates_deleted_folder(registry, client):
+    """Test that folder is created again when the move asks for it."""
+    logger = MagicMock(logging.Logger)
+    registry.ensure(client, ["INBOX.Important"], logger)
+    client.list_folders.return_value = FOLDERS[:1]
+    client.move.side_effect = [IMAPClientError("[TRYCREATE] No folder"), None]
+
+    registry.move(client, [1, 2], "INBOX.Important", logger)
+
+    client.create_folder.assert_called_once_with("INBOX.Important")
+    assert client.move.call_args_list == [call([1, 2], "INBOX.Important")] * 2
+    assert client.list_folders.call_count == 2
+
+
+def test_move_raises_other_errors(registry, client):
+    """Test that only TRYCREATE failures are retried."""
+    client.move.side_effect = IMAPClientError("Mailbox is read-only")
+    with pytest.raises(IMAPClientError):
+        registry.move(client, [1], "INBOX.Important", MagicMock(logging.Logger))
+    client.create_folder.assert_not_called()
+
+
+def test_is_trycreate():
+    """Test detection of TRYCREATE response code."""
+    assert is_trycreate(IMAPClientError("move failed: [TRYCREATE] Mailbox"))
+    assert not is_trycreate(IMAPClientError("move failed: [NONEXISTENT]"))
@@ -0,0 +1,152 @@
+"""Test push mode using IMAP IDLE."""
+# pylint: disable=redefined-outer-name
+import logging
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from imapclient import IMAPClient
+
+from zippy.client.idle import MailboxWatcher, has_new_mails, mailbox_state
+from zippy.client.main import EmailAuthUser
+from zippy.client.pool import IMAPConnectionPool
+
+USER = EmailAuthUser("test1@localhost.org", "test1")
+
+
+@pytest.fixture
+def client():
+    """Mocked logged in client."""
+    return MagicMock(IMAPClient)
+
+
+@pytest.fixture
+def pool(client):
+    """Pool that always returns the mocked client."""
+    return IMAPConnectionPool(
+        lambda user: client, host="localhost.org", logger=MagicMock(logging.Logger)
+    )
+
+
+def test_has_new_mails():
+    """Test only EXISTS response is considered as new mail."""
+    assert has_new_mails([(3, b"EXISTS"), (1, b"RECENT")])
+    assert not has_new_mails([(b"OK", b"Still here")])
+    assert not has_new_mails([(2, b"EXPUNGE")])
+    assert not has_new_mails([])
+
+
+def test_watcher_runs_handler_on_new_mails(client, pool):
+    """Test that handler runs on start and after EXISTS notification."""
+    client.has_capability.return_value = True
+    handler = MagicMock()
+    watcher = MailboxWatcher(USER, pool, handler, logger=MagicMock(logging.Logger))
+
+    def notify(timeout):  # pylint: disable=unused-argument
+        if handler.call_count > 1:
+            watcher.stop()
+            return []
+        return [(1, b"EXISTS")]
+
+    client.idle_check.side_effect = notify
+    watcher.run()
+
+    assert watcher.supports_idle
+    assert handler.call_count == 2
+    handler.assert_called_with(client, USER)
+    assert client.idle.call_count == client.idle_done.call_count == 2
+    client.select_folder.assert_called_with("INBOX", readonly=True)
+
+
+def test_watcher_runs_handler_on_changed_status(client, pool):
+    """Test that mails reported by SELECT, not by IDLE, are processed."""
+    client.has_capability.return_value = True
+    statuses = [
+        {b"EXISTS": 1, b"UIDNEXT": 2},
+        # arrived while the handler ran, before IDLE was issued again
+        {b"EXISTS": 2, b"UIDNEXT": 3},
+        # moved away by the handler
+        {b"EXISTS": 0, b"UIDNEXT": 3},
+    ]
+    client.select_folder.side_effect = lambda folder, readonly: statuses[
+        min(client.select_folder.call_count, len(statuses)) - 1
+    ]
+    handler = MagicMock()
+    watcher = MailboxWatcher(
+        USER, pool, handler, idle_timeout=-1, logger=MagicMock(logging.Logger)
+    )
+
+    def no_response(timeout):  # pylint: disable=unused-argument
+        if client.idle_check.call_count > 1:
+            watcher.stop()
+        return []
+
+    client.idle_check.side_effect = no_response
+    watcher.run()
+
+    assert handler.call_count == 2
+    assert client.idle.call_count == 2
+
+
+def test_mailbox_state():
+    """Test that UIDNEXT is preferred over EXISTS."""
+    assert mailbox_state({b"EXISTS": 3, b"UIDNEXT": 7}) == 7
+    assert mailbox_state({b"EXISTS": 3}) == 3
+
+
+def test_watcher_reissues_idle_after_timeout(client, pool):
+    """Test that IDLE is renewed without running handler if nothing arrived."""
+    client.has_capability.return_value = True
+    handler = MagicMock()
+    watcher = MailboxWatcher(
+        USER, pool, handler, idle_timeout=-1, logger=MagicMock(logging.Logger)
+    )
+
+    def no_response(timeout):  # pylint: disable=unused-argument
+        if client.idle_check.call_count > 2:
+            watcher.stop()
+        return []
+
+    client.idle_check.side_effect = no_response
+    watcher.run()
+
+    handler.assert_called_once_with(client, USER)
+    assert client.idle.call_count == 3
+
+
+def test_watcher_falls_back_to_polling(client, pool):
+    """Test that mailbox is polled if server does not support IDLE."""
+    client.has_capability.return_value = False
+    watcher = MailboxWatcher(
+        USER, pool, MagicMock(), poll_interval=0, logger=MagicMock(logging.Logger)
+    )
+
+    def handler(_client, _user):
+        if watcher.handler.call_count > 2:
+            watcher.stop()
+
+    watcher.handler = MagicMock(side_effect=handler)
+    watcher.run()
+
+    assert watcher.supports_idle is False
+    assert watcher.handler.call_count == 3
+    client.idle.assert_not_called()
+
+
+def test_watcher_reconnects_on_connection_error(pool):
+    """Test that broken session is replaced and watching continues."""
+    broken_client = MagicMock(IMAPClient)
+    broken_client.has_capability.side_effect = OSError("broken pipe")
+    working_client = MagicMock(IMAPClient)
+    working_client.has_capability.return_value = False
+    pool.connect = MagicMock(side_effect=[broken_client, working_client])
+
+    watcher = MailboxWatcher(
+        USER, pool, MagicMock(), retry_delay=0, logger=MagicMock(logging.Logger)
+    )
+    watcher.handler.side_effect = lambda client, user: watcher.stop()
+    watcher.run()
+
+    broken_client.logout.assert_called_once_with()
+    watcher.handler.assert_called_once_with(working_client, USER)
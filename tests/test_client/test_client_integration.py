@@ -22,10 +22,10 @@ from zippy.client.main import (
     ProcessedMessage,
     create_folder_if_not_exists,
     get_client,
-    mark_processed,
+    mark_all_processed,
     process_mails,
     retrieve_new_emails,
-    shift_mail,
+    shift_mails,
 )
 
 pytestmark = pytest.mark.skipif(
@@ -190,22 +190,26 @@ def test_get_server_socket_error(config: dict, logger, caplog):
 
 
 def test_flag_happy_path(logged_in_client: IMAPClient, random_mail, logger, caplog):
-    mark_processed(logged_in_client, random_mail, logger)
+    logged_in_client.select_folder(EmailFolders.INBOX)
+    assert mark_all_processed(logged_in_client, [random_mail], logger) == [random_mail]
 
     assert random_mail in logged_in_client.get_flags(random_mail)
     assert FLAG_TO_CHECK in logged_in_client.get_flags(random_mail).get(random_mail)
-    assert f"Flag added to {random_mail}\n" in caplog.text
+    assert f"Flag added to [{random_mail}]\n" in caplog.text
 
 
 def test_flag_if_already_exists(
     logged_in_client: IMAPClient, flagged_random_mail, logger, caplog
 ):
-    mark_processed(logged_in_client, flagged_random_mail, logger)
+    logged_in_client.select_folder(EmailFolders.INBOX)
+    assert mark_all_processed(logged_in_client, [flagged_random_mail], logger) == [
+        flagged_random_mail
+    ]
 
     assert FLAG_TO_CHECK in logged_in_client.get_flags(flagged_random_mail).get(
         flagged_random_mail
     )
-    assert not caplog.text
+    assert "could not be flagged" not in caplog.text
 
 
 def test_flag_if_already_exists_with_not_existing_mail_id(
@@ -214,10 +218,11 @@ def test_flag_if_already_exists_with_not_existing_mail_id(
 
     mail_uid = random_mail + 10
 
-    mark_processed(logged_in_client, mail_uid, logger)
+    logged_in_client.select_folder(EmailFolders.INBOX)
+    assert mark_all_processed(logged_in_client, [mail_uid], logger) == []
 
     assert not logged_in_client.get_flags(mail_uid)
-    assert f"Mail with uid: {mail_uid} does not exist" in caplog.text
+    assert f"Mails (uids: [{mail_uid}]) could not be flagged." in caplog.text
 
 
 def test_create_folder_if_not_exists_happy_path(
@@ -249,15 +254,15 @@ def test_email_shift(
 ):
     next_uid = logged_in_client.select_folder(random_folder, readonly=True)[b"UIDNEXT"]
 
-    shift_mail(
-        client=logged_in_client,
-        uid=random_mail,
-        source=EmailFolders.INBOX,
-        destination=random_folder,
-        logger=logger,
-    )
+    logged_in_client.select_folder(EmailFolders.INBOX)
+    assert shift_mails(logged_in_client, [random_mail], random_folder, logger) == [
+        random_mail
+    ]
 
-    assert f"Email (uid: {random_mail}) moved to {random_folder} folder." in caplog.text
+    assert (
+        f"Emails (uids: [{random_mail}]) moved to {random_folder} folder."
+        in caplog.text
+    )
 
     logged_in_client.select_folder(random_folder, readonly=True)
     assert next_uid in logged_in_client.search("ALL")
@@ -272,23 +277,17 @@ def test_email_shift_not_existing_folder(
     logged_in_client: IMAPClient, random_mail, logger, teardown, caplog
 ):
     not_existing_folder = "random-123322"
-    shift_mail(
-        client=logged_in_client,
-        uid=random_mail,
-        source=EmailFolders.INBOX,
-        destination=not_existing_folder,
-        logger=logger,
-    )
+    teardown.append(lambda client: client.delete_folder(not_existing_folder))
+    logged_in_client.select_folder(EmailFolders.INBOX)
+    assert shift_mails(
+        logged_in_client, [random_mail], not_existing_folder, logger
+    ) == [random_mail]
 
-    assert (
-        f"Failed email (uid: {random_mail}) to move to {not_existing_folder} folder:"
-        in caplog.text
-    )
+    assert f"Folder {not_existing_folder} is missing, creating it again." in caplog.text
 
-    assert not logged_in_client.folder_exists(not_existing_folder)
-    # check that message exists in the inbox
+    assert logged_in_client.folder_exists(not_existing_folder)
     logged_in_client.select_folder(EmailFolders.INBOX, readonly=True)
-    assert random_mail in logged_in_client.search("ALL")
+    assert random_mail not in logged_in_client.search("ALL")
 
 
 def test_process_mails_happy_path_important(
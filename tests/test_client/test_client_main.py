@@ -1,11 +1,19 @@
 """Test client for main client."""
+
+import email
 import logging
 
-from unittest.mock import MagicMock, call
+from unittest.mock import MagicMock, call, patch
 
+import pandas as pd
 import pytest
 
+from imapclient.exceptions import IMAPClientError
+
 from zippy.client import main
+from zippy.client.fetch import MESSAGE_FORMAT
+from zippy.client.rank_cache import RankCache
+from zippy.client.training_ledger import TrainingLedger
 
 
 def test_email_auth_user_repr():
@@ -130,3 +138,266 @@ def test_with_logging():
 
     assert mocked_logger.info.call_args_list == calls
     assert mocked_logger.info.call_count == 2
+
+
+def test_main_borrows_session_from_pool():
+    """Test main uses pooled session instead of connecting again."""
+    pool = MagicMock()
+    client = pool.session.return_value.__enter__.return_value
+    user = main.EmailAuthUser("test@email.com", "testpwd")
+    logger = MagicMock(logging.Logger)
+
+    with patch("zippy.client.main.get_client") as mocked_get_client, patch(
+        "zippy.client.main.process_new_emails", return_value=2
+    ) as mocked_process:
+        main.main({"fetch_chunk_size": 10}, user, logger=logger, pool=pool)
+
+    mocked_get_client.assert_not_called()
+    pool.session.assert_called_once_with(user)
+    mocked_process.assert_called_once_with(
+        client,
+        user,
+        logger,
+        fetch=main.fetch_full,
+        chunk_size=10,
+        sync_store=None,
+        batch_size=main.DEFAULT_INTENT_BATCH_SIZE,
+    )
+
+
+def test_process_mails_batches_actions_by_destination():
+    """Test that mails are moved and flagged with one command per destination."""
+    client = MagicMock()
+    uids = [1, 2, 3, 4, 5]
+    client.fetch.return_value = {
+        uid: {MESSAGE_FORMAT: b"Subject: test\r\n\r\nbody"} for uid in uids
+    }
+    client.add_flags.return_value = {4: (main.FLAG_TO_CHECK,)}
+    logger = MagicMock(logging.Logger)
+    ranks = {
+        1: main.ProcessedMessage({}, 1, True, False),
+        2: main.ProcessedMessage({}, 2, True, True),
+        3: main.ProcessedMessage({}, 3, True, False),
+        4: main.ProcessedMessage({}, 4, False, False),
+        5: main.ProcessedMessage({}, 5, False, True),
+    }
+
+    with patch("zippy.client.main.rank_mail", side_effect=lambda uid, msg: ranks[uid]):
+        processed_msgs = main.process_mails(client, uids, logger)
+
+    assert processed_msgs == ranks
+    assert client.move.call_args_list == [
+        call([1, 3], main.EmailFolders.IMPORTANT),
+        call([2], main.EmailFolders.URGENT),
+    ]
+    client.add_flags.assert_called_once_with([4, 5], [main.FLAG_TO_CHECK])
+    client.get_flags.assert_not_called()
+    logger.warning.assert_called_once_with(
+        "Mails (uids: %s) could not be flagged. Weights might get updated twice",
+        [5],
+    )
+    logger.info.assert_any_call("Flag added to %s", [4])
+
+
+def test_mark_all_processed_without_flagged_mails():
+    """Test that no flagged mails are logged if none could be flagged."""
+    client = MagicMock()
+    client.add_flags.return_value = {}
+    logger = MagicMock(logging.Logger)
+
+    main.mark_all_processed(client, [1, 2], logger)
+
+    logger.warning.assert_called_once()
+    logger.info.assert_not_called()
+
+
+def test_apply_actions_returns_handled_mails():
+    """Test that mails whose move or flag failed are left out."""
+    client = MagicMock()
+    client.move.side_effect = [IMAPClientError("move failed"), None]
+    client.add_flags.return_value = {4: (main.FLAG_TO_CHECK,)}
+    processed_msgs = {
+        1: main.ProcessedMessage({}, 1, True, False),
+        2: main.ProcessedMessage({}, 2, True, True),
+        4: main.ProcessedMessage({}, 4, False, False),
+        5: main.ProcessedMessage({}, 5, False, False),
+    }
+
+    handled = main.apply_actions(client, processed_msgs, MagicMock(logging.Logger))
+
+    assert handled == [2, 4]
+
+
+def test_apply_actions_without_mails():
+    """Test that no command is sent if nothing was processed."""
+    client = MagicMock()
+    main.apply_actions(client, {}, MagicMock(logging.Logger))
+    assert not client.method_calls
+
+
+@pytest.mark.parametrize(
+    "mode, engine",
+    [
+        (main.ASYNC_MODE, "zippy.client.async_engine.run_async"),
+        (main.PIPELINE_MODE, "zippy.client.pipeline.run_pipeline"),
+    ],
+)
+def test_run_client_runs_engine_of_mode(mode, engine):
+    """Test that workers of the supervisor can run every engine."""
+    config = {"mode": mode}
+    users = [main.EmailAuthUser("user@example.com", "password")]
+    with patch(engine) as run_engine, patch.object(main, "warm_up") as warm_up:
+        main.run_client(config, users)
+
+    run_engine.assert_called_once_with(config, users)
+    warm_up.assert_not_called()
+
+
+def test_warm_up_configures_components():
+    """Test that every component reads its own options of the config."""
+    config = {"metrics": True}
+    components = (
+        "INTENT_MODELS",
+        "WEIGHTS",
+        "METRICS",
+        "RANK_CACHE",
+        "TRAINING_LEDGER",
+    )
+    with patch.multiple(
+        main, **{name: MagicMock() for name in components}
+    ), patch.object(main, "get_analyzer"):
+        main.warm_up(config)
+        for name in components:
+            getattr(main, name).configure.assert_called_once_with(config)
+        main.INTENT_MODELS.get.assert_called_once_with()
+
+
+def test_iter_process_mails_in_chunks():
+    """Test that each chunk is fetched, ranked and acted on before the next."""
+    client = MagicMock()
+    events = []
+
+    def fetch(_client, uids):
+        events.append(("fetch", uids))
+        return {uid: f"mail {uid}" for uid in uids}
+
+    def rank(uid, _msg):
+        events.append(("rank", uid))
+        return main.ProcessedMessage({}, uid, False, False)
+
+    def act(_client, msgs, _logger):
+        events.append(("act", list(msgs)))
+        return list(msgs)
+
+    checkpoint = MagicMock(side_effect=lambda uids: events.append(("done", uids)))
+    with patch("zippy.client.main.rank_mail", side_effect=rank), patch(
+        "zippy.client.main.apply_actions", side_effect=act
+    ):
+        chunks = main.iter_process_mails(
+            client,
+            [1, 2, 3, 4, 5],
+            MagicMock(logging.Logger),
+            fetch=fetch,
+            chunk_size=2,
+            checkpoint=checkpoint,
+        )
+        assert list(next(chunks)) == [1, 2]
+        # nothing is fetched before the previous chunk is consumed
+        assert events[-1] == ("done", [1, 2])
+        assert [list(chunk) for chunk in chunks] == [[3, 4], [5]]
+
+    assert events == [
+        ("fetch", [1, 2]),
+        ("rank", 1),
+        ("rank", 2),
+        ("act", [1, 2]),
+        ("done", [1, 2]),
+        ("fetch", [3, 4]),
+        ("rank", 3),
+        ("rank", 4),
+        ("act", [3, 4]),
+        ("done", [3, 4]),
+        ("fetch", [5]),
+        ("rank", 5),
+        ("act", [5]),
+        ("done", [5]),
+    ]
+    assert client.select_folder.call_count == 3
+
+
+def test_process_and_train_trains_each_chunk():
+    """Test that weights are updated after every chunk."""
+    chunks = [{1: "processed 1", 2: "processed 2"}, {3: "processed 3"}]
+    with patch(
+        "zippy.client.main.iter_process_mails", return_value=iter(chunks)
+    ), patch("zippy.client.main.online_train_all") as mocked_train:
+        count = main.process_and_train(
+            MagicMock(), [1, 2, 3], MagicMock(logging.Logger), chunk_size=2
+        )
+
+    assert count == 3
+    assert mocked_train.call_args_list == [call(chunks[0]), call(chunks[1])]
+
+
+def test_chunked():
+    """Test that uids are split in chunks of given size."""
+    assert list(main.chunked([1, 2, 3], 2)) == [[1, 2], [3]]
+    assert list(main.chunked([1, 2, 3], None)) == [[1, 2, 3]]
+    assert list(main.chunked([], 2)) == []
+
+
+@pytest.mark.parametrize("batch_size", [None, 2])
+def test_rank_mails_reuses_cached_ranks(tmp_path, batch_size):
+    """Test that mails seen before are not ranked again."""
+    cache = RankCache(tmp_path, logger=MagicMock(logging.Logger))
+    messages = {
+        uid: email.message_from_bytes(
+            f"From: sender@localhost.org\r\nTo: test@localhost.org\r\n"
+            f"Message-ID: <{uid}@host>\r\nSubject: test {uid}\r\n\r\nbody".encode()
+        )
+        for uid in (1, 2)
+    }
+    ranked = []
+
+    def rank(message):
+        ranked.append(message["Message-ID"])
+        return [{}, len(message["Subject"]), True, False, 1.0]
+
+    with patch.object(main, "RANK_CACHE", cache), patch(
+        "zippy.client.main.rank_message", side_effect=rank
+    ), patch(
+        "zippy.client.main.rank_messages",
+        side_effect=lambda messages, _: [rank(message) for message in messages],
+    ), patch(
+        "zippy.client.main.get_logger"
+    ):
+        main.rank_mails({1: messages[1]}, batch_size)
+        processed_msgs = main.rank_mails(messages, batch_size)
+
+    assert ranked == ["<1@host>", "<2@host>"]
+    assert list(processed_msgs) == [1, 2]
+    assert [msg.rank for msg in processed_msgs.values()] == [6, 6]
+    assert processed_msgs[1].msg["Subject"][0] == "test 1"
+
+
+def test_online_train_all_trains_once(tmp_path):
+    """Test that mails trained on before are skipped."""
+    ledger = TrainingLedger(tmp_path, logger=MagicMock(logging.Logger))
+    processed_msgs = {
+        uid: main.ProcessedMessage(
+            pd.DataFrame({"To": ["test@localhost.org"], "Message-ID": [f"<{uid}@a>"]}),
+            uid,
+            False,
+            False,
+        )
+        for uid in (1, 2)
+    }
+
+    with patch.object(main, "TRAINING_LEDGER", ledger), patch(
+        "zippy.client.main.online_training"
+    ) as online_training, patch("zippy.client.main.get_logger"):
+        main.online_train_all({1: processed_msgs[1]})
+        main.online_train_all(processed_msgs)
+
+    assert [call_args[0][1] for call_args in online_training.call_args_list] == [1, 2]
+    ledger.close()
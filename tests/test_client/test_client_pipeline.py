@@ -0,0 +1,175 @@
+"""Test staged pipeline for mailboxes."""
+# pylint: disable=redefined-outer-name
+import logging
+import threading
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from imapclient import IMAPClient
+
+from zippy.client.main import EmailAuthUser, ProcessedMessage
+from zippy.client.pipeline import ACT, FETCH, MailPipeline
+from zippy.client.pool import IMAPConnectionPool
+from zippy.utils.metrics import Metrics
+
+USER1 = EmailAuthUser("test1@localhost.org", "test1")
+USER2 = EmailAuthUser("test2@localhost.org", "test2")
+
+
+def make_client(uids):
+    """Return mocked client with given unprocessed mails."""
+    client = MagicMock(IMAPClient)
+    client.search.return_value = uids
+    client.fetch.side_effect = lambda fetch_uids, data: {
+        uid: {b"RFC822": f"Subject: mail {uid}\r\n\r\nbody".encode()}
+        for uid in fetch_uids
+    }
+    return client
+
+
+@pytest.fixture
+def clients():
+    """Mocked clients of users."""
+    return {
+        USER1.email_address: make_client([3, 1, 2, 5, 4]),
+        USER2.email_address: make_client([7]),
+    }
+
+
+@pytest.fixture
+def pool(clients):
+    """Pool of mocked clients."""
+    return IMAPConnectionPool(
+        lambda user: clients[user.email_address],
+        host="localhost.org",
+        logger=MagicMock(logging.Logger),
+    )
+
+
+@pytest.fixture
+def pipeline(pool):
+    """Running pipeline passing two mails from stage to stage."""
+    pipeline = MailPipeline(
+        pool,
+        chunk_size=2,
+        workers={FETCH: 2, ACT: 2},
+        queue_size=1,
+        logger=MagicMock(logging.Logger),
+    )
+    pipeline.start()
+    yield pipeline
+    pipeline.stop()
+
+
+def rank(uid, email_message):
+    """Rank mail by its uid."""
+    assert email_message["Subject"] == f"mail {uid}"
+    return ProcessedMessage({}, uid, False, False)
+
+
+def test_pipeline_keeps_order_of_mails_per_user(pipeline):
+    """Test that chunks of a user pass all stages in fetched order."""
+    events = []
+
+    def act(client, processed_msgs, logger):  # pylint: disable=unused-argument
+        events.append(("act", list(processed_msgs)))
+
+    def train(processed_msgs):
+        events.append(("train", list(processed_msgs)))
+
+    with patch("zippy.client.main.rank_mail", side_effect=rank), patch(
+        "zippy.client.main.apply_actions", side_effect=act
+    ), patch("zippy.client.pipeline.online_train_all", side_effect=train):
+        assert pipeline.run_once([USER1, USER2]) == [True, True]
+
+    user1_events = [event for event in events if event[-1] != [7]]
+    assert [event for event in user1_events if event[0] == "act"] == [
+        ("act", [3, 1]),
+        ("act", [2, 5]),
+        ("act", [4]),
+    ]
+    assert [event for event in user1_events if event[0] == "train"] == [
+        ("train", [3, 1]),
+        ("train", [2, 5]),
+        ("train", [4]),
+    ]
+    assert ("train", [7]) in events
+    assert len(pipeline.pool) == 2
+
+
+def test_pipeline_overlaps_stages(pipeline, clients):
+    """Test that next chunk is fetched while the previous one is trained on."""
+    fetched = threading.Event()
+    fetch = clients[USER1.email_address].fetch.side_effect
+
+    def fetch_and_notify(uids, data):
+        if uids == [2, 5]:
+            fetched.set()
+        return fetch(uids, data)
+
+    clients[USER1.email_address].fetch.side_effect = fetch_and_notify
+
+    def train(processed_msgs):
+        if 3 in processed_msgs:
+            # completes only if the next chunk is fetched meanwhile
+            assert fetched.wait(5)
+
+    with patch("zippy.client.main.rank_mail", side_effect=rank), patch(
+        "zippy.client.main.apply_actions"
+    ), patch("zippy.client.pipeline.online_train_all", side_effect=train):
+        assert pipeline.run_once([USER1]) == [True]
+
+
+def test_pipeline_applies_backpressure(pipeline, clients):
+    """Test that fetching waits for a slow stage instead of running ahead."""
+    clients[USER1.email_address].search.return_value = list(range(1, 41))
+    release = threading.Event()
+
+    def train(processed_msgs):  # pylint: disable=unused-argument
+        assert release.wait(5)
+
+    with patch("zippy.client.main.rank_mail", side_effect=rank), patch(
+        "zippy.client.main.apply_actions"
+    ), patch("zippy.client.pipeline.online_train_all", side_effect=train):
+        thread = threading.Thread(target=pipeline.run_once, args=([USER1],))
+        thread.start()
+        # wait for the queues to fill up
+        thread.join(0.5)
+        fetches = clients[USER1.email_address].fetch.call_count
+        release.set()
+        thread.join(5)
+
+    # a chunk in each queue and worker of the five stages, at most
+    assert fetches <= 10
+    assert clients[USER1.email_address].fetch.call_count == 20
+
+
+def test_pipeline_discards_broken_session(pipeline, clients):
+    """Test that failing chunk stops the cycle and closes the session."""
+    clients[USER1.email_address].fetch.side_effect = OSError("broken pipe")
+
+    with patch("zippy.client.main.rank_mail", side_effect=rank), patch(
+        "zippy.client.main.apply_actions"
+    ), patch("zippy.client.pipeline.online_train_all") as mocked_train:
+        assert pipeline.run_once([USER1, USER2]) == [False, True]
+
+    clients[USER1.email_address].logout.assert_called_once_with()
+    mocked_train.assert_called_once()
+    assert len(pipeline.pool) == 1
+
+
+def test_pipeline_times_stages_of_mails(pipeline):
+    """Test that stages of the pipeline are timed like those of the client."""
+    metrics = Metrics(enabled=True, logger=MagicMock(logging.Logger))
+    with patch("zippy.client.main.METRICS", metrics), patch(
+        "zippy.client.main.rank_mail", side_effect=rank
+    ), patch("zippy.client.main.apply_actions"), patch(
+        "zippy.client.pipeline.online_train_all"
+    ):
+        assert pipeline.run_once([USER1]) == [True]
+
+    summaries = metrics.summaries()
+    for stage in ("mail.fetch", "mail.rank", "mail.act"):
+        assert summaries[stage].count == 3
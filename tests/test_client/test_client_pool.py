@@ -0,0 +1,179 @@
+"""Test pool of IMAP sessions."""
+# pylint: disable=redefined-outer-name
+import logging
+import socket
+import threading
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from imapclient import IMAPClient
+from imapclient.exceptions import IMAPClientAbortError, IMAPClientError
+
+from zippy.client.main import EmailAuthUser
+from zippy.client.pool import IMAPConnectionPool
+
+
+@pytest.fixture
+def connect():
+    """Return fresh mocked client on every connect."""
+    return MagicMock(side_effect=lambda user: MagicMock(IMAPClient))
+
+
+@pytest.fixture
+def pool(connect):
+    """Pool with mocked connections."""
+    return IMAPConnectionPool(
+        connect,
+        host="localhost.org",
+        max_connections_per_host=2,
+        logger=MagicMock(logging.Logger),
+    )
+
+
+USER1 = EmailAuthUser("test1@localhost.org", "test1")
+USER2 = EmailAuthUser("test2@localhost.org", "test2")
+USER3 = EmailAuthUser("test3@localhost.org", "test3")
+
+
+def test_session_is_reused(pool, connect):
+    """Test that same session is returned on next borrow after NOOP check."""
+    with pool.session(USER1) as client:
+        first_client = client
+    with pool.session(USER1) as client:
+        assert client is first_client
+
+    assert connect.call_count == 1
+    first_client.noop.assert_called_once_with()
+    assert len(pool) == 1
+
+
+def test_stale_session_is_reconnected(pool, connect):
+    """Test that session failing NOOP is replaced with new one."""
+    with pool.session(USER1) as client:
+        stale_client = client
+    stale_client.noop.side_effect = IMAPClientError("connection lost")
+
+    with pool.session(USER1) as client:
+        assert client is not stale_client
+
+    assert connect.call_count == 2
+    stale_client.logout.assert_called_once_with()
+    assert len(pool) == 1
+
+
+def test_idle_session_is_reconnected_without_noop(pool, connect):
+    """Test that session idle for too long is not even checked."""
+    pool.max_idle_time = -1
+    with pool.session(USER1) as client:
+        old_client = client
+    with pool.session(USER1) as client:
+        assert client is not old_client
+
+    old_client.noop.assert_not_called()
+    assert connect.call_count == 2
+
+
+def test_session_discarded_on_connection_error(pool, connect):
+    """Test that broken session is closed and not given back to pool."""
+    with pytest.raises(OSError):
+        with pool.session(USER1) as client:
+            broken_client = client
+            raise OSError("broken pipe")
+
+    broken_client.logout.assert_called_once_with()
+    assert len(pool) == 0
+
+    with pool.session(USER1) as client:
+        assert client is not broken_client
+
+
+@pytest.mark.parametrize(
+    "error", [IMAPClientAbortError("socket error: EOF"), socket.timeout("timed out")]
+)
+def test_session_discarded_on_aborted_connection(pool, connect, error):
+    """Test that aborted and timed out sessions are not given back to pool."""
+    with pytest.raises(type(error)):
+        with pool.session(USER1):
+            raise error
+
+    assert len(pool) == 0
+    assert connect.call_count == 1
+
+
+def test_session_kept_on_failed_command(pool, connect):
+    """Test that a command answered with NO keeps the session."""
+    with pytest.raises(IMAPClientError):
+        with pool.session(USER1) as client:
+            kept_client = client
+            raise IMAPClientError("select failed: NO Mailbox does not exist")
+
+    with pool.session(USER1) as client:
+        assert client is kept_client
+    assert connect.call_count == 1
+
+
+def test_session_kept_on_other_errors(pool, connect):
+    """Test that errors unrelated to connection keeps session alive."""
+    with pytest.raises(ValueError):
+        with pool.session(USER1) as client:
+            kept_client = client
+            raise ValueError("ranking failed")
+
+    with pool.session(USER1) as client:
+        assert client is kept_client
+    assert connect.call_count == 1
+
+
+def test_failed_connect_frees_slot(pool, connect):
+    """Test that failing to connect does not leak a connection slot."""
+    connect.side_effect = OSError("could not connect")
+    with pytest.raises(OSError):
+        pool.acquire(USER1)
+    assert len(pool) == 0
+
+
+def test_least_recently_used_session_is_evicted_on_cap(pool, connect):
+    """Test that connections to the host never exceed the cap."""
+    with pool.session(USER1) as client:
+        client1 = client
+    with pool.session(USER2):
+        pass
+    with pool.session(USER3):
+        assert len(pool) == 2
+
+    client1.logout.assert_called_once_with()
+    assert connect.call_count == 3
+    assert len(pool) == 2
+
+
+def test_acquire_waits_for_free_slot(pool):
+    """Test that borrowing blocks when all connections are in use."""
+    client1 = pool.acquire(USER1)
+    pool.acquire(USER2)
+    acquired = threading.Event()
+
+    def borrow():
+        with pool.session(USER3):
+            acquired.set()
+
+    thread = threading.Thread(target=borrow)
+    thread.start()
+    assert not acquired.wait(0.1)
+
+    pool.release(USER1, client1)
+    thread.join(1)
+    assert acquired.is_set()
+    assert len(pool) == 2
+
+
+def test_close_all(pool):
+    """Test that all idle sessions are logged out."""
+    with pool.session(USER1) as client1, pool.session(USER2) as client2:
+        pass
+    pool.close_all()
+
+    client1.logout.assert_called_once_with()
+    client2.logout.assert_called_once_with()
+    assert len(pool) == 0
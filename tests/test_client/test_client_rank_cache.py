@@ -0,0 +1,134 @@
+"""Test reusing ranks of mails seen before."""
+# pylint: disable=redefined-outer-name
+import email
+import json
+import logging
+
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from zippy.client.rank_cache import CACHE_FILE, CachedRank, RankCache, message_key
+
+USER = "test@localhost.org"
+RANKED = CachedRank(3.5, True, False, 2.0)
+
+
+def get_message(message_id=None, subject="test"):
+    """Return mail to the user, with the Message-ID if given."""
+    headers = f"To: {USER}\r\nSubject: {subject}\r\n"
+    if message_id is not None:
+        headers += f"Message-ID: {message_id}\r\n"
+    return email.message_from_bytes(f"{headers}\r\nbody".encode())
+
+
+@pytest.fixture
+def cache(tmp_path):
+    """Cache in a temporary directory, written only when flushed."""
+    return RankCache(
+        tmp_path, max_size=2, flush_interval=3600, logger=MagicMock(logging.Logger)
+    )
+
+
+def test_message_key():
+    """Test that mails are identified by Message-ID, or by their content."""
+    key = message_key(get_message("<1@host>"))
+    assert key == f"{USER}\n<1@host>"
+    assert message_key(get_message("<1@host>", subject="other")) == key
+    assert message_key(get_message()) == message_key(get_message())
+    assert message_key(get_message()) != message_key(get_message(subject="other"))
+
+
+def test_cache_reuses_ranks(cache):
+    """Test that ranks are returned for the same mail only."""
+    assert cache.get(get_message("<1@host>")) is None
+
+    cache.put(get_message("<1@host>"), RANKED)
+
+    assert cache.get(get_message("<1@host>")) == RANKED
+    assert cache.get(get_message("<2@host>")) is None
+
+
+def test_cache_evicts_least_recently_used(cache):
+    """Test that mails not used for the longest time are forgotten first."""
+    cache.put(get_message("<1@host>"), RANKED)
+    cache.put(get_message("<2@host>"), RANKED)
+    cache.get(get_message("<1@host>"))
+
+    cache.put(get_message("<3@host>"), RANKED)
+
+    assert len(cache) == 2
+    assert cache.get(get_message("<2@host>")) is None
+    assert cache.get(get_message("<1@host>")) == RANKED
+
+
+def test_cache_forgets_expired_ranks(cache):
+    """Test that ranks older than the ttl are not reused."""
+    with patch("zippy.client.rank_cache.time.time", return_value=1000.0):
+        cache.put(get_message("<1@host>"), RANKED)
+    cache.ttl = 60
+
+    with patch("zippy.client.rank_cache.time.time", return_value=1059.0):
+        assert cache.get(get_message("<1@host>")) == RANKED
+    with patch("zippy.client.rank_cache.time.time", return_value=1061.0):
+        assert cache.get(get_message("<1@host>")) is None
+    assert len(cache) == 0
+
+
+def test_cache_is_persisted(cache, tmp_path):
+    """Test that ranks are written when flushed and read back in order."""
+    cache.put(get_message("<1@host>"), RANKED)
+    cache.put(get_message("<2@host>"), RANKED)
+    assert not (tmp_path / CACHE_FILE).exists()
+    cache.flush()
+
+    loaded = RankCache(tmp_path, max_size=2)
+    assert loaded.get(get_message("<1@host>")) == RANKED
+    loaded.put(get_message("<3@host>"), RANKED)
+    assert loaded.get(get_message("<2@host>")) is None
+
+
+def test_corrupted_cache_is_ignored(cache, tmp_path):
+    """Test that mails are ranked again if the file cannot be read."""
+    (tmp_path / CACHE_FILE).write_text("{not json")
+
+    assert cache.get(get_message("<1@host>")) is None
+    cache.put(get_message("<1@host>"), RANKED)
+    cache.flush()
+    assert len(json.loads((tmp_path / CACHE_FILE).read_text())) == 1
+
+
+def test_disabled_cache(tmp_path):
+    """Test that a cache without size keeps nothing and writes nothing."""
+    cache = RankCache(tmp_path, max_size=0)
+    cache.put(get_message("<1@host>"), RANKED)
+    cache.flush()
+
+    assert cache.get(get_message("<1@host>")) is None
+    assert not (tmp_path / CACHE_FILE).exists()
+
+
+def test_configure_cache(cache):
+    """Test that the time to live is configured in days."""
+    cache.configure({"rank_cache_size": 5, "rank_cache_ttl": 2})
+    assert cache.max_size == 5
+    assert cache.ttl == 2 * 24 * 60 * 60
+
+    with pytest.raises(ValueError):
+        cache.configure({"rank_cache_size": -1})
+    assert cache.max_size == 5
+
+
+def test_workers_share_cache(tmp_path):
+    """Test that caches writing the same file keep the mails of each other."""
+    workers = [RankCache(tmp_path, max_size=10) for _ in range(2)]
+    workers[0].put(get_message("<1@host>"), RANKED)
+    workers[1].put(get_message("<2@host>"), RANKED)
+
+    for worker in workers:
+        worker.flush()
+
+    reopened = RankCache(tmp_path)
+    assert reopened.get(get_message("<1@host>")) == RANKED
+    assert reopened.get(get_message("<2@host>")) == RANKED
+    assert workers[1].get(get_message("<1@host>")) == RANKED
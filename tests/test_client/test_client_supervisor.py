@@ -0,0 +1,157 @@
+"""Test supervisor of worker processes."""
+# pylint: disable=redefined-outer-name
+import logging
+import multiprocessing
+import time
+
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+from zippy.client.main import EmailAuthUser
+from zippy.client.supervisor import Supervisor, shard_of, shard_users, worker_config
+from zippy.client.training_ledger import TrainingLedger
+from zippy.pipeline.model.weight_store import GLOBAL, TABLES, WeightStore
+
+USERS = [
+    {"username": f"test{number}@localhost.org", "password": ""} for number in range(8)
+]
+
+
+def sleep_forever(config, users):  # pylint: disable=unused-argument
+    """Worker that runs till stopped."""
+    while True:
+        time.sleep(1)
+
+
+def crash(config, users):  # pylint: disable=unused-argument
+    """Worker that crashes right away."""
+    raise SystemExit(1)
+
+
+def train_global(directory, worker, mails):
+    """Worker that adds ranks of mails to the global model and the ledger."""
+    store = WeightStore(directory / "models", logger=MagicMock(logging.Logger))
+    ledger = TrainingLedger(directory / "ledger", logger=MagicMock(logging.Logger))
+    user = f"test{worker}@localhost.org"
+    for number in range(mails):
+        global_weights = store.get(GLOBAL)
+        rank = pd.DataFrame({column: [worker] for column in TABLES["rank_df"]})
+        global_weights.update("rank_df", pd.concat([global_weights["rank_df"], rank]))
+        ledger.add(pd.DataFrame({"To": [user], "Message-ID": [f"<{number}@host>"]}))
+        store.flush()
+    ledger.close()
+
+
+@pytest.fixture
+def config():
+    """Client config with eight users."""
+    return {"hostname": "localhost.org", "users": list(USERS)}
+
+
+@pytest.fixture
+def supervisor(config):
+    """Supervisor with two forked workers."""
+    supervisor = Supervisor(
+        load_config=lambda: config,
+        workers=2,
+        target=sleep_forever,
+        restart_delay=0,
+        start_method="fork",
+        logger=MagicMock(logging.Logger),
+    )
+    yield supervisor
+    supervisor.stop()
+
+
+def test_shard_users_is_stable():
+    """Test that users are split over all workers the same way every time."""
+    users = [EmailAuthUser(user["username"], "") for user in USERS]
+    shards = shard_users(users, 3)
+
+    assert sorted(sum(shards, []), key=users.index) == users
+    assert shard_users(list(reversed(users)), 3) == [
+        list(reversed(shard)) for shard in shards
+    ]
+
+
+def test_worker_config_shares_connections():
+    """Test that workers together stay within the connection cap."""
+    assert (
+        worker_config({"max_connections_per_host": 10}, 4)["max_connections_per_host"]
+        == 2
+    )
+    assert (
+        worker_config({"max_connections_per_host": 1}, 4)["max_connections_per_host"]
+        == 1
+    )
+
+
+def test_crashed_worker_is_restarted(supervisor):
+    """Test that a worker is started again after it exits."""
+    supervisor.start()
+    process = supervisor.processes[0]
+    process.terminate()
+    process.join()
+
+    supervisor.check()
+
+    assert supervisor.processes[0] is not process
+    assert supervisor.processes[0].is_alive()
+    assert supervisor.processes[1].is_alive()
+
+
+def test_crashing_worker_waits_for_restart_delay(supervisor):
+    """Test that a crashing worker is not restarted in a tight loop."""
+    supervisor.target = crash
+    supervisor.restart_delay = 60
+    supervisor.start()
+    process = supervisor.processes[0]
+    process.join()
+
+    supervisor.check()
+
+    assert supervisor.processes[0] is process
+
+
+def test_only_changed_workers_are_restarted(supervisor, config):
+    """Test that adding a user restarts only the worker it belongs to."""
+    supervisor.start()
+    processes = dict(supervisor.processes)
+
+    new_user = {"username": "new@localhost.org", "password": ""}
+    config["users"] = config["users"] + [new_user]
+    supervisor.check()
+
+    new_worker = shard_of(EmailAuthUser(new_user["username"], ""), 2)
+    assert supervisor.processes[new_worker] is not processes[new_worker]
+    assert supervisor.processes[1 - new_worker] is processes[1 - new_worker]
+    assert not processes[new_worker].is_alive()
+
+
+def test_workers_share_global_files(tmp_path):
+    """Test that workers writing the global model and ledger keep every write."""
+    (tmp_path / "models").mkdir()
+    WeightStore(tmp_path / "models", logger=MagicMock(logging.Logger)).create(GLOBAL)
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=train_global, args=(tmp_path, worker, 20))
+        for worker in (1, 2)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    global_weights = WeightStore(tmp_path / "models").get(GLOBAL)
+    assert global_weights.quantiles.count == 40
+    assert global_weights.rank_weights()[-1] == pytest.approx(1.5, rel=0.01)
+    assert len(pd.read_csv(tmp_path / "models" / GLOBAL / "rank_df.csv")) == 40
+    ledger = TrainingLedger(tmp_path / "ledger")
+    for worker in (1, 2):
+        user = f"test{worker}@localhost.org"
+        msg = pd.DataFrame({"To": [user], "Message-ID": ["<19@host>"]})
+        assert ledger.trained(msg)
+    ledger.close()
@@ -0,0 +1,170 @@
+"""Test incremental search of changed mails."""
+# pylint: disable=redefined-outer-name
+import logging
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from imapclient import IMAPClient
+
+from zippy.client.sync_state import (
+    MailboxSync,
+    SyncState,
+    SyncStateStore,
+    enable_condstore,
+)
+
+USER = "test@localhost.org"
+CRITERIA = b"UNSEEN"
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Store in a temporary directory."""
+    return SyncStateStore(tmp_path)
+
+
+@pytest.fixture
+def sync(store):
+    """Sync of the inbox of the user."""
+    return MailboxSync(store, USER, logger=MagicMock(logging.Logger))
+
+
+def get_client(uidvalidity=1, uidnext=None, highestmodseq=None, uids=()):
+    """Return mocked client with given folder status and search result."""
+    client = MagicMock(IMAPClient)
+    status = {b"UIDVALIDITY": uidvalidity}
+    if uidnext is not None:
+        status[b"UIDNEXT"] = uidnext
+    if highestmodseq is not None:
+        status[b"HIGHESTMODSEQ"] = highestmodseq
+    client.select_folder.return_value = status
+    client.search.return_value = list(uids)
+    return client
+
+
+def test_full_search_without_state(sync, store):
+    """Test that all mails are searched on the first cycle."""
+    client = get_client(uidnext=11, highestmodseq=7, uids=[5, 2])
+
+    assert sync.search(client, CRITERIA) == [2, 5]
+    client.search.assert_called_once_with(CRITERIA)
+
+    sync.checkpoint([2, 5])
+    sync.commit()
+    assert store.get(USER, "INBOX") == SyncState(1, 5, 7)
+
+
+def test_full_search_on_uidvalidity_change(sync, store):
+    """Test that state of another UIDVALIDITY is not used."""
+    store.set(USER, "INBOX", SyncState(1, 10, 7))
+    client = get_client(uidvalidity=2, uidnext=4, uids=[1, 3])
+
+    assert sync.search(client, CRITERIA) == [1, 3]
+    client.search.assert_called_once_with(CRITERIA)
+
+
+def test_search_skipped_if_modseq_unchanged(sync, store):
+    """Test that no search is sent if nothing changed in the folder."""
+    store.set(USER, "INBOX", SyncState(1, 10, 7))
+    client = get_client(uidnext=11, highestmodseq=7)
+
+    assert sync.search(client, CRITERIA) == []
+    client.search.assert_not_called()
+
+
+def test_search_changes_since_modseq(sync, store):
+    """Test that only mails changed after the last modseq are searched."""
+    store.set(USER, "INBOX", SyncState(1, 10, 7))
+    client = get_client(uidnext=13, highestmodseq=9, uids=[3, 12])
+
+    assert sync.search(client, CRITERIA) == [3, 12]
+    client.search.assert_called_once_with(CRITERIA + b" MODSEQ 8")
+
+    sync.checkpoint([3, 12])
+    sync.commit()
+    assert store.get(USER, "INBOX") == SyncState(1, 12, 9)
+
+
+def test_search_skipped_if_uidnext_unchanged(sync, store):
+    """Test that no search is sent without CONDSTORE if no mail arrived."""
+    store.set(USER, "INBOX", SyncState(1, 10))
+    client = get_client(uidnext=11)
+
+    assert sync.search(client, CRITERIA) == []
+    client.search.assert_not_called()
+
+
+def test_search_new_uids(sync, store):
+    """Test that only mails newer than the last uid are searched."""
+    store.set(USER, "INBOX", SyncState(1, 10))
+    # "11:*" matches the last mail even if it is older
+    client = get_client(uidnext=14, uids=[10, 13, 11])
+
+    assert sync.search(client, CRITERIA) == [11, 13]
+    client.search.assert_called_once_with(CRITERIA + b" UID 11:*")
+
+
+def test_checkpoint_keeps_modseq(sync, store):
+    """Test that interrupted cycle searches unprocessed mails again."""
+    store.set(USER, "INBOX", SyncState(1, 10, 7))
+    client = get_client(uidnext=15, highestmodseq=9, uids=[11, 12, 13, 14])
+    sync.search(client, CRITERIA)
+
+    sync.checkpoint([11, 12])
+    assert store.get(USER, "INBOX") == SyncState(1, 12, 7)
+
+    sync.checkpoint([13, 14])
+    sync.commit()
+    assert store.get(USER, "INBOX") == SyncState(1, 14, 9)
+
+
+def test_commit_without_mails_keeps_modseq(sync, store):
+    """Test that the modseq is saved when nothing was found."""
+    store.set(USER, "INBOX", SyncState(1, 10, 7))
+    client = get_client(uidnext=11, highestmodseq=8)
+    sync.search(client, CRITERIA)
+
+    sync.commit()
+    assert store.get(USER, "INBOX") == SyncState(1, 10, 8)
+
+
+@pytest.mark.parametrize("highestmodseq, stored_modseq", [(None, None), (9, 7)])
+def test_failed_mail_is_searched_again(sync, store, highestmodseq, stored_modseq):
+    """Test that a mail that could not be moved or flagged is found again."""
+    store.set(USER, "INBOX", SyncState(1, 10, stored_modseq))
+    client = get_client(uidnext=15, highestmodseq=highestmodseq, uids=[11, 12, 13])
+    sync.search(client, CRITERIA)
+
+    # mail 12 failed, mail 13 was flagged
+    sync.checkpoint([11, 13])
+    sync.commit()
+    assert store.get(USER, "INBOX") == SyncState(1, 11, stored_modseq)
+
+    client = get_client(uidnext=15, highestmodseq=highestmodseq, uids=[12])
+    assert sync.search(client, CRITERIA) == [12]
+    if highestmodseq is None:
+        client.search.assert_called_once_with(CRITERIA + b" UID 12:*")
+    else:
+        client.search.assert_called_once_with(CRITERIA + b" MODSEQ 8")
+
+
+def test_corrupted_state_is_ignored(store, tmp_path):
+    """Test that unreadable state leads to a full search instead of failing."""
+    (tmp_path / f"{USER}.json").write_text("{")
+    assert store.get(USER, "INBOX") is None
+
+
+def test_enable_condstore():
+    """Test that CONDSTORE is only enabled if the server supports it."""
+    client = MagicMock(IMAPClient)
+    client.has_capability.return_value = True
+    client.enable.return_value = [b"CONDSTORE"]
+    assert enable_condstore(client, MagicMock(logging.Logger))
+    client.enable.assert_called_once_with("CONDSTORE")
+
+    client = MagicMock(IMAPClient)
+    client.has_capability.return_value = False
+    assert not enable_condstore(client, MagicMock(logging.Logger))
+    client.enable.assert_not_called()
@@ -0,0 +1,104 @@
+"""Test remembering the mails the weights were trained on."""
+# pylint: disable=redefined-outer-name
+import logging
+
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+
+from zippy.client.training_ledger import BloomFilter, TrainingLedger, training_key
+
+USER = "test@localhost.org"
+
+
+def get_msg(message_id=None, subject="test", user=USER):
+    """Return parsed mail to the user, with the Message-ID if given."""
+    msg = {"From": ["sender@localhost.org"], "To": [user], "Subject": [subject]}
+    if message_id is not None:
+        msg["message-id"] = [message_id]
+    msg["content"] = "body"
+    return pd.DataFrame(msg)
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    """Ledger in a temporary directory, with small filters."""
+    ledger = TrainingLedger(tmp_path, capacity=2, logger=MagicMock(logging.Logger))
+    yield ledger
+    ledger.close()
+
+
+def test_bloom_filter():
+    """Test that added strings are always found, and few others are."""
+    bloom = BloomFilter(1000, 0.01)
+    for number in range(1000):
+        bloom.add(f"<{number}@host>")
+
+    assert all(f"<{number}@host>" in bloom for number in range(1000))
+    found = sum(f"<{number}@other>" in bloom for number in range(10000))
+    assert found < 300
+    assert not bloom.full
+    bloom.add("one more")
+    assert bloom.full
+
+
+def test_training_key():
+    """Test that mails are identified by Message-ID, or by their content."""
+    assert training_key(get_msg(" <1@host> ")) == (USER, "<1@host>")
+    assert training_key(get_msg("<1@host>", subject="other")) == (USER, "<1@host>")
+    assert training_key(get_msg()) == training_key(get_msg())
+    assert training_key(get_msg()) != training_key(get_msg(subject="other"))
+
+
+def test_ledger_remembers_mails_by_user(ledger):
+    """Test that mails are known once added, for their user only."""
+    assert not ledger.trained(get_msg("<1@host>"))
+
+    ledger.add(get_msg("<1@host>"))
+
+    assert ledger.trained(get_msg("<1@host>"))
+    assert not ledger.trained(get_msg("<2@host>"))
+    assert not ledger.trained(get_msg("<1@host>", user="other@localhost.org"))
+
+
+def test_ledger_grows_filters(ledger):
+    """Test that mails are still known once a filter is rebuilt bigger."""
+    for number in range(10):
+        ledger.add(get_msg(f"<{number}@host>"))
+
+    assert all(ledger.trained(get_msg(f"<{number}@host>")) for number in range(10))
+    assert ledger._filters[USER].capacity >= 10
+
+
+def test_ledger_is_persisted(ledger, tmp_path):
+    """Test that added mails are known by a new ledger."""
+    ledger.add(get_msg("<1@host>"))
+
+    other = TrainingLedger(tmp_path)
+    assert other.trained(get_msg("<1@host>"))
+    assert not other.trained(get_msg("<2@host>"))
+    other.close()
+
+
+def test_disabled_ledger(tmp_path):
+    """Test that a disabled ledger keeps nothing and creates no database."""
+    ledger = TrainingLedger(tmp_path, enabled=False)
+    ledger.add(get_msg("<1@host>"))
+
+    assert not ledger.trained(get_msg("<1@host>"))
+    assert not ledger.path.exists()
+
+
+def test_ledgers_share_database(ledger, tmp_path):
+    """Test that a process adding mails never locks out another one."""
+    other = TrainingLedger(tmp_path, timeout=0.1)
+    ledger.add(get_msg("<1@host>"))
+
+    other.add(get_msg("<2@host>", user="other@localhost.org"))
+
+    other.close()
+    reopened = TrainingLedger(tmp_path)
+    assert reopened.trained(get_msg("<1@host>"))
+    assert reopened.trained(get_msg("<2@host>", user="other@localhost.org"))
+    reopened.close()
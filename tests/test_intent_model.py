@@ -0,0 +1,96 @@
+"""Tests for the registry of the intent model."""
+# pylint: disable=redefined-outer-name
+import logging
+import os
+import pickle
+
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import pytest
+
+from zippy.pipeline.model.intent import IntentModelRegistry
+
+
+@pytest.fixture
+def files(tmp_path):
+    """Model and tokenizer files."""
+    model_path = tmp_path / "model.h5"
+    model_path.write_bytes(b"model")
+    tokenizer_path = tmp_path / "tokenizer.pickle"
+    tokenizer = SimpleNamespace(
+        word_index={"suit": 1},
+        num_words=None,
+        oov_token=None,
+        filters="",
+        lower=True,
+        split=" ",
+        char_level=False,
+    )
+    tokenizer_path.write_bytes(pickle.dumps(tokenizer))
+    return model_path, tokenizer_path
+
+
+@pytest.fixture
+def load_model():
+    """Return a new mocked model on every load."""
+    return MagicMock(side_effect=lambda path: MagicMock())
+
+
+@pytest.fixture
+def registry(files, load_model):
+    """Registry checking the files on every use."""
+    model_path, tokenizer_path = files
+    return IntentModelRegistry(
+        model_path,
+        tokenizer_path,
+        check_interval=0,
+        load_model=load_model,
+        logger=MagicMock(logging.Logger),
+    )
+
+
+def touch(path, offset):
+    """Move modification time of the file."""
+    stat = path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + offset))
+
+
+def test_model_is_loaded_once_and_warmed_up(registry, load_model):
+    """Test that the model is loaded on first use only."""
+    intent = registry.get()
+
+    assert registry.get() is intent
+    assert intent.tokenizer.vocabulary == {"suit": 1}
+    load_model.assert_called_once_with(registry.model_path)
+    intent.model.predict_on_batch.assert_called_once()
+
+
+def test_model_is_swapped_when_file_changes(registry, files, load_model):
+    """Test that a new version on disk is loaded and used."""
+    old = registry.get()
+    touch(files[0], 10)
+
+    new = registry.get()
+
+    assert new is not old
+    assert new.version != old.version
+    assert load_model.call_count == 2
+    new.model.predict_on_batch.assert_called_once()
+
+
+def test_failed_reload_keeps_model(registry, files, load_model):
+    """Test that a broken new version does not replace the working one."""
+    old = registry.get()
+    touch(files[1], 10)
+    files[1].write_bytes(b"half written")
+
+    assert registry.get() is old
+    assert load_model.call_count == 1
+
+
+def test_missing_model_stops_client(registry, files):
+    """Test that the client does not start without a model."""
+    files[0].unlink()
+    with pytest.raises(SystemExit):
+        registry.get()
@@ -0,0 +1,66 @@
+"""Tests for timings of the stages of ranking."""
+import json
+import logging
+
+from unittest.mock import MagicMock
+
+import pytest
+
+from zippy.utils.metrics import NULL_TIMER, Histogram, Metrics
+
+
+def test_histogram_summary():
+    """Test that quantiles are bounds of the buckets of the durations."""
+    histogram = Histogram(bounds=(0.001, 0.01, 0.1))
+    for duration in [0.0005] * 50 + [0.005] * 45 + [0.05] * 4 + [2.0]:
+        histogram.observe(duration)
+
+    summary = histogram.summary()
+    assert summary.count == 100
+    assert summary.total == pytest.approx(0.025 + 0.225 + 0.2 + 2.0)
+    assert (summary.p50, summary.p90, summary.p99) == (0.001, 0.01, 0.1)
+    assert summary.max == 2.0
+    assert Histogram().summary().p50 == 0.0
+
+
+def test_disabled_metrics_record_nothing():
+    """Test that disabled metrics give a timer doing nothing."""
+    metrics = Metrics(logger=MagicMock(logging.Logger))
+    stage = metrics.timed("stage")(lambda value: value * 2)
+
+    with metrics.timer("block") as timer:
+        assert stage(21) == 42
+
+    assert timer is NULL_TIMER
+    assert metrics.summaries() == {}
+    metrics.log_if_due()
+    metrics.logger.info.assert_not_called()
+
+
+def test_enabled_metrics_time_stages():
+    """Test that blocks and functions are timed, even if they raise."""
+    metrics = Metrics(enabled=True, log_interval=0, logger=MagicMock(logging.Logger))
+
+    @metrics.timed("stage")
+    def stage(fail):
+        if fail:
+            raise ValueError(fail)
+        return "done"
+
+    with metrics.timer("block"):
+        assert stage(False) == "done"
+    with pytest.raises(ValueError):
+        stage(True)
+
+    summaries = metrics.summaries()
+    assert summaries["stage"].count == 2
+    assert summaries["block"].count == 1
+    assert summaries["block"].total >= summaries["stage"].total / 2
+    assert stage.__name__ == "stage"
+    json.dumps(metrics.to_dict())
+    assert sum(metrics.to_dict()["stage"]["buckets"].values()) <= 2
+
+    metrics.log_if_due()
+    assert metrics.logger.info.call_count == 2
+    metrics.reset()
+    assert metrics.summaries() == {}
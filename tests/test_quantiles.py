@@ -0,0 +1,103 @@
+"""Tests for the streaming quantiles of ranks."""
+import math
+
+import numpy as np
+import pytest
+
+from zippy.pipeline.model.quantiles import QuantileSketch, read_sketch, write_sketch
+
+QUANTILES = [0, 0.1, 0.25, 0.5, 0.9, 1]
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        np.random.default_rng(0).lognormal(0, 2, 5000),
+        np.random.default_rng(1).normal(0, 1, 5000),
+        np.array([0, 0, 0, 1, 2, 3]),
+        np.array([4.2]),
+    ],
+)
+def test_quantiles_within_relative_accuracy(values):
+    """Test that quantiles are within the accuracy of the exact ones."""
+    sketch = QuantileSketch.from_values(values)
+
+    for q in QUANTILES:
+        exact = np.quantile(values, q)
+        # the numbers the quantile is interpolated between
+        bound = np.abs(np.quantile(values, q, method="nearest"))
+        bound = max(bound, np.abs(np.quantile(values, q, method="higher")))
+        bound = max(bound, np.abs(np.quantile(values, q, method="lower")))
+        assert abs(sketch.quantile(q) - exact) <= 0.01 * bound + 1e-12
+
+
+def test_median_of_even_count_is_interpolated():
+    """Test that the median of two ranks is their mean, like pandas."""
+    sketch = QuantileSketch.from_values([1, 3, math.nan])
+
+    assert sketch.quantile(0.5) == pytest.approx(2, rel=0.01)
+    assert math.isnan(QuantileSketch().quantile(0.5))
+
+
+def test_half_life_follows_recent_values():
+    """Test that older values count less with a half life."""
+    day = 24 * 60 * 60
+    values = [1.0] * 100 + [10.0] * 100
+    times = [0.0] * 100 + [30 * day] * 100
+
+    assert QuantileSketch.from_values(values, times).quantile(0.3) == pytest.approx(
+        1, rel=0.01
+    )
+    decayed = QuantileSketch.from_values(values, times, half_life=day)
+    assert decayed.quantile(0.3) == pytest.approx(10, rel=0.01)
+    # weights of far future values are scaled back without changing quantiles
+    decayed.add(10.0, 10000 * day)
+    assert decayed.count == pytest.approx(1, rel=1e-6)
+    assert decayed.quantile(0.3) == pytest.approx(10, rel=0.01)
+
+
+def test_sketch_is_saved_and_read(tmp_path):
+    """Test that a saved sketch gives the same quantiles."""
+    sketch = QuantileSketch.from_values([-2.5, 0, 1, 3, 8], half_life=60)
+    path = tmp_path / "rank_quantiles.json"
+
+    assert read_sketch(path) is None
+    write_sketch(sketch, path)
+    saved = read_sketch(path)
+
+    assert saved.half_life == 60
+    for q in QUANTILES:
+        assert saved.quantile(q) == sketch.quantile(q)
+    assert read_sketch(path, half_life=120).half_life == 120
+
+
+@pytest.mark.parametrize("half_life", [None, 60])
+def test_merged_sketches_are_the_sketch_of_all_values(half_life):
+    """Test that merging sketches gives the quantiles of all their values."""
+    rng = np.random.default_rng(2)
+    values = rng.lognormal(0, 1, 2000) * rng.choice([-1, 0, 1], 2000)
+    times = np.sort(rng.uniform(0, 600, 2000))
+    first, second = np.arange(2000) % 3 == 0, np.arange(2000) % 3 != 0
+    merged = QuantileSketch.from_values(
+        values[first], times[first], half_life=half_life
+    )
+
+    merged.merge(
+        QuantileSketch.from_values(values[second], times[second], half_life=half_life)
+    )
+
+    expected = QuantileSketch.from_values(values, times, half_life=half_life)
+    assert merged.count == pytest.approx(expected.count, rel=1e-9)
+    for q in QUANTILES:
+        assert merged.quantile(q) == pytest.approx(expected.quantile(q), rel=1e-9)
+    with pytest.raises(ValueError):
+        merged.merge(QuantileSketch(relative_accuracy=0.05))
+
+
+@pytest.mark.parametrize("content", ["", '{"positive": {', "[]", '{"zero": 1}'])
+def test_corrupted_sketch_is_not_read(tmp_path, content):
+    """Test that a truncated or corrupted sketch is ignored."""
+    path = tmp_path / "rank_quantiles.json"
+    path.write_text(content)
+
+    assert read_sketch(path) is None
@@ -0,0 +1,111 @@
+"""Tests for ranking emails."""
+# pylint: disable=redefined-outer-name
+import email
+
+from unittest.mock import patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from zippy.pipeline.data import parse_email
+from zippy.pipeline.model import rank_message
+from zippy.pipeline.model.intent import TOKENIZER, IntentModel, load_tokenizer
+from zippy.pipeline.model.weight_store import SenderIndex
+
+SUBJECTS = [
+    "Suit up, Ted.",
+    "Please send the report by tomorrow",
+    "legendary party tonight",
+    "Can you review the report, please?",
+    "Where is the yellow umbrella",
+]
+
+
+class FakeModel:
+    """Model scoring sequences by their word indices."""
+
+    def predict_on_batch(self, sequences):
+        """Score a batch of sequences."""
+        return (sequences.sum(axis=1, keepdims=True) % 97) / 97
+
+
+def load_intent_model():
+    """Return fake model with the tokenizer."""
+    return IntentModel(FakeModel(), load_tokenizer(TOKENIZER), (0, 0))
+
+
+@pytest.fixture
+def messages():
+    """Emails with different subjects."""
+    return [
+        email.message_from_bytes(
+            f"From: test1@email.com\r\nTo: test2@email.com\r\n"
+            f"Subject: {subject}\r\nDate: 05/23/2019\r\n\r\nbody".encode()
+        )
+        for subject in SUBJECTS
+    ]
+
+
+def fake_rank(msg):
+    """Rank by length of the subject."""
+    return len(msg["Subject"][0]), 25
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 32])
+def test_batch_ranking_is_identical(messages, batch_size):
+    """Test that batches rank exactly like one message at a time."""
+    with patch.object(rank_message, "combined_rank", side_effect=fake_rank):
+        with patch.object(rank_message.INTENT_MODELS, "get") as mocked_get:
+            mocked_get.return_value = load_intent_model()
+            expected = [rank_message.rank_message(message) for message in messages]
+
+            mocked_get.return_value = load_intent_model()
+            ranked = rank_message.rank_messages(messages, batch_size)
+
+    assert len(ranked) == len(expected)
+    for (msg, *result), (expected_msg, *expected_result) in zip(ranked, expected):
+        assert msg.equals(expected_msg)
+        assert result == expected_result
+    # scores of the fake model tell intent apart
+    assert {bool(result[3]) for result in expected} == {True, False}
+
+
+def test_predict_intent_in_batches():
+    """Test that sequences are predicted batch by batch, in order."""
+    sequences = np.arange(10).reshape(5, 2)
+    calls = []
+
+    class Model(FakeModel):
+        def predict_on_batch(self, sequences):
+            calls.append(len(sequences))
+            return sequences[:, :1]
+
+    scores = rank_message.predict_intent(Model(), sequences, batch_size=2)
+
+    assert calls == [2, 2, 1]
+    assert scores.ravel().tolist() == [0, 2, 4, 6, 8]
+
+
+def test_rank_no_messages():
+    """Test that nothing is predicted without emails."""
+    with patch.object(rank_message.INTENT_MODELS, "get") as mocked_get:
+        assert rank_message.rank_messages([]) == []
+    mocked_get.assert_called_once_with()
+
+
+@pytest.mark.parametrize("sender", ["test1@email.com", "test3@email.com"])
+def test_sender_weight_from_index(messages, sender):
+    """Test that the sender index finds the same weight as a scan of the table."""
+    from_weight = pd.DataFrame(
+        {"From": ["test2@email.com", "test1@email.com"], "weight": [0.5, 2.0]}
+    )
+    msg = pd.DataFrame(parse_email.get_from_message(messages[0]))
+    msg["From"] = sender
+
+    expected = rank_message.get_weights_from_sender(msg, from_weight)
+    weight = rank_message.get_weights_from_sender(
+        msg, from_weight, SenderIndex(from_weight)
+    )
+
+    assert np.ravel(weight).tolist() == np.ravel(expected).tolist()
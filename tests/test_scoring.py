@@ -0,0 +1,203 @@
+"""Tests for ranking emails with sparse matrices."""
+# pylint: disable=redefined-outer-name
+import email
+import logging
+
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from zippy.pipeline.data import parse_email
+from zippy.pipeline.model import rank_message
+from zippy.pipeline.model.text_index import CHAR_MATCH, TOKEN_MATCH
+from zippy.pipeline.model.weight_store import GLOBAL, WeightStore
+
+pytest.importorskip("scipy")
+
+from zippy.pipeline.model.scoring import SparseScorer  # noqa: E402
+
+USER = "test2@email.com"
+EMAILS = [
+    ("test1@email.com", "Re: report for tomorrow", "Please send the report."),
+    ("test3@email.com", "Re: legendary party tonight", "Suit up! It's legendary."),
+    ("test1@email.com", "Yellow umbrella", "Where is the yellow umbrella?"),
+    ("test4@email.com", "Re: the", "the and of"),
+    ("test3@email.com", "Re: unknown thread", "Nothing known at all here"),
+    ("test5@email.com", "Re: ab", "ab"),
+]
+
+
+def weights(rng, size):
+    """Return random weights, one negative and one missing."""
+    values = rng.random(size) * 3
+    values[1] = -0.5
+    values[2] = np.nan
+    return values
+
+
+def random_terms(rng, size):
+    """Return random words with words of the emails."""
+    alphabet = list("abcdefghijklmnopqrstuvwxyz")
+    terms = ["".join(rng.choice(alphabet, rng.integers(2, 8))) for _ in range(size)]
+    return terms + ["report", "tomorrow", "legendary", "umbrella", "suit", np.nan]
+
+
+def tables(seed):
+    """Return tables of weights of a user."""
+    rng = np.random.default_rng(seed)
+    senders = ["test1@email.com", "test3@email.com", "test1@email.com", "a@b.com"]
+    threads = [
+        "report for tomorrow",
+        "legendary party tonight",
+        "report",
+        "party",
+        np.nan,
+        "report for tomorrow",
+    ]
+    thread_terms = random_terms(rng, 50)
+    msg_terms = random_terms(rng, 200)
+    return {
+        "from_weight": pd.DataFrame({"From": senders, "weight": [0.5, 2.0, 9.0, 1.5]}),
+        "thread_senders_weight": pd.DataFrame(
+            {"From": senders[:2], "freq": [1, 2], "weight": [3.0, 0.25]}
+        ),
+        "thread_weights": pd.DataFrame(
+            {
+                "freq": 1,
+                "time_span": 1,
+                "weight": weights(rng, len(threads)),
+                "min_time": 0,
+                "thread": threads,
+            }
+        ),
+        "thread_term_weights": pd.DataFrame(
+            {"term": thread_terms, "weight": weights(rng, len(thread_terms))}
+        ),
+        "msg_terms_weight": pd.DataFrame(
+            {"freq": 1, "term": msg_terms, "weight": weights(rng, len(msg_terms))}
+        ),
+    }
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Store with weights of the user and of the global model."""
+    store = WeightStore(tmp_path, logger=MagicMock(logging.Logger))
+    for seed, user in enumerate((USER, GLOBAL)):
+        user_weights = store.create(user)
+        for name, table in tables(seed).items():
+            user_weights.update(name, table)
+        ranks = pd.DataFrame({"rank": [1.0, 2.0, 4.0], "date": "2019-05-23"})
+        user_weights.update("rank_df", ranks)
+    monkeypatch.setattr(rank_message, "WEIGHTS", store)
+    return store
+
+
+def parse_emails():
+    """Return the emails, parsed like the client does."""
+    return [
+        pd.DataFrame(
+            parse_email.get_from_message(
+                email.message_from_bytes(
+                    f"From: {sender}\r\nTo: {USER}\r\nSubject: {subject}\r\n"
+                    f"Date: 05/23/2019\r\n\r\n{content}".encode()
+                )
+            )
+        )
+        for sender, subject, content in EMAILS
+    ]
+
+
+def product_of_weights(msg, user_weights, term_match):
+    """Return the product of the five weights ``calculate_rank`` multiplies."""
+    from_weight, *threads, msg_term_weights, _ = user_weights.rank_weights()
+    senders, terms = user_weights.senders, user_weights.terms
+    weights = [
+        rank_message.get_weights_from_sender(msg, from_weight, senders["from_weight"])
+    ]
+    if msg["is_thread"][0]:
+        weights.extend(
+            rank_message.get_weights_from_thread(
+                msg,
+                threads,
+                rank_message.get_analyzer(),
+                senders["thread_senders_weight"],
+                terms["thread_term_weights"],
+                term_match,
+                user_weights.threads,
+            )
+        )
+    else:
+        weights.extend([1, 1, 1])
+    weights.append(
+        rank_message.get_weights_from_terms(
+            msg,
+            msg_term_weights,
+            rank_message.get_analyzer(),
+            terms["msg_terms_weight"],
+            term_match,
+        )
+    )
+    rank = 1.0
+    for weight in weights:
+        rank *= float(weight)
+    return rank
+
+
+@pytest.mark.parametrize("term_match", [CHAR_MATCH, TOKEN_MATCH])
+@pytest.mark.parametrize("user", [USER, GLOBAL])
+def test_ranks_like_calculate_rank(store, term_match, user):
+    """Test that ranks are the products of the weights of every email."""
+    user_weights = store.get(user)
+    expected = [
+        product_of_weights(msg, user_weights, term_match) for msg in parse_emails()
+    ]
+
+    scorer = SparseScorer(user_weights, term_match)
+    ranks = scorer.rank(parse_emails())
+
+    np.testing.assert_allclose(ranks, expected, rtol=1e-12)
+    # senders match a single row, their weight is the one of the row
+    factors = scorer.factors(scorer.features(parse_emails()))
+    assert factors[:, 0].tolist() == [0.5, 2.0, 0.5, 1, 2.0, 1]
+
+
+@pytest.mark.parametrize("term_match", [CHAR_MATCH, TOKEN_MATCH])
+def test_combined_ranks_like_combined_rank(store, term_match):
+    """Test that ranking emails together gives ranks and thresholds of each."""
+    store.term_match = term_match
+    user_weights, global_weights = store.get(USER), store.get(GLOBAL)
+    expected = [
+        product_of_weights(msg, user_weights, term_match)
+        + product_of_weights(msg, global_weights, term_match)
+        for msg in parse_emails()
+    ]
+    msgs = parse_emails()
+
+    ranked = rank_message.combined_ranks(msgs)
+
+    np.testing.assert_allclose([rank for rank, _ in ranked], expected, rtol=1e-12)
+    threshold = (
+        user_weights.rank_weights()[-1] + 0.1 * global_weights.rank_weights()[-1]
+    )
+    assert [threshold for _, threshold in ranked] == [threshold] * len(msgs)
+    assert msgs[0]["Date"].dtype.kind == "M"
+
+
+def test_weights_added_later_are_not_seen(store):
+    """Test that a scorer keeps the snapshot of the weights it was built with."""
+    user_weights = store.get(USER)
+    scorer = SparseScorer(user_weights)
+    expected = scorer.rank(parse_emails())
+    new_sender = pd.DataFrame({"From": ["test5@email.com"], "weight": [7.0]})
+    user_weights.update(
+        "from_weight",
+        pd.concat([user_weights["from_weight"], new_sender], ignore_index=True),
+    )
+
+    np.testing.assert_array_equal(scorer.rank(parse_emails()), expected)
+    assert SparseScorer(user_weights).rank(parse_emails())[-1] == pytest.approx(
+        7 * expected[-1]
+    )
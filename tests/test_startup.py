@@ -0,0 +1,39 @@
+"""Tests for the imports done when the client starts."""
+import pathlib
+import subprocess
+import sys
+
+import pytest
+
+from scripts.import_time import HEAVY_MODULES, import_times
+
+ROOT = pathlib.Path(__file__).parents[1]
+
+
+@pytest.mark.parametrize("module", ["zippy.client.main", "zippy.client.supervisor"])
+def test_client_imports_no_heavy_modules(module):
+    """Test that models and their dependencies are only loaded on first use."""
+    check = (
+        f"import sys, {module}\n"
+        f"heavy = {HEAVY_MODULES!r}\n"
+        "print(sorted(name for name in sys.modules if name.split('.')[0] in heavy))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", check],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    assert result.stdout.strip() == "[]"
+
+
+def test_import_times_are_reported():
+    """Test that the report lists the imports of the module."""
+    times = import_times("zippy.pipeline.model.weight_store")
+    modules = [time_.module for time_ in times]
+
+    assert "zippy.pipeline.model.weight_store" in modules
+    assert "pandas" in modules
+    assert all(time_.cumulative >= time_.self_time for time_ in times)
@@ -0,0 +1,111 @@
+"""Tests for the indexes of terms and threads."""
+# pylint: disable=redefined-outer-name
+import numpy as np
+import pandas as pd
+import pytest
+
+from zippy.pipeline.model.rank_message import get_weights
+from zippy.pipeline.model.text_index import (
+    CHAR_MATCH,
+    TOKEN_MATCH,
+    TermIndex,
+    ThreadIndex,
+)
+from zippy.pipeline.model.update_dataset import find_thread, thread_weights_containing
+
+SEARCHES = [
+    ["report", "tomorrow"],
+    ["suit"],
+    ["zzz"],
+    [],
+    ["legen", "dary"],
+]
+
+
+@pytest.fixture
+def table():
+    """Terms with their weights, one of them missing."""
+    rng = np.random.default_rng(0)
+    alphabet = list("abcdefghijklmnopqrstuvwxyz")
+    terms = ["".join(rng.choice(alphabet, rng.integers(2, 8))) for _ in range(300)]
+    terms += ["report", "tomorrow", "suit", np.nan]
+    return pd.DataFrame({"term": terms, "weight": rng.random(len(terms))})
+
+
+@pytest.mark.parametrize("search", SEARCHES)
+@pytest.mark.parametrize("mode", [CHAR_MATCH, TOKEN_MATCH])
+def test_index_matches_like_scan(table, search, mode):
+    """Test that the index finds the same weights as scans of the table."""
+    index = TermIndex(table)
+
+    assert index.weight(search, table, mode) == get_weights(search, table, mode=mode)
+
+
+@pytest.mark.parametrize("search", SEARCHES)
+def test_index_is_extended_with_new_rows(table, search):
+    """Test that adding rows gives the index of the whole table."""
+    old_table = table.iloc[:100]
+    index = TermIndex(old_table)
+    index.extend(table)
+
+    assert index.chars == TermIndex(table).chars
+    assert index.weight(search, table) == get_weights(search, table)
+    # older versions of the table do not see the new rows
+    assert index.weight(search, old_table) == get_weights(search, old_table)
+
+
+def test_token_mode_matches_whole_terms():
+    """Test that a term only matches rows with the same term."""
+    table = pd.DataFrame({"term": ["report", "reports", "port"], "weight": [2, 4, 8]})
+    index = TermIndex(table)
+
+    assert index.weight(["report", "unknown"], table, TOKEN_MATCH) == 2
+    assert index.weight(["unknown"], table, TOKEN_MATCH) == 1
+    assert index.weight(["report"], table, CHAR_MATCH) == pytest.approx(14 / 3)
+
+
+@pytest.fixture
+def threads():
+    """Subjects of threads with their weights, one of them missing."""
+    subjects = [
+        "Re: report for tomorrow",
+        "report",
+        "Fwd: Re: report for tomorrow",
+        "legendary party tonight",
+        "Suit up",
+        np.nan,
+        "report",
+        "ab",
+    ]
+    return pd.DataFrame({"thread": subjects, "weight": np.arange(len(subjects)) / 3})
+
+
+@pytest.mark.parametrize(
+    "subject", ["report", "Re: report for tomorrow", "ab", "r", "", "unknown", "nan"]
+)
+def test_thread_index_matches_like_scan(threads, subject):
+    """Test that the index finds the same threads as a scan of the table."""
+    subjects = ThreadIndex(threads)
+
+    assert subjects.weight(subject, threads) == get_weights(
+        subject, threads, term=False
+    )
+    np.testing.assert_array_equal(
+        thread_weights_containing(threads, subject, subjects),
+        thread_weights_containing(threads, subject),
+    )
+    np.testing.assert_array_equal(
+        find_thread(threads, subject, subjects), find_thread(threads, subject)
+    )
+
+
+def test_thread_index_is_extended_with_new_rows(threads):
+    """Test that threads added later are found, but not in older tables."""
+    old_threads = threads.iloc[:4]
+    subjects = ThreadIndex(old_threads)
+    subjects.extend(threads)
+
+    assert subjects.lookup("report") == [1, 6]
+    assert subjects.lookup("report", len(old_threads)) == [1]
+    assert subjects.contains("report", len(old_threads)) == [0, 1, 2]
+    assert subjects.weight("Suit", old_threads) == 1
@@ -0,0 +1,108 @@
+"""Tests for the TFLite backend of the intent model."""
+# pylint: disable=redefined-outer-name
+import logging
+
+from unittest.mock import MagicMock
+
+import numpy as np
+import pytest
+
+from zippy.pipeline.model import intent, tflite
+
+tf = pytest.importorskip("tensorflow")
+
+SEQUENCE_LENGTH = 50
+
+
+@pytest.fixture(scope="module")
+def keras_model_path(tmp_path_factory):
+    """Small bi-LSTM model shaped like the intent model."""
+    keras = tf.keras
+    model = keras.Sequential(
+        [
+            keras.Input((SEQUENCE_LENGTH,), dtype="int32"),
+            keras.layers.Embedding(100, 8),
+            keras.layers.Bidirectional(keras.layers.LSTM(8)),
+            keras.layers.Dense(1, activation="sigmoid"),
+        ]
+    )
+    path = tmp_path_factory.mktemp("intent") / "intent.h5"
+    model.save(path)
+    return path
+
+
+@pytest.fixture
+def sequences():
+    """Held-out sequences, not a multiple of the batch size."""
+    rng = np.random.default_rng(0)
+    sequences = rng.integers(1, 100, (11, SEQUENCE_LENGTH), dtype=np.int32)
+    sequences[0, :40] = 0
+    return sequences
+
+
+@pytest.mark.parametrize("quantize", [False, True])
+def test_converted_model_matches_keras(keras_model_path, tmp_path, sequences, quantize):
+    """Test that the converted model scores like the keras one."""
+    output = tflite.convert(
+        keras_model_path, tmp_path / "intent.tflite", batch_size=4, quantize=quantize
+    )
+    lite_model = tflite.TFLiteModel(output)
+
+    report = tflite.check_parity(
+        intent.load_keras_model(keras_model_path), lite_model, sequences
+    )
+
+    assert lite_model.batch_size == 4
+    assert report.size == len(sequences)
+    assert report.max_abs_diff < 1e-3
+    assert report.agreement == 1
+    assert lite_model.predict_on_batch(sequences[:1]).shape == (1, 1)
+    assert lite_model.predict_on_batch(sequences[:0]).shape == (0, 1)
+
+
+def test_missing_converted_model(tmp_path):
+    """Test that a missing model is reported like a missing keras model."""
+    with pytest.raises(FileNotFoundError):
+        tflite.load_tflite_model(tmp_path / "intent.tflite")
+
+
+def test_use_backend():
+    """Test that the registry loads the model of the backend."""
+    registry = intent.IntentModelRegistry(logger=MagicMock(logging.Logger))
+
+    registry.use_backend(intent.TFLITE_BACKEND)
+    assert registry.model_path == tflite.TFLITE_MODEL
+    assert registry.load_model is tflite.load_tflite_model
+
+    registry.use_backend(intent.KERAS_BACKEND)
+    assert registry.model_path == intent.INTENT_MODEL
+
+    with pytest.raises(ValueError):
+        registry.use_backend("onnx")
+
+
+def test_main_logs_parity(keras_model_path, tmp_path, sequences, monkeypatch):
+    """Test that the command converts the model and logs the parity check."""
+    logger = MagicMock(logging.Logger)
+    monkeypatch.setattr(tflite, "get_logger", lambda name: logger)
+    monkeypatch.setattr(tflite, "read_holdout", lambda path, column: ["subject"])
+    monkeypatch.setattr(
+        tflite, "load_tokenizer", lambda path: MagicMock(encode=lambda _: sequences)
+    )
+    output = tmp_path / "intent.tflite"
+
+    tflite.main(
+        [
+            "--model",
+            str(keras_model_path),
+            "--output",
+            str(output),
+            "--holdout",
+            str(tmp_path / "subjects.csv"),
+        ]
+    )
+
+    assert output.exists()
+    messages = [call.args[0] for call in logger.info.call_args_list]
+    assert messages[0].startswith("Converted")
+    assert messages[1].startswith("Checked")
@@ -0,0 +1,66 @@
+"""Tests for the frozen tokenizer."""
+import copy
+import pickle
+
+import numpy as np
+import pytest
+
+from tensorflow import keras
+
+from zippy.pipeline.model.intent import TOKENIZER, load_tokenizer
+from zippy.pipeline.model.tokenizer import FrozenTokenizer
+
+keras_text = pytest.importorskip("keras_preprocessing.text")
+
+TEXTS = [
+    "Suit up, Ted.",
+    "Please SEND the report by tomorrow!!",
+    "",
+    "unknownword another-unknown",
+    " ".join(["report"] * 60 + ["tomorrow"]),
+]
+
+
+def keras_encode(tokenizer, texts, maxlen=50):
+    """Encode texts the way keras does."""
+    return keras.preprocessing.sequence.pad_sequences(
+        tokenizer.texts_to_sequences(texts), maxlen=maxlen
+    )
+
+
+def test_encodes_like_pickled_tokenizer():
+    """Test that encoding matches the tokenizer the intent model was trained with."""
+    with open(TOKENIZER, "rb") as handle:
+        tokenizer = pickle.load(handle)
+    word_index = copy.deepcopy(tokenizer.word_index)
+    frozen = load_tokenizer(TOKENIZER)
+
+    encoded = frozen.encode(TEXTS)
+
+    assert encoded.dtype == np.int32
+    assert encoded.shape == (len(TEXTS), 50)
+    np.testing.assert_array_equal(encoded, keras_encode(tokenizer, TEXTS))
+    assert tokenizer.word_index == word_index
+
+
+@pytest.mark.parametrize("oov_token", [None, "<oov>"])
+def test_encodes_like_keras_with_limited_words(oov_token):
+    """Test that rare and unknown words are dropped or replaced like keras."""
+    tokenizer = keras_text.Tokenizer(num_words=5, oov_token=oov_token)
+    tokenizer.fit_on_texts(TEXTS[:2] + ["report report tomorrow tomorrow please"])
+    frozen = FrozenTokenizer.from_tokenizer(tokenizer, sequence_length=8)
+
+    np.testing.assert_array_equal(
+        frozen.encode(TEXTS), keras_encode(tokenizer, TEXTS, maxlen=8)
+    )
+
+
+def test_encode_into_preallocated_array():
+    """Test that rows of a given array are reused."""
+    frozen = FrozenTokenizer({"suit": 1, "up": 2}, sequence_length=4)
+    out = np.full((3, 4), 9, dtype=np.int32)
+
+    encoded = frozen.encode(["suit up", "up"], out=out)
+
+    assert np.shares_memory(encoded, out)
+    assert encoded.tolist() == [[0, 0, 1, 2], [0, 0, 0, 2]]
@@ -0,0 +1,248 @@
+"""Tests for the in-memory store of weights."""
+
+# pylint: disable=redefined-outer-name
+import logging
+import multiprocessing
+
+from unittest.mock import MagicMock
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from zippy.pipeline.model.update_dataset import update_sender_weight
+from zippy.pipeline.model.weight_store import TABLES, WeightStore
+
+USER = "test1@email.com"
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Store of a user with a sender and two ranked emails."""
+    store = WeightStore(tmp_path, flush_interval=0, logger=MagicMock(logging.Logger))
+    user_weights = store.create(USER)
+    user_weights.update(
+        "from_weight", pd.DataFrame({"From": ["test2@email.com"], "weight": [0.5]})
+    )
+    user_weights.update(
+        "rank_df", pd.DataFrame({column: [1, 3] for column in TABLES["rank_df"]})
+    )
+    store.flush()
+    return WeightStore(tmp_path, flush_interval=60, logger=MagicMock(logging.Logger))
+
+
+def test_create_writes_empty_tables(tmp_path, store):
+    """Test that a new user gets an empty CSV per table."""
+    for name, columns in TABLES.items():
+        assert list(pd.read_csv(tmp_path / USER / f"{name}.csv").columns) == columns
+    assert store.exists(USER)
+    assert not store.exists("test2@email.com")
+
+
+def test_weights_are_read_once(tmp_path, store):
+    """Test that tables are read on first use and kept in memory."""
+    user_weights = store.get(USER)
+    (tmp_path / USER / "from_weight.csv").unlink()
+
+    assert store.get(USER) is user_weights
+    from_weight, *_, threshold = user_weights.rank_weights()
+    assert from_weight.weight.tolist() == [0.5]
+    assert threshold == pytest.approx(2, rel=0.01)
+    assert len(user_weights.train_weights()) == len(TABLES)
+
+
+def test_changes_are_written_on_flush(tmp_path, store):
+    """Test that changed tables replace their file and new ranks are appended."""
+    user_weights = store.get(USER)
+    rank_df = user_weights["rank_df"]
+    new_rank = pd.DataFrame({column: [5] for column in TABLES["rank_df"]})
+    user_weights.update("rank_df", pd.concat([rank_df, new_rank]))
+    user_weights.update("from_weight", user_weights["from_weight"].assign(weight=[0.7]))
+    # rank added by another process meanwhile
+    pd.DataFrame({column: [9] for column in TABLES["rank_df"]}).to_csv(
+        tmp_path / USER / "rank_df.csv", mode="a", header=False, index=False
+    )
+
+    store.flush_if_due()
+    assert pd.read_csv(tmp_path / USER / "from_weight.csv").weight.tolist() == [0.5]
+
+    store.flush()
+    assert pd.read_csv(tmp_path / USER / "from_weight.csv").weight.tolist() == [0.7]
+    assert pd.read_csv(tmp_path / USER / "rank_df.csv")["rank"].tolist() == [
+        1,
+        3,
+        9,
+        5,
+    ]
+    assert not user_weights.dirty
+    assert not list((tmp_path / USER).glob("*.partial"))
+
+
+def test_sender_index_follows_added_rows(store):
+    """Test that senders added by training are found, but not in older tables."""
+    user_weights = store.get(USER)
+    old_table = user_weights["from_weight"]
+    senders = user_weights.senders["from_weight"]
+    new_table = pd.concat(
+        [old_table, pd.DataFrame({"From": ["test3@email.com"], "weight": [0.2]})],
+        ignore_index=True,
+    )
+
+    user_weights.update("from_weight", new_table)
+
+    assert senders.weight("test2@email.com", old_table) == 0.5
+    assert senders.weight("test3@email.com", new_table) == 0.2
+    assert senders.weight("test3@email.com", old_table) == 1
+    assert senders.get("test4@email.com", new_table) is None
+
+
+def test_threshold_is_kept_by_sketch(tmp_path, store):
+    """Test that ranks are read from the sketch, built from the ranks once."""
+    user_weights = store.get(USER)
+    assert user_weights["rank_df"].empty
+    new_ranks = pd.DataFrame({column: [5, 7] for column in TABLES["rank_df"]})
+    user_weights.update("rank_df", pd.concat([user_weights["rank_df"], new_ranks]))
+    assert user_weights.rank_weights()[-1] == pytest.approx(4, rel=0.01)
+    assert user_weights.rank_weights(0.25)[-1] == pytest.approx(2.5, rel=0.01)
+
+    store.flush()
+    assert user_weights["rank_df"].empty
+    assert pd.read_csv(tmp_path / USER / "rank_df.csv")["rank"].tolist() == [
+        1,
+        3,
+        5,
+        7,
+    ]
+    reopened = WeightStore(tmp_path, logger=MagicMock(logging.Logger))
+    assert reopened.get(USER).rank_weights()[-1] == pytest.approx(4, rel=0.01)
+
+    # without the sketch, it is built again from the ranks
+    (tmp_path / USER / "rank_quantiles.json").unlink()
+    rebuilt = WeightStore(tmp_path, logger=MagicMock(logging.Logger)).get(USER)
+    assert len(rebuilt["rank_df"]) == 4
+    assert rebuilt.rank_weights()[-1] == pytest.approx(4, rel=0.01)
+
+
+def test_workers_share_global_ranks(tmp_path):
+    """Test that stores flushing the same sketch merge their ranks."""
+    logger = MagicMock(logging.Logger)
+    WeightStore(tmp_path, logger=logger).create("global")
+    workers = [WeightStore(tmp_path, logger=logger) for _ in range(2)]
+
+    for worker, ranks in zip(workers, ([1, 2, 3], [10, 20, 30, 40])):
+        global_weights = worker.get("global")
+        new_ranks = pd.DataFrame({column: ranks for column in TABLES["rank_df"]})
+        global_weights.update(
+            "rank_df", pd.concat([global_weights["rank_df"], new_ranks])
+        )
+    for worker in workers:
+        worker.flush()
+
+    # the last worker to write sees every rank, the first one once it writes again
+    assert workers[1].get("global").quantiles.count == 7
+    assert workers[1].get("global").rank_weights()[-1] == pytest.approx(10, rel=0.01)
+    assert workers[0].get("global").quantiles.count == 3
+    workers[0].get("global").dirty.add("rank_quantiles")
+    workers[0].flush()
+    assert workers[0].get("global").quantiles.count == 7
+    reopened = WeightStore(tmp_path, logger=logger).get("global")
+    assert reopened.quantiles.count == 7
+    assert len(pd.read_csv(tmp_path / "global" / "rank_df.csv")) == 7
+
+
+def append_ranks(directory, worker, rows):
+    """Append long ranks of a worker to the global ranks, flushing often."""
+    store = WeightStore(directory, logger=MagicMock(logging.Logger))
+    global_weights = store.get("global")
+    for start in range(0, rows, 100):
+        new_ranks = pd.DataFrame(
+            {column: [worker] * 100 for column in TABLES["rank_df"]}
+        )
+        new_ranks["subject"] = "x" * 5000
+        global_weights.update(
+            "rank_df", pd.concat([global_weights["rank_df"], new_ranks])
+        )
+        store.flush()
+
+
+def test_workers_append_whole_rows(tmp_path):
+    """Test that ranks appended by processes at once are never interleaved."""
+    WeightStore(tmp_path, logger=MagicMock(logging.Logger)).create("global")
+    context = multiprocessing.get_context("fork")
+    workers = [
+        context.Process(target=append_ranks, args=(tmp_path, worker, 1000))
+        for worker in (1, 2)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    ranks = pd.read_csv(tmp_path / "global" / "rank_df.csv")
+    assert ranks["rank"].value_counts().to_dict() == {1: 1000, 2: 1000}
+    assert (ranks["subject"].str.len() == 5000).all()
+    assert (ranks["from"] == ranks["rank"]).all()
+    assert (tmp_path / "global" / "rank_df.lock").exists()
+
+
+def test_corrupted_sketch_is_built_again(tmp_path, store):
+    """Test that weights are still read when the sketch cannot be."""
+    store.get(USER)
+    (tmp_path / USER / "rank_quantiles.json").write_text('{"positive": {"1')
+
+    rebuilt = WeightStore(tmp_path, logger=MagicMock(logging.Logger))
+    user_weights = rebuilt.get(USER)
+
+    assert user_weights.rank_weights()[-1] == pytest.approx(2, rel=0.01)
+    rebuilt.logger.warning.assert_called_once()
+    rebuilt.flush()
+    assert WeightStore(tmp_path).get(USER).quantiles.count == 2
+
+
+def test_snapshot_is_not_changed_by_training(store):
+    """Test that ranking keeps its snapshot while training changes rows."""
+    user_weights = store.get(USER)
+    from_weight, *_ = user_weights.rank_weights()
+
+    trained, *_ = user_weights.train_weights()
+    update_sender_weight(
+        "test2@email.com", trained, user_weights.senders["from_weight"]
+    )
+
+    assert from_weight.weight.tolist() == [0.5]
+    assert user_weights.rank_weights()[0].weight.tolist() == [0.5]
+    user_weights.update("from_weight", trained)
+    assert from_weight.weight.tolist() == [0.5]
+    assert user_weights.rank_weights()[0].weight.tolist() == [
+        pytest.approx(np.log(np.exp(0.5) + 1))
+    ]
+
+
+def test_configure_checks_options(tmp_path):
+    """Test that options of the config are converted and checked."""
+    store = WeightStore(tmp_path, logger=MagicMock(logging.Logger))
+    store.configure(
+        {
+            "weights_flush_interval": 5,
+            "term_match": "token",
+            "threshold_quantile": 0.25,
+            "threshold_half_life": 2,
+            "rank_engine": "sparse",
+        }
+    )
+    assert store.flush_interval == 5
+    assert store.term_match == "token"
+    assert store.threshold_quantile == 0.25
+    assert store.half_life == 2 * 24 * 60 * 60
+    assert store.rank_engine == "sparse"
+
+    for option in (
+        {"term_match": "word"},
+        {"threshold_quantile": 2},
+        {"threshold_half_life": 0},
+        {"rank_engine": "numpy"},
+    ):
+        with pytest.raises(ValueError):
+            store.configure(option)
+    # a wrong option changes nothing
+    assert store.term_match == "token"
@@ -0,0 +1,260 @@
+#! /usr/bin/env python3
+"""Engine that processes mailboxes of many users concurrently on an event loop.
+
+``IMAPClient`` is blocking, so every IMAP command of a session runs on a thread
+of the I/O executor while the event loop moves on to other mailboxes. Ranking
+and online training are CPU bound and run on their own executor, so they never
+hold up the I/O of other users.
+
+Emails of a user are handled exactly as in the polling client: the cycles of a
+user never overlap and mails are ranked and trained on in the order they were
+fetched.
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import logging
+
+from typing import Any, Callable, Dict, List, Optional
+
+from imapclient import IMAPClient
+
+from zippy.client.fetch import Fetcher, fetch_full, get_fetcher
+from zippy.client.idle import DEFAULT_POLL_INTERVAL
+from zippy.client.main import (
+    CLIENT,
+    DEFAULT_FETCH_CHUNK_SIZE,
+    DEFAULT_INTENT_BATCH_SIZE,
+    SEARCH_KEY,
+    EmailAuthUser,
+    EmailFolders,
+    ProcessedMessage,
+    act_on_chunk,
+    chunked,
+    fetch_chunk,
+    get_pool,
+    get_sync_store,
+    get_users,
+    online_train_all,
+    rank_chunk,
+    search_new_emails,
+    warm_up,
+)
+from zippy.client.pool import CONNECTION_ERRORS, IMAPConnectionPool
+from zippy.client.rank_cache import RANK_CACHE
+from zippy.client.sync_state import MailboxSync, SyncStateStore
+from zippy.client.training_ledger import TRAINING_LEDGER
+from zippy.pipeline.model.weight_store import WEIGHTS
+from zippy.utils.config import get_config
+from zippy.utils.log_handler import get_logger
+from zippy.utils.metrics import METRICS
+
+# rankings read snapshots of the weights, but the Keras intent model is not
+# safe to predict with from several threads at once
+DEFAULT_RANK_WORKERS: int = 1
+
+
+class AsyncMailbox:
+    """Async adapter for a logged in session.
+
+    Parameters
+    ----------
+    client: IMAPClient
+        Logged in session
+    executor: concurrent.futures.Executor
+        Executor to run the blocking IMAP commands on
+    """
+
+    def __init__(
+        self, client: IMAPClient, executor: concurrent.futures.Executor
+    ) -> None:
+        self.client = client
+        self.executor = executor
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run ``func(client, *args, **kwargs)`` on the executor."""
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, self.client, *args, **kwargs)
+        )
+
+
+class MailboxEngine:
+    """Process mailboxes of all the users concurrently.
+
+    Parameters
+    ----------
+    users: List[EmailAuthUser]
+        Users whose mailboxes are processed
+    pool: IMAPConnectionPool
+        Pool to borrow sessions from. At most ``max_connections_per_host``
+        mailboxes are processed at once.
+    interval: float, optional
+        Seconds to wait between two cycles of a user
+    rank_workers: int, optional
+        Number of threads used for ranking and online training
+    fetch: Fetcher, optional
+        Function to fetch the emails with, fetches complete emails by default
+    chunk_size: int, optional
+        Number of mails fetched, ranked and trained on at once
+    sync_store: SyncStateStore, optional
+        Store of sync states, to search only mails changed since the last cycle
+    batch_size: int, optional
+        Number of mails whose intent is predicted at once, one by one if not given
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        users: List[EmailAuthUser],
+        pool: IMAPConnectionPool,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        rank_workers: int = DEFAULT_RANK_WORKERS,
+        fetch: Optional[Fetcher] = None,
+        chunk_size: int = DEFAULT_FETCH_CHUNK_SIZE,
+        sync_store: Optional[SyncStateStore] = None,
+        batch_size: Optional[int] = None,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.users = users
+        self.pool = pool
+        self.interval = interval
+        self.fetch = fetch or fetch_full
+        self.chunk_size = chunk_size
+        self.sync_store = sync_store
+        self.batch_size = batch_size
+        self.logger = logger or get_logger(CLIENT)
+        # an in-flight cycle uses at most one I/O thread at a time
+        self.io_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=pool.max_connections_per_host
+        )
+        self.rank_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=rank_workers
+        )
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def _io(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.io_executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def _cpu(self, func: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.rank_executor, functools.partial(func, *args, **kwargs)
+        )
+
+    async def process_chunk(
+        self,
+        mailbox: AsyncMailbox,
+        uids: List[int],
+        checkpoint: Optional[Callable[[List[int]], None]] = None,
+    ) -> Dict[int, ProcessedMessage]:
+        """Fetch and rank the mails in order, then move or flag them."""
+        messages = await mailbox.run(fetch_chunk, uids, self.fetch)
+        processed_msgs = await self._cpu(rank_chunk, messages, self.batch_size)
+        await mailbox.run(act_on_chunk, processed_msgs, self.logger, checkpoint)
+        return processed_msgs
+
+    async def process_mailbox(self, mailbox: AsyncMailbox, user: EmailAuthUser) -> int:
+        """Process new mails of the mailbox chunk by chunk, return their count."""
+        sync = None
+        if self.sync_store is None:
+            uids = await mailbox.run(search_new_emails, self.logger)
+        else:
+            sync = MailboxSync(
+                self.sync_store, user.email_address, EmailFolders.INBOX, self.logger
+            )
+            uids = await mailbox.run(sync.search, SEARCH_KEY)
+
+        count = 0
+        checkpoint = sync.checkpoint if sync is not None else None
+        for chunk in chunked(uids, self.chunk_size):
+            processed_msgs = await self.process_chunk(mailbox, chunk, checkpoint)
+            await self._cpu(online_train_all, processed_msgs)
+            count += len(processed_msgs)
+
+        if sync is not None:
+            await self._io(sync.commit)
+        return count
+
+    async def cycle(self, user: EmailAuthUser):
+        """Process new mails of the user and update the weights."""
+        assert self._slots is not None, "Engine is not running."
+        async with self._slots:
+            client = await self._io(self.pool.acquire, user)
+            discard = False
+            try:
+                await self.process_mailbox(AsyncMailbox(client, self.io_executor), user)
+            except CONNECTION_ERRORS:
+                discard = True
+                raise
+            finally:
+                await self._io(self.pool.release, user, client, discard=discard)
+
+    async def safe_cycle(self, user: EmailAuthUser) -> bool:
+        """Run cycle of the user, logging the errors instead of raising."""
+        try:
+            await self.cycle(user)
+        except Exception:  # pylint: disable=broad-except
+            # failure of one mailbox should not stop the others
+            self.logger.exception("Failed to process emails of %s", user)
+            return False
+        return True
+
+    async def watch(self, user: EmailAuthUser):
+        """Run cycles of the user forever, one after another."""
+        while True:
+            await self.safe_cycle(user)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> List[bool]:
+        """Run a single cycle for all users at once, returning their success."""
+        self._slots = asyncio.Semaphore(self.pool.max_connections_per_host)
+        return await asyncio.gather(*(self.safe_cycle(user) for user in self.users))
+
+    async def run(self):
+        """Watch mailboxes of all users."""
+        self._slots = asyncio.Semaphore(self.pool.max_connections_per_host)
+        await asyncio.gather(*(self.watch(user) for user in self.users))
+
+    def shutdown(self):
+        """Wait for the executors to finish and logout from all sessions."""
+        self.io_executor.shutdown()
+        self.rank_executor.shutdown()
+        self.pool.close_all()
+
+
+def run_async(config: dict, users: List[EmailAuthUser]):
+    """Run engine for the users till interrupted."""
+    warm_up(config)
+    engine = MailboxEngine(
+        users,
+        get_pool(config),
+        interval=config.get("poll_interval", DEFAULT_POLL_INTERVAL),
+        rank_workers=config.get("rank_workers", DEFAULT_RANK_WORKERS),
+        fetch=get_fetcher(config),
+        chunk_size=config.get("fetch_chunk_size", DEFAULT_FETCH_CHUNK_SIZE),
+        sync_store=get_sync_store(config),
+        batch_size=config.get("intent_batch_size", DEFAULT_INTENT_BATCH_SIZE),
+    )
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(engine.run())
+    finally:
+        loop.close()
+        engine.shutdown()
+        WEIGHTS.flush()
+        RANK_CACHE.flush()
+        TRAINING_LEDGER.close()
+        if METRICS.enabled:
+            METRICS.log()
+
+
+if __name__ == "__main__":
+    CLIENT_CONFIG = get_config(CLIENT)
+    run_async(CLIENT_CONFIG, get_users(CLIENT_CONFIG))
@@ -0,0 +1,214 @@
+"""Fetch emails from the server, either fully or only the parts used for ranking.
+
+Ranking only needs a few headers and the ``text/plain`` parts of an email, so
+the partial fetch first asks for ``BODYSTRUCTURE`` and those headers, and then
+peeks into the ``text/plain`` sections only, up to a limit of bytes per email.
+Attachments are never downloaded.
+"""
+import base64
+import binascii
+import email
+import functools
+import quopri
+
+from email.message import Message
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+from imapclient import IMAPClient
+
+FULL_FETCH: str = "full"
+PARTIAL_FETCH: str = "partial"
+
+MESSAGE_FORMAT: bytes = b"RFC822"
+BODYSTRUCTURE: bytes = b"BODYSTRUCTURE"
+# headers used by the ranker and the online training
+HEADER_FIELDS: Tuple[bytes, ...] = (b"FROM", b"TO", b"SUBJECT", b"DATE", b"MESSAGE-ID")
+HEADERS: bytes = b"BODY.PEEK[HEADER.FIELDS (" + b" ".join(HEADER_FIELDS) + b")]"
+HEADERS_SECTION: bytes = b"HEADER.FIELDS"
+
+DEFAULT_MAX_TEXT_BYTES: int = 64 * 1024
+DEFAULT_CHARSET: str = "us-ascii"
+
+# pylint: disable=invalid-name
+Fetcher = Callable[[IMAPClient, Sequence[int]], Dict[int, Message]]
+
+
+class TextPart(NamedTuple):
+    """``text/plain`` section of an email as described by its BODYSTRUCTURE."""
+
+    section: str
+    encoding: str
+    charset: str
+    size: int
+
+
+def fetch_raw(client: IMAPClient, uids: Sequence[int]) -> Dict[int, bytes]:
+    """Fetch complete emails of the selected folder, without parsing them."""
+    return {
+        uid: message_data[MESSAGE_FORMAT]
+        for uid, message_data in client.fetch(uids, [MESSAGE_FORMAT]).items()
+    }
+
+
+def parse_messages(messages: Mapping[int, Union[bytes, Message]]) -> Dict[int, Message]:
+    """Parse fetched emails, emails that are parsed already are kept as is."""
+    return {
+        uid: email.message_from_bytes(data) if isinstance(data, bytes) else data
+        for uid, data in messages.items()
+    }
+
+
+def fetch_full(client: IMAPClient, uids: Sequence[int]) -> Dict[int, Message]:
+    """Fetch complete emails of the selected folder."""
+    return parse_messages(fetch_raw(client, uids))
+
+
+def _lower(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode("ascii", errors="replace").lower()
+    return str(value).lower() if value is not None else ""
+
+
+def _charset(params) -> str:
+    """Return charset from the parameters list of a body part."""
+    params = params or ()
+    for key, value in zip(params[::2], params[1::2]):
+        if _lower(key) == "charset":
+            return _lower(value)
+    return DEFAULT_CHARSET
+
+
+def find_text_parts(body, prefix: str = "") -> List[TextPart]:
+    """Find ``text/plain`` sections in the BODYSTRUCTURE, in the order of the email.
+
+    Emails attached as ``message/rfc822`` are not looked into.
+    """
+    if isinstance(body[0], list):
+        parts: List[TextPart] = []
+        for number, part in enumerate(body[0], start=1):
+            parts.extend(find_text_parts(part, f"{prefix}{number}."))
+        return parts
+
+    if (_lower(body[0]), _lower(body[1])) != ("text", "plain"):
+        return []
+    # a non-multipart email has its body as the first section
+    section = prefix.rstrip(".") or "1"
+    return [TextPart(section, _lower(body[5]), _charset(body[2]), int(body[6] or 0))]
+
+
+def plan_sections(parts: List[TextPart], max_bytes: int) -> Tuple[Tuple[str, int], ...]:
+    """Return sections and number of bytes to fetch of each, within the limit."""
+    plan = []
+    remaining = max_bytes
+    for part in parts:
+        length = min(part.size, remaining)
+        if length <= 0:
+            break
+        plan.append((part.section, length))
+        remaining -= length
+    return tuple(plan)
+
+
+def decode_text(data: bytes, part: TextPart) -> str:
+    """Decode content transfer encoding and charset of a (truncated) section."""
+    if part.encoding == "base64":
+        data = b"".join(data.split())
+        # fetch might have ended in the middle of a base64 quantum
+        data = data[: len(data) - len(data) % 4]
+        try:
+            data = base64.b64decode(data)
+        except binascii.Error:
+            pass
+    elif part.encoding == "quoted-printable":
+        data = quopri.decodestring(data)
+
+    try:
+        return data.decode(part.charset, errors="replace")
+    except LookupError:
+        return data.decode(DEFAULT_CHARSET, errors="replace")
+
+
+def _get_section(message_data: dict, section: bytes) -> bytes:
+    """Return fetched section, whatever the server's formatting of the key is."""
+    prefix = b"BODY[" + section
+    for key, value in message_data.items():
+        if key.upper().startswith(prefix):
+            return value or b""
+    return b""
+
+
+def fetch_partial(
+    client: IMAPClient,
+    uids: Sequence[int],
+    max_text_bytes: int = DEFAULT_MAX_TEXT_BYTES,
+) -> Dict[int, Message]:
+    """Fetch headers used for ranking and at most ``max_text_bytes`` of text.
+
+    Returned emails only have those headers and the text of all ``text/plain``
+    parts, transfer-decoded, as a single ``text/plain`` payload.
+    """
+    structures = client.fetch(uids, [BODYSTRUCTURE, HEADERS])
+
+    text_parts: Dict[int, List[TextPart]] = {}
+    # emails with same structure are fetched together in a single command
+    plans: Dict[Tuple[Tuple[str, int], ...], List[int]] = {}
+    for uid, message_data in structures.items():
+        text_parts[uid] = find_text_parts(message_data[BODYSTRUCTURE])
+        plan = plan_sections(text_parts[uid], max_text_bytes)
+        plans.setdefault(plan, []).append(uid)
+
+    texts: Dict[int, Dict[str, bytes]] = {uid: {} for uid in structures}
+    for plan, plan_uids in plans.items():
+        if not plan:
+            continue
+        items = [
+            f"BODY.PEEK[{section}]<0.{length}>".encode() for section, length in plan
+        ]
+        for uid, message_data in client.fetch(plan_uids, items).items():
+            texts[uid] = {
+                section: _get_section(message_data, section.encode() + b"]")
+                for section, _ in plan
+            }
+
+    messages: Dict[int, Message] = {}
+    for uid, message_data in structures.items():
+        message = email.message_from_bytes(_get_section(message_data, HEADERS_SECTION))
+        message.set_payload(
+            "".join(
+                decode_text(texts[uid][part.section], part)
+                for part in text_parts[uid]
+                if part.section in texts[uid]
+            )
+        )
+        messages[uid] = message
+    return messages
+
+
+def get_fetcher(config: Optional[dict] = None, parse: bool = True) -> Fetcher:
+    """Return fetch function for the ``fetch_mode`` of the config.
+
+    If ``parse`` is false, complete emails are returned as bytes, to be parsed
+    later with ``parse_messages``.
+    """
+    config = config or {}
+    mode = config.get("fetch_mode", FULL_FETCH)
+    if mode == FULL_FETCH:
+        return fetch_full if parse else fetch_raw
+    if mode == PARTIAL_FETCH:
+        return functools.partial(
+            fetch_partial,
+            max_text_bytes=config.get("max_text_bytes", DEFAULT_MAX_TEXT_BYTES),
+        )
+    raise ValueError(
+        f"Unknown fetch_mode '{mode}'. Use '{FULL_FETCH}' or '{PARTIAL_FETCH}'."
+    )
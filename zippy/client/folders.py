@@ -0,0 +1,99 @@
+"""Remember folders of a session, so that they are not created on every cycle.
+
+Folders of a session are listed once with a single ``LIST`` and only the
+missing ones are created. If a ``MOVE`` fails with ``TRYCREATE``, the folder
+was deleted meanwhile, so the session's folders are listed again and the
+destination is created before retrying.
+"""
+import logging
+import threading
+import weakref
+
+from typing import Iterable, List, Set, Union
+
+from imapclient import IMAPClient
+from imapclient.exceptions import IMAPClientError
+
+TRYCREATE: str = "TRYCREATE"
+
+
+def is_trycreate(exc_info: IMAPClientError) -> bool:
+    """Check if server asked to create the destination folder first."""
+    return TRYCREATE in str(exc_info).upper()
+
+
+def _folder_name(name: Union[str, bytes]) -> str:
+    if isinstance(name, bytes):
+        return name.decode("utf-8", errors="replace")
+    return name
+
+
+class FolderRegistry:
+    """Folders known to exist, for each session.
+
+    Sessions are not kept alive by the registry; folders of a session are
+    forgotten once it is garbage collected.
+    """
+
+    def __init__(self) -> None:
+        self._folders: "weakref.WeakKeyDictionary[IMAPClient, Set[str]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._lock = threading.Lock()
+
+    def folders(self, client: IMAPClient) -> Set[str]:
+        """Return folders of the session, listing them on first use."""
+        with self._lock:
+            folders = self._folders.get(client)
+        if folders is None:
+            folders = {_folder_name(name) for _, _, name in client.list_folders()}
+            with self._lock:
+                self._folders[client] = folders
+        return folders
+
+    def invalidate(self, client: IMAPClient):
+        """Forget folders of the session, to list them again on next use."""
+        with self._lock:
+            self._folders.pop(client, None)
+
+    def ensure(
+        self, client: IMAPClient, folders: Iterable[str], logger: logging.Logger
+    ) -> List[str]:
+        """Create folders missing in the session, return the created ones."""
+        known = self.folders(client)
+        created = []
+        for folder in folders:
+            if folder in known:
+                continue
+            try:
+                client.create_folder(folder)
+            except IMAPClientError:
+                # created by another session since the LIST
+                logger.info("Looks like the folder %s already exists.", folder)
+            else:
+                logger.info("Created folder %s.", folder)
+                created.append(folder)
+            known.add(folder)
+        return created
+
+    def move(
+        self,
+        client: IMAPClient,
+        uids: Union[int, List[int]],
+        folder: str,
+        logger: logging.Logger,
+    ):
+        """Move mails of the selected folder, creating the folder if it is gone."""
+        try:
+            client.move(uids, folder)
+        except IMAPClientError as exc_info:
+            if not is_trycreate(exc_info):
+                raise
+            logger.warning("Folder %s is missing, creating it again.", folder)
+            self.invalidate(client)
+            self.ensure(client, [folder], logger)
+            client.move(uids, folder)
+
+
+# folders of all sessions of the process
+FOLDERS = FolderRegistry()
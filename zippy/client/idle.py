@@ -0,0 +1,205 @@
+"""Push mode that waits for new emails with IMAP IDLE instead of polling."""
+import logging
+import threading
+import time
+
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Tuple
+
+from imapclient import IMAPClient
+
+from zippy.client.pool import CONNECTION_ERRORS, IMAPConnectionPool
+from zippy.utils.log_handler import get_logger
+
+if TYPE_CHECKING:  # pragma: no cover
+    from zippy.client.main import EmailAuthUser  # noqa: F401
+
+IDLE_CAPABILITY: str = "IDLE"
+EXISTS_RESPONSE: bytes = b"EXISTS"
+UIDNEXT_RESPONSE: bytes = b"UIDNEXT"
+
+# RFC 2177 asks clients to re-issue IDLE at least every 29 minutes
+DEFAULT_IDLE_TIMEOUT: float = 29 * 60
+DEFAULT_POLL_INTERVAL: float = 10
+DEFAULT_RETRY_DELAY: float = 30
+# how long a single wait for responses blocks, bounds the time taken to stop
+IDLE_CHECK_TIMEOUT: float = 5
+
+
+def has_new_mails(responses: List[Tuple]) -> bool:
+    """Check if IDLE responses notify about new messages in the folder."""
+    return any(
+        len(response) > 1 and response[1] == EXISTS_RESPONSE for response in responses
+    )
+
+
+def mailbox_state(status: dict) -> Any:
+    """Return what changes in the status of a selected folder when mails arrive.
+
+    ``UIDNEXT`` only grows with new mails, while ``EXISTS`` also shrinks when
+    mails are moved away, so it is only used by servers without ``UIDNEXT``.
+    """
+    uidnext = status.get(UIDNEXT_RESPONSE)
+    if uidnext is not None:
+        return uidnext
+    return status.get(EXISTS_RESPONSE)
+
+
+class MailboxWatcher(threading.Thread):
+    """Run handler for the mailbox whenever the server notifies about new emails.
+
+    Falls back to polling every ``poll_interval`` seconds if the server does not
+    have the IDLE capability.
+
+    Parameters
+    ----------
+    user: EmailAuthUser
+        User whose mailbox is watched
+    pool: IMAPConnectionPool
+        Pool to borrow session of the user from. The session stays borrowed as
+        long as the mailbox is watched.
+    handler: Callable
+        Called with the logged in client and the user, once on start and on
+        every notification
+    folder: str, optional
+        Folder to watch
+    idle_timeout: float, optional
+        Seconds after which IDLE is re-issued
+    poll_interval: float, optional
+        Seconds between polls if IDLE is not supported
+    retry_delay: float, optional
+        Seconds to wait before reconnecting after errors
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        user: "EmailAuthUser",
+        pool: IMAPConnectionPool,
+        handler: Callable[[IMAPClient, "EmailAuthUser"], Any],
+        folder: str = "INBOX",
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        retry_delay: float = DEFAULT_RETRY_DELAY,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        super().__init__(name=f"watcher-{user.email_address}", daemon=True)
+        self.user = user
+        self.pool = pool
+        self.handler = handler
+        self.folder = folder
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.retry_delay = retry_delay
+        self.logger = logger or get_logger("client")
+        self.supports_idle: Optional[bool] = None
+        self._stopped = threading.Event()
+
+    def stop(self):
+        """Stop watching after the current wait."""
+        self._stopped.set()
+
+    def run(self):
+        """Watch the mailbox till stopped, reconnecting on errors."""
+        while not self._stopped.is_set():
+            try:
+                with self.pool.session(self.user) as client:
+                    self.supports_idle = client.has_capability(IDLE_CAPABILITY)
+                    if self.supports_idle:
+                        self._watch(client)
+                    else:
+                        self.handler(client, self.user)
+            except CONNECTION_ERRORS:
+                self.logger.exception(
+                    "Lost connection while watching %s, retrying.", self.user
+                )
+                self._stopped.wait(self.retry_delay)
+            except Exception:  # pylint: disable=broad-except
+                # keep the thread alive, there is no one to report to
+                self.logger.exception(
+                    "Failed to process new emails of %s, retrying.", self.user
+                )
+                self._stopped.wait(self.retry_delay)
+            else:
+                if not self.supports_idle:
+                    self.logger.debug(
+                        "IDLE not supported, polling %s again in %s seconds.",
+                        self.user,
+                        self.poll_interval,
+                    )
+                    self._stopped.wait(self.poll_interval)
+
+    def _watch(self, client: IMAPClient):
+        """Idle on the folder and run handler on new emails.
+
+        The handler runs whenever IDLE notifies about new emails or the status
+        of the folder changed since the handler last ran, so emails arriving
+        while the handler runs, before IDLE is issued again, are not missed.
+        """
+        # catch up with the emails that arrived while not watching
+        notified = True
+        seen = None
+        while not self._stopped.is_set():
+            state = mailbox_state(client.select_folder(self.folder, readonly=True))
+            if notified or state != seen:
+                # status from before the handler, so mails arriving meanwhile
+                # show up as a change on the next select
+                seen = state
+                notified = False
+                self.handler(client, self.user)
+                continue
+
+            client.idle()
+            self.logger.debug("Waiting for new emails of %s", self.user)
+            try:
+                responses = self._wait(client)
+            finally:
+                client.idle_done()
+
+            notified = has_new_mails(responses)
+            if notified:
+                self.logger.info("New emails arrived for %s", self.user)
+
+    def _wait(self, client: IMAPClient) -> List[Tuple]:
+        """Wait for responses in IDLE till timeout or stopped."""
+        started = time.monotonic()
+        while not self._stopped.is_set():
+            responses = client.idle_check(timeout=IDLE_CHECK_TIMEOUT)
+            if responses:
+                return responses
+            if time.monotonic() - started > self.idle_timeout:
+                break
+        return []
+
+
+def watch_mailboxes(
+    config: dict,
+    users: List["EmailAuthUser"],
+    pool: IMAPConnectionPool,
+    handler: Callable[[IMAPClient, "EmailAuthUser"], Any],
+    logger: Optional[logging.Logger] = None,
+) -> List[MailboxWatcher]:
+    """Start watching mailboxes of all the users."""
+    logger = logger or get_logger("client")
+    if len(users) > pool.max_connections_per_host:
+        logger.warning(
+            "Only %s of %s mailboxes can be watched at once. "
+            "Increase 'max_connections_per_host'.",
+            pool.max_connections_per_host,
+            len(users),
+        )
+
+    watchers = [
+        MailboxWatcher(
+            user,
+            pool,
+            handler,
+            idle_timeout=config.get("idle_timeout", DEFAULT_IDLE_TIMEOUT),
+            poll_interval=config.get("poll_interval", DEFAULT_POLL_INTERVAL),
+            logger=logger,
+        )
+        for user in users
+    ]
+    for watcher in watchers:
+        watcher.start()
+    return watchers
@@ -1,13 +1,14 @@
 #! /usr/bin/env python3
 """Client that fetches new emails."""
-import email
+
 import functools
 import logging
 import socket
 import ssl
 import time
 
-from typing import Callable, Dict, List, NamedTuple, Optional
+from email.message import Message
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional
 
 import pandas as pd
 import schedule
@@ -15,10 +16,30 @@ import schedule
 from imapclient import IMAPClient
 from imapclient.exceptions import IMAPClientError, LoginError
 
-from zippy.pipeline.model.rank_message import rank_message
+from zippy.client.fetch import Fetcher, fetch_full, get_fetcher
+from zippy.client.folders import FOLDERS
+from zippy.client.idle import DEFAULT_POLL_INTERVAL, watch_mailboxes
+from zippy.client.pool import (
+    DEFAULT_MAX_CONNECTIONS_PER_HOST,
+    DEFAULT_MAX_IDLE_TIME,
+    IMAPConnectionPool,
+)
+from zippy.client.rank_cache import RANK_CACHE, CachedRank
+from zippy.client.sync_state import MailboxSync, SyncStateStore, enable_condstore
+from zippy.client.training_ledger import TRAINING_LEDGER
+from zippy.pipeline.data import parse_email
+from zippy.pipeline.features.analyzer import get_analyzer
+from zippy.pipeline.model.intent import INTENT_MODELS
+from zippy.pipeline.model.rank_message import (
+    DEFAULT_INTENT_BATCH_SIZE,
+    rank_message,
+    rank_messages,
+)
 from zippy.pipeline.model.update_dataset import online_training
+from zippy.pipeline.model.weight_store import WEIGHTS
 from zippy.utils.config import get_config
 from zippy.utils.log_handler import get_logger
+from zippy.utils.metrics import METRICS
 
 
 # pylint: disable=no-member
@@ -54,11 +75,16 @@ class ProcessedMessage(NamedTuple):
 
 
 CLIENT: str = "client"
+POLL_MODE: str = "poll"
+PUSH_MODE: str = "push"
+ASYNC_MODE: str = "async"
+PIPELINE_MODE: str = "pipeline"
 OUTPUT: str = "output"
 USERS: str = "users"
 FLAG_TO_CHECK: bytes = b"processed"
 SEEN_FLAG: bytes = b"\\Seen"
-MESSAGE_FORMAT: bytes = b"RFC822"
+SEARCH_KEY: bytes = b"UNSEEN UNKEYWORD " + FLAG_TO_CHECK
+DEFAULT_FETCH_CHUNK_SIZE: int = 100
 
 
 def get_users(client_config) -> List[EmailAuthUser]:
@@ -135,50 +161,10 @@ def create_folder_if_not_exists(
         logger.info("Looks like the folder %s already exists.", folder)
 
 
-def shift_mail(
-    client: IMAPClient, uid: int, source: str, destination: str, logger: logging.Logger
-):
-    """Shift mail with given uid to given destination folder."""
-    try:
-        client.select_folder(source, readonly=True)
-        client.move(uid, destination)
-    except IMAPClientError as exc_info:
-        # most likely the folder doesnot exists
-        logger.exception(
-            "Failed email (uid: %s) to move to %s folder: %s",
-            uid,
-            destination,
-            str(exc_info),
-        )
-    else:
-        logger.info("Email (uid: %s) moved to %s folder.", uid, destination)
-
-
-def mark_processed(client: IMAPClient, uid: int, logger: logging.Logger):
-    """Add flags to not check the emails again."""
-    client.select_folder(EmailFolders.INBOX)
-    flags = client.get_flags(uid)
-
-    if uid not in flags:
-        logger.warn("Mail with uid: %s does not exist", uid)
-        return
-    if FLAG_TO_CHECK not in flags.get(uid):
-        flags = client.add_flags(uid, FLAG_TO_CHECK)
-        if uid not in flags:
-            logger.warn(
-                "Mail (uid: %s) could not added " "Weights might get updated twice", uid
-            )
-        else:
-            logger.info("Flag added to %s", uid)
-
-
-def process_mail(
-    client: IMAPClient, uid: int, message_data: dict, logger: logging.Logger
-) -> ProcessedMessage:
-    """Process mail."""
+def log_rank(uid: int, email_message: Message, ranked: list) -> ProcessedMessage:
+    """Log the outcome of ranking the mail."""
     output = get_logger(OUTPUT)
-    email_message = email.message_from_bytes(message_data[MESSAGE_FORMAT])
-    *msg, threshold = rank_message(email_message)
+    *msg, threshold = ranked
     processed_msg = ProcessedMessage(*msg)
     output.info(
         {
@@ -192,46 +178,240 @@ def process_mail(
             "threshold": threshold,
         }
     )
+    return processed_msg
+
+
+def cached_rank(email_message: Message) -> Optional[list]:
+    """Return outcome of ranking the mail before, like ``rank_message``, if any."""
+    cached = RANK_CACHE.get(email_message)
+    if cached is None:
+        return None
+    msg = pd.DataFrame(parse_email.get_from_message(email_message))
+    return [msg, *cached]
+
+
+def cache_rank(email_message: Message, ranked: list):
+    """Keep outcome of ranking the mail, to reuse it if seen again."""
+    _, *outcome = ranked
+    RANK_CACHE.put(email_message, CachedRank(*outcome))
+
+
+def rank_mail(uid: int, email_message: Message) -> ProcessedMessage:
+    """Rank the mail, unless it was ranked before, and log the outcome."""
+    ranked = cached_rank(email_message)
+    if ranked is None:
+        ranked = rank_message(email_message)
+        cache_rank(email_message, ranked)
+    else:
+        get_logger(CLIENT).debug("Reusing rank of mail (uid: %s)", uid)
+    return log_rank(uid, email_message, ranked)
+
+
+def rank_mails(
+    email_messages: Dict[int, Message], batch_size: Optional[int] = None
+) -> Dict[int, ProcessedMessage]:
+    """Rank the mails in order and log the outcomes.
+
+    If ``batch_size`` is given, intent of that many mails is predicted at once.
+    """
+    if not batch_size:
+        return {
+            uid: rank_mail(uid, email_message)
+            for uid, email_message in email_messages.items()
+        }
+    ranked = {
+        uid: cached_rank(email_message) for uid, email_message in email_messages.items()
+    }
+    new_messages = {
+        uid: email_message
+        for uid, email_message in email_messages.items()
+        if ranked[uid] is None
+    }
+    if new_messages:
+        new_ranked = rank_messages(list(new_messages.values()), batch_size)
+        for (uid, email_message), ranked_msg in zip(new_messages.items(), new_ranked):
+            cache_rank(email_message, ranked_msg)
+            ranked[uid] = ranked_msg
+    return {
+        uid: log_rank(uid, email_message, ranked[uid])
+        for uid, email_message in email_messages.items()
+    }
+
+
+def get_destination(processed_msg: ProcessedMessage) -> Optional[str]:
+    """Return folder the mail should be moved to, if any."""
     if processed_msg.important and not processed_msg.intent:
-        shift_mail(
-            client=client,
-            uid=uid,
-            source=EmailFolders.INBOX,
-            destination=EmailFolders.IMPORTANT,
-            logger=logger,
+        return EmailFolders.IMPORTANT
+    if processed_msg.important and processed_msg.intent:
+        return EmailFolders.URGENT
+    return None
+
+
+def shift_mails(
+    client: IMAPClient, uids: List[int], destination: str, logger: logging.Logger
+) -> List[int]:
+    """Shift mails with given uids of selected folder to destination, at once.
+
+    Destination is created again if it was deleted. Return uids of the mails
+    moved, none if the move failed.
+    """
+    try:
+        FOLDERS.move(client, uids, destination, logger)
+    except IMAPClientError as exc_info:
+        # most likely the folder doesnot exists
+        logger.exception(
+            "Failed emails (uids: %s) to move to %s folder: %s",
+            uids,
+            destination,
+            str(exc_info),
         )
-    elif processed_msg.important and processed_msg.intent:
-        shift_mail(
-            client=client,
-            uid=uid,
-            source=EmailFolders.INBOX,
-            destination=EmailFolders.URGENT,
-            logger=logger,
+        return []
+    logger.info("Emails (uids: %s) moved to %s folder.", uids, destination)
+    return uids
+
+
+def mark_all_processed(
+    client: IMAPClient, uids: List[int], logger: logging.Logger
+) -> List[int]:
+    """Add flags to all mails of selected folder to not check them again.
+
+    Return uids of the mails flagged.
+    """
+    flags = client.add_flags(uids, [FLAG_TO_CHECK])
+    missing = [uid for uid in uids if uid not in flags]
+    if missing:
+        logger.warning(
+            "Mails (uids: %s) could not be flagged. Weights might get updated twice",
+            missing,
         )
-    else:
-        mark_processed(client=client, uid=uid, logger=logger)
+    flagged = [uid for uid in uids if uid in flags]
+    if flagged:
+        logger.info("Flag added to %s", flagged)
+    return flagged
 
-    return processed_msg
+
+def apply_actions(
+    client: IMAPClient,
+    processed_msgs: Dict[int, ProcessedMessage],
+    logger: logging.Logger,
+) -> List[int]:
+    """Move or flag all processed mails, with one command per destination.
+
+    Return uids of the mails moved or flagged, in order.
+    """
+    if not processed_msgs:
+        return []
+
+    destinations: Dict[Optional[str], List[int]] = {}
+    for uid, processed_msg in processed_msgs.items():
+        destinations.setdefault(get_destination(processed_msg), []).append(uid)
+
+    client.select_folder(EmailFolders.INBOX)
+    handled: List[int] = []
+    for destination in (EmailFolders.IMPORTANT, EmailFolders.URGENT):
+        if destination in destinations:
+            handled.extend(
+                shift_mails(client, destinations[destination], destination, logger)
+            )
+    if None in destinations:
+        handled.extend(mark_all_processed(client, destinations[None], logger))
+    return sorted(handled)
+
+
+def chunked(uids: List[int], chunk_size: Optional[int]) -> Iterator[List[int]]:
+    """Split uids into chunks of given size, or a single chunk if not given."""
+    if not chunk_size:
+        chunk_size = len(uids) or 1
+    for start in range(0, len(uids), chunk_size):
+        end = start + chunk_size
+        yield uids[start:end]
+
+
+def fetch_chunk(
+    client: IMAPClient, uids: List[int], fetch: Optional[Fetcher] = None
+) -> Dict[int, Message]:
+    """Fetch a chunk of mails of the inbox, without marking them seen."""
+    # actions select the folder read-write, where fetch would mark mails seen
+    client.select_folder(EmailFolders.INBOX, readonly=True)
+    with METRICS.timer("mail.fetch"):
+        return (fetch or fetch_full)(client, uids)
+
+
+def rank_chunk(
+    email_messages: Dict[int, Message], batch_size: Optional[int] = None
+) -> Dict[int, ProcessedMessage]:
+    """Rank a chunk of mails in order and log the outcomes."""
+    with METRICS.timer("mail.rank"):
+        return rank_mails(email_messages, batch_size)
+
+
+def act_on_chunk(
+    client: IMAPClient,
+    processed_msgs: Dict[int, ProcessedMessage],
+    logger: logging.Logger,
+    checkpoint: Optional[Callable[[List[int]], None]] = None,
+) -> List[int]:
+    """Move or flag a chunk of ranked mails, then checkpoint the handled ones.
+
+    Return uids of the mails moved or flagged.
+    """
+    with METRICS.timer("mail.act"):
+        handled = apply_actions(client, processed_msgs, logger)
+    if checkpoint is not None:
+        checkpoint(handled)
+    return handled
+
+
+def iter_process_mails(
+    client: IMAPClient,
+    uids: List[int],
+    logger: logging.Logger,
+    fetch: Optional[Fetcher] = None,
+    chunk_size: Optional[int] = DEFAULT_FETCH_CHUNK_SIZE,
+    checkpoint: Optional[Callable[[List[int]], None]] = None,
+    batch_size: Optional[int] = None,
+) -> Iterator[Dict[int, ProcessedMessage]]:
+    """Retrieve, rank, and move or flag mails chunk by chunk.
+
+    Only a chunk of mails is held in memory at once. Mails of a chunk are
+    moved or flagged before the next chunk is fetched, so they are not
+    processed again if the cycle is interrupted. ``checkpoint`` is called with
+    the uids of the mails of every chunk that were moved or flagged once that
+    is done. Intent of ``batch_size`` mails of a chunk is predicted at once, if
+    given.
+    """
+    if isinstance(uids, int):
+        # a single uid is accepted as well, like IMAPClient does
+        uids = [uids]
+    done = 0
+    for chunk in chunked(list(uids), chunk_size):
+        email_messages = fetch_chunk(client, chunk, fetch)
+        processed_msgs = rank_chunk(email_messages, batch_size)
+        act_on_chunk(client, processed_msgs, logger, checkpoint)
+        done += len(chunk)
+        logger.debug("Processed %s of %s mails.", done, len(uids))
+        yield processed_msgs
 
 
 def process_mails(
-    client: IMAPClient, uids: List[int], logger: logging.Logger
+    client: IMAPClient,
+    uids: List[int],
+    logger: logging.Logger,
+    fetch: Optional[Fetcher] = None,
+    chunk_size: Optional[int] = None,
+    batch_size: Optional[int] = None,
 ) -> Dict[int, ProcessedMessage]:
-    """Retrieve all mails and process them, one by one."""
-    client.select_folder(EmailFolders.INBOX, readonly=True)
+    """Retrieve and rank all mails, then move or flag them together."""
     processed_msgs: Dict[int, ProcessedMessage] = {}
-    for uid, message_data in client.fetch(uids, MESSAGE_FORMAT).items():
-        processed_msgs[uid] = process_mail(client, uid, message_data, logger)
-
+    for processed_chunk in iter_process_mails(
+        client, uids, logger, fetch, chunk_size, batch_size=batch_size
+    ):
+        processed_msgs.update(processed_chunk)
     return processed_msgs
 
 
-def retrieve_new_emails(
-    client: IMAPClient, user: EmailAuthUser, logger: Optional[logging.Logger] = None
-) -> List[int]:
-    """Retrieve new unseen emails for the user."""
-    logger = logger or get_logger(CLIENT)
-    mails: List[int] = []
+def login(client: IMAPClient, user: EmailAuthUser, logger: logging.Logger):
+    """Login the user, shutting down the connection on failure."""
     try:
         client.login(user.email_address, user.password)
         logger.info("Logged in successful for %s", user)
@@ -249,25 +429,128 @@ def retrieve_new_emails(
         logger.exception("Unknown Exception occured. %s", str(exc_info))
         client.shutdown()
         raise
-    else:
 
-        create_folder_if_not_exists(client, EmailFolders.IMPORTANT, logger)
-        create_folder_if_not_exists(client, EmailFolders.URGENT, logger)
 
-        search_key = b"UNSEEN UNKEYWORD " + FLAG_TO_CHECK
+def search_new_emails(client: IMAPClient, logger: logging.Logger) -> List[int]:
+    """Search unseen emails in the inbox that have not been processed yet."""
+    client.select_folder(EmailFolders.INBOX, readonly=True)
+
+    logger.debug("Searching for unseen emails flagged '%s'", FLAG_TO_CHECK)
+    return client.search(SEARCH_KEY)
+
+
+def retrieve_new_emails(
+    client: IMAPClient, user: EmailAuthUser, logger: Optional[logging.Logger] = None
+) -> List[int]:
+    """Retrieve new unseen emails for the user."""
+    logger = logger or get_logger(CLIENT)
+    login(client, user, logger)
+
+    FOLDERS.ensure(client, [EmailFolders.IMPORTANT, EmailFolders.URGENT], logger)
 
-        client.select_folder(EmailFolders.INBOX, readonly=True)
+    return search_new_emails(client, logger)
 
-        logger.debug("Searching for unseen emails flagged '%s'", FLAG_TO_CHECK)
-        mails = client.search(search_key)
 
-    return mails
+def connect_user(
+    config: dict, user: EmailAuthUser, logger: Optional[logging.Logger] = None
+) -> IMAPClient:
+    """Open a new session for the user, ready to process mails."""
+    logger = logger or get_logger(CLIENT)
+    client = get_client(config, logger=logger)
+    login(client, user, logger)
+    enable_condstore(client, logger)
+
+    FOLDERS.ensure(client, [EmailFolders.IMPORTANT, EmailFolders.URGENT], logger)
+    return client
+
+
+def get_pool(
+    config: dict, logger: Optional[logging.Logger] = None
+) -> IMAPConnectionPool:
+    """Return pool that keeps sessions of the configured users alive."""
+    logger = logger or get_logger(CLIENT)
+    return IMAPConnectionPool(
+        functools.partial(connect_user, config, logger=logger),
+        host=config["hostname"],
+        max_connections_per_host=config.get(
+            "max_connections_per_host", DEFAULT_MAX_CONNECTIONS_PER_HOST
+        ),
+        max_idle_time=config.get("max_idle_time", DEFAULT_MAX_IDLE_TIME),
+        logger=logger,
+    )
 
 
 def online_train_all(processed_messages: Dict[int, ProcessedMessage]):
-    """Update weights from processed messages."""
-    for _, train_args in processed_messages.items():
+    """Update weights from processed messages not trained on before."""
+    for uid, train_args in processed_messages.items():
+        if TRAINING_LEDGER.trained(train_args.msg):
+            get_logger(CLIENT).debug("Mail (uid: %s) was trained on already", uid)
+            continue
         online_training(*train_args)
+        TRAINING_LEDGER.add(train_args.msg)
+    METRICS.log_if_due()
+
+
+def process_and_train(
+    client: IMAPClient,
+    uids: List[int],
+    logger: logging.Logger,
+    fetch: Optional[Fetcher] = None,
+    chunk_size: Optional[int] = DEFAULT_FETCH_CHUNK_SIZE,
+    checkpoint: Optional[Callable[[List[int]], None]] = None,
+    batch_size: Optional[int] = None,
+) -> int:
+    """Process mails and update weights chunk by chunk, return number of mails."""
+    count = 0
+    for processed_messages in iter_process_mails(
+        client, uids, logger, fetch, chunk_size, checkpoint, batch_size
+    ):
+        online_train_all(processed_messages)
+        count += len(processed_messages)
+    return count
+
+
+def process_new_emails(
+    client: IMAPClient,
+    user: EmailAuthUser,
+    logger: Optional[logging.Logger] = None,
+    fetch: Optional[Fetcher] = None,
+    chunk_size: Optional[int] = DEFAULT_FETCH_CHUNK_SIZE,
+    sync_store: Optional[SyncStateStore] = None,
+    batch_size: Optional[int] = None,
+) -> int:
+    """Process new emails of the user's logged in client and update weights.
+
+    If ``sync_store`` is given, only mails that changed since the last call are
+    searched.
+    """
+    logger = logger or get_logger(CLIENT)
+    if sync_store is None:
+        unprocessed_mails = search_new_emails(client, logger)
+        return process_and_train(
+            client, unprocessed_mails, logger, fetch, chunk_size, batch_size=batch_size
+        )
+
+    sync = MailboxSync(sync_store, user.email_address, EmailFolders.INBOX, logger)
+    unprocessed_mails = sync.search(client, SEARCH_KEY)
+    count = process_and_train(
+        client,
+        unprocessed_mails,
+        logger,
+        fetch,
+        chunk_size,
+        sync.checkpoint,
+        batch_size,
+    )
+    sync.commit()
+    return count
+
+
+def get_sync_store(config: dict) -> Optional[SyncStateStore]:
+    """Return store for sync states if incremental search is enabled."""
+    if config.get("incremental_search", False):
+        return SyncStateStore()
+    return None
 
 
 @with_logging
@@ -276,21 +559,118 @@ def main(
     user: EmailAuthUser,
     client: Optional[IMAPClient] = None,
     logger: Optional[logging.Logger] = None,
+    pool: Optional[IMAPConnectionPool] = None,
+    sync_store: Optional[SyncStateStore] = None,
 ):
     """Handle all updates for a specific users."""
     logger = logger or get_logger(CLIENT)
+    fetch = get_fetcher(config)
+    chunk_size = config.get("fetch_chunk_size", DEFAULT_FETCH_CHUNK_SIZE)
+    batch_size = config.get("intent_batch_size", DEFAULT_INTENT_BATCH_SIZE)
+    if pool is not None:
+        with pool.session(user) as pooled_client:
+            process_new_emails(
+                pooled_client,
+                user,
+                logger,
+                fetch=fetch,
+                chunk_size=chunk_size,
+                sync_store=sync_store,
+                batch_size=batch_size,
+            )
+        return
+
     client = client or get_client(config, logger=logger)
     with client:
         unprocessed_mails = retrieve_new_emails(client, user, logger)
-        processed_messages = process_mails(client, unprocessed_mails, logger)
-        online_train_all(processed_messages)
+        process_and_train(
+            client, unprocessed_mails, logger, fetch, chunk_size, batch_size=batch_size
+        )
 
 
-if __name__ == "__main__":
-    CLIENT_CONFIG = get_config(CLIENT)
-    for email_user in get_users(CLIENT_CONFIG):
-        schedule.every(10).seconds.do(main, CLIENT_CONFIG, email_user)
+def run_polling(config: dict, users: List[EmailAuthUser], pool: IMAPConnectionPool):
+    """Check mailboxes of all users every ``poll_interval`` seconds."""
+    interval = config.get("poll_interval", DEFAULT_POLL_INTERVAL)
+    sync_store = get_sync_store(config)
+    for user in users:
+        schedule.every(interval).seconds.do(
+            main, config, user, pool=pool, sync_store=sync_store
+        )
 
     while True:
         schedule.run_pending()
         time.sleep(1)
+
+
+def run_push(
+    config: dict,
+    users: List[EmailAuthUser],
+    pool: IMAPConnectionPool,
+    logger: Optional[logging.Logger] = None,
+):
+    """Process new emails as soon as the server notifies about them."""
+    logger = logger or get_logger(CLIENT)
+    handler = functools.partial(
+        process_new_emails,
+        logger=logger,
+        fetch=get_fetcher(config),
+        chunk_size=config.get("fetch_chunk_size", DEFAULT_FETCH_CHUNK_SIZE),
+        sync_store=get_sync_store(config),
+        batch_size=config.get("intent_batch_size", DEFAULT_INTENT_BATCH_SIZE),
+    )
+    watchers = watch_mailboxes(config, users, pool, handler, logger=logger)
+    try:
+        for watcher in watchers:
+            watcher.join()
+    finally:
+        for watcher in watchers:
+            watcher.stop()
+        for watcher in watchers:
+            watcher.join()
+
+
+def warm_up(config: Optional[dict] = None):
+    """Configure the components of the process and load models once.
+
+    Models are loaded before the first email has to wait for them.
+    """
+    if config is not None:
+        for component in (INTENT_MODELS, WEIGHTS, METRICS, RANK_CACHE, TRAINING_LEDGER):
+            component.configure(config)
+    INTENT_MODELS.get()
+    get_analyzer()
+
+
+def run_client(config: dict, users: List[EmailAuthUser]):
+    """Process emails of the users in the configured ``mode`` till interrupted."""
+    mode = config.get("mode", POLL_MODE)
+    # pylint: disable=import-outside-toplevel
+    if mode == ASYNC_MODE:
+        from zippy.client.async_engine import run_async
+
+        run_async(config, users)
+        return
+    if mode == PIPELINE_MODE:
+        from zippy.client.pipeline import run_pipeline
+
+        run_pipeline(config, users)
+        return
+    warm_up(config)
+    pool = get_pool(config)
+    try:
+        if mode == PUSH_MODE:
+            run_push(config, users, pool)
+        else:
+            run_polling(config, users, pool)
+    finally:
+        pool.close_all()
+        WEIGHTS.flush()
+        RANK_CACHE.flush()
+        TRAINING_LEDGER.close()
+        if METRICS.enabled:
+            METRICS.log()
+
+
+if __name__ == "__main__":
+    CLIENT_CONFIG = get_config(CLIENT)
+    run_client(CLIENT_CONFIG, get_users(CLIENT_CONFIG))
@@ -0,0 +1,440 @@
+#! /usr/bin/env python3
+"""Pipeline that overlaps fetching, parsing, ranking, moving and training of mails.
+
+New mails of a cycle are split into chunks that flow through five stages:
+
+1. fetch: download the chunk from the server
+2. parse: parse the MIME messages
+3. rank: rank the messages
+4. act: move or flag the mails on the server
+5. train: update weights from the ranked messages
+
+Every stage has its own worker threads, and every worker reads from a bounded
+queue. A full queue blocks the stage before it, so a slow stage holds back the
+ones upstream instead of piling up mails in memory, and throughput approaches
+that of the slowest stage instead of the sum of all of them.
+
+Chunks of a user always go to the same worker of a stage, so they pass every
+stage in the order they were fetched, and commands of a session are sent by
+one thread at a time.
+"""
+
+import logging
+import queue
+import threading
+import time
+import zlib
+
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from imapclient import IMAPClient
+
+from zippy.client.fetch import Fetcher, get_fetcher, parse_messages
+from zippy.client.idle import DEFAULT_POLL_INTERVAL
+from zippy.client.main import (
+    CLIENT,
+    DEFAULT_FETCH_CHUNK_SIZE,
+    DEFAULT_INTENT_BATCH_SIZE,
+    SEARCH_KEY,
+    EmailAuthUser,
+    EmailFolders,
+    ProcessedMessage,
+    act_on_chunk,
+    chunked,
+    fetch_chunk,
+    get_pool,
+    get_sync_store,
+    get_users,
+    online_train_all,
+    rank_chunk,
+    search_new_emails,
+    warm_up,
+)
+from zippy.client.pool import CONNECTION_ERRORS, IMAPConnectionPool
+from zippy.client.rank_cache import RANK_CACHE
+from zippy.client.sync_state import MailboxSync, SyncStateStore
+from zippy.client.training_ledger import TRAINING_LEDGER
+from zippy.pipeline.model.weight_store import WEIGHTS
+from zippy.utils.config import get_config
+from zippy.utils.log_handler import get_logger
+from zippy.utils.metrics import METRICS
+
+FETCH: str = "fetch"
+PARSE: str = "parse"
+RANK: str = "rank"
+ACT: str = "act"
+TRAIN: str = "train"
+STAGES: List[str] = [FETCH, PARSE, RANK, ACT, TRAIN]
+
+# rankings read snapshots of the weights, but the Keras intent model is not
+# safe to predict with from several threads at once, and training is CPU bound
+# under the GIL, so neither runs on more than one thread by default
+DEFAULT_WORKERS: Dict[str, int] = {FETCH: 4, PARSE: 2, RANK: 1, ACT: 4, TRAIN: 1}
+DEFAULT_QUEUE_SIZE: int = 4
+
+# tells a worker to stop
+_STOP = object()
+
+
+class Cycle:
+    """A single cycle of a user, whose chunks are in the pipeline.
+
+    Parameters
+    ----------
+    user: EmailAuthUser
+        User whose mails are processed
+    client: IMAPClient
+        Session borrowed for the cycle
+    on_done: Callable
+        Called with the cycle once all its chunks left the pipeline
+    sync: MailboxSync, optional
+        Sync state to checkpoint the processed chunks in
+    """
+
+    def __init__(
+        self,
+        user: EmailAuthUser,
+        client: IMAPClient,
+        on_done: Callable[["Cycle"], None],
+        sync: Optional[MailboxSync] = None,
+    ) -> None:
+        self.user = user
+        self.client = client
+        self.sync = sync
+        self.error: Optional[BaseException] = None
+        self.count = 0
+        # fetch and act of different chunks run on different threads
+        self.session_lock = threading.Lock()
+        self._on_done = on_done
+        self._pending = 0
+        self._submitted = False
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    @property
+    def failed(self) -> bool:
+        """Check if processing a chunk of the cycle failed."""
+        return self.error is not None
+
+    def add_chunk(self):
+        """Count chunk put into the pipeline."""
+        with self._lock:
+            self._pending += 1
+
+    def fail(self, error: BaseException):
+        """Remember first error, chunks still in the pipeline are dropped."""
+        with self._lock:
+            if self.error is None:
+                self.error = error
+
+    def chunk_done(self, count: int = 0):
+        """Count chunk that left the pipeline."""
+        with self._lock:
+            self._pending -= 1
+            self.count += count
+            finished = self._submitted and self._pending == 0
+        if finished:
+            self._finish()
+
+    def submitted(self):
+        """Mark that all chunks of the cycle were put into the pipeline."""
+        with self._lock:
+            self._submitted = True
+            finished = self._pending == 0
+        if finished:
+            self._finish()
+
+    def _finish(self):
+        try:
+            self._on_done(self)
+        finally:
+            self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Wait till all chunks of the cycle left the pipeline."""
+        return self._done.wait(timeout)
+
+
+class Chunk(NamedTuple):
+    """Mails of a cycle, with the result of the last stage they passed."""
+
+    cycle: Cycle
+    uids: List[int]
+    data: Any = None
+
+
+class Stage:
+    """Workers of a stage of the pipeline, each with its own bounded queue.
+
+    Parameters
+    ----------
+    name: str
+        Name of the stage
+    func: Callable
+        Called with a chunk, returns data passed on to the next stage
+    workers: int, optional
+        Number of worker threads
+    queue_size: int, optional
+        Number of chunks waiting for a worker at most
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func: Callable[[Chunk], Any],
+        workers: int = 1,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.name = name
+        self.func = func
+        self.logger = logger or get_logger(CLIENT)
+        self.next_stage: Optional["Stage"] = None
+        self.queues: List[queue.Queue] = [
+            queue.Queue(maxsize=queue_size) for _ in range(max(workers, 1))
+        ]
+        self.threads = [
+            threading.Thread(
+                target=self._work,
+                args=(worker_queue,),
+                name=f"{name}-{number}",
+                daemon=True,
+            )
+            for number, worker_queue in enumerate(self.queues)
+        ]
+
+    def put(self, chunk: Chunk):
+        """Queue chunk for the worker of its user, blocking while it is full."""
+        # a stable shard keeps chunks of a user in order
+        shard = zlib.crc32(chunk.cycle.user.email_address.encode())
+        self.queues[shard % len(self.queues)].put(chunk)
+
+    def start(self):
+        """Start the workers."""
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """Stop the workers once they are done with the queued chunks."""
+        for worker_queue in self.queues:
+            worker_queue.put(_STOP)
+        for thread in self.threads:
+            thread.join()
+
+    def _work(self, worker_queue: queue.Queue):
+        while True:
+            chunk = worker_queue.get()
+            if chunk is _STOP:
+                break
+            cycle = chunk.cycle
+            if cycle.failed:
+                cycle.chunk_done()
+                continue
+            try:
+                data = self.func(chunk)
+            except Exception as exc_info:  # pylint: disable=broad-except
+                self.logger.exception(
+                    "Stage %s failed for mails (uids: %s) of %s",
+                    self.name,
+                    chunk.uids,
+                    cycle.user,
+                )
+                cycle.fail(exc_info)
+                cycle.chunk_done()
+                continue
+
+            if self.next_stage is not None:
+                self.next_stage.put(chunk._replace(data=data))
+            else:
+                cycle.chunk_done(len(chunk.uids))
+
+
+class MailPipeline:
+    """Process mailboxes of users with a pipeline of stages.
+
+    Parameters
+    ----------
+    pool: IMAPConnectionPool
+        Pool to borrow sessions from
+    fetch: Fetcher, optional
+        Function to fetch the emails with, fetches complete emails by default
+    chunk_size: int, optional
+        Number of mails passed from stage to stage at once
+    workers: Dict[str, int], optional
+        Number of workers of the stages, missing stages use the defaults
+    queue_size: int, optional
+        Number of chunks waiting in front of a worker at most
+    sync_store: SyncStateStore, optional
+        Store of sync states, to search only mails changed since the last cycle
+    batch_size: int, optional
+        Number of mails whose intent is predicted at once, one by one if not given
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        pool: IMAPConnectionPool,
+        fetch: Optional[Fetcher] = None,
+        chunk_size: int = DEFAULT_FETCH_CHUNK_SIZE,
+        workers: Optional[Dict[str, int]] = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        sync_store: Optional[SyncStateStore] = None,
+        batch_size: Optional[int] = None,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.pool = pool
+        self.fetch = fetch or get_fetcher(parse=False)
+        self.chunk_size = chunk_size
+        self.sync_store = sync_store
+        self.batch_size = batch_size
+        self.logger = logger or get_logger(CLIENT)
+
+        workers = {**DEFAULT_WORKERS, **(workers or {})}
+        funcs = {
+            FETCH: self._fetch,
+            PARSE: self._parse,
+            RANK: self._rank,
+            ACT: self._act,
+            TRAIN: self._train,
+        }
+        self.stages = [
+            Stage(name, funcs[name], workers[name], queue_size, self.logger)
+            for name in STAGES
+        ]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.next_stage = next_stage
+        self._started = False
+
+    def _fetch(self, chunk: Chunk) -> dict:
+        with chunk.cycle.session_lock:
+            return fetch_chunk(chunk.cycle.client, chunk.uids, self.fetch)
+
+    @staticmethod
+    def _parse(chunk: Chunk) -> dict:
+        return parse_messages(chunk.data)
+
+    def _rank(self, chunk: Chunk) -> Dict[int, ProcessedMessage]:
+        return rank_chunk(chunk.data, self.batch_size)
+
+    def _act(self, chunk: Chunk) -> Dict[int, ProcessedMessage]:
+        cycle = chunk.cycle
+        checkpoint = cycle.sync.checkpoint if cycle.sync is not None else None
+        with cycle.session_lock:
+            act_on_chunk(cycle.client, chunk.data, self.logger, checkpoint)
+        return chunk.data
+
+    @staticmethod
+    def _train(chunk: Chunk):
+        online_train_all(chunk.data)
+
+    def start(self):
+        """Start workers of all stages."""
+        for stage in self.stages:
+            stage.start()
+        self._started = True
+
+    def stop(self):
+        """Stop workers, stage by stage, after the queued chunks are processed."""
+        if not self._started:
+            return
+        for stage in self.stages:
+            stage.stop()
+        self._started = False
+
+    def _cycle_done(self, cycle: Cycle):
+        discard = isinstance(cycle.error, CONNECTION_ERRORS)
+        if not cycle.failed and cycle.sync is not None:
+            cycle.sync.commit()
+        self.pool.release(cycle.user, cycle.client, discard=discard)
+        if not cycle.failed:
+            self.logger.info("Processed %s mails of %s", cycle.count, cycle.user)
+
+    def submit(self, user: EmailAuthUser) -> Cycle:
+        """Search new mails of the user and put them into the pipeline.
+
+        Blocks while the first stage is full. Session of the user is given back
+        to the pool once all chunks left the pipeline.
+        """
+        assert self._started, "Pipeline is not running."
+        client = self.pool.acquire(user)
+        sync = None
+        if self.sync_store is not None:
+            sync = MailboxSync(
+                self.sync_store, user.email_address, EmailFolders.INBOX, self.logger
+            )
+        cycle = Cycle(user, client, self._cycle_done, sync)
+
+        try:
+            with cycle.session_lock:
+                if sync is None:
+                    uids = search_new_emails(client, self.logger)
+                else:
+                    uids = sync.search(client, SEARCH_KEY)
+        except Exception as exc_info:
+            cycle.fail(exc_info)
+            cycle.submitted()
+            raise
+
+        for uids_chunk in chunked(uids, self.chunk_size):
+            if cycle.failed:
+                break
+            cycle.add_chunk()
+            self.stages[0].put(Chunk(cycle, uids_chunk))
+        cycle.submitted()
+        return cycle
+
+    def run_once(self, users: List[EmailAuthUser]) -> List[bool]:
+        """Run a single cycle for all users, returning their success."""
+        cycles: List[Optional[Cycle]] = []
+        for user in users:
+            try:
+                cycles.append(self.submit(user))
+            except Exception:  # pylint: disable=broad-except
+                # failure of one mailbox should not stop the others
+                self.logger.exception("Failed to search emails of %s", user)
+                cycles.append(None)
+
+        for cycle in cycles:
+            if cycle is not None:
+                cycle.wait()
+        return [cycle is not None and not cycle.failed for cycle in cycles]
+
+    def run(self, users: List[EmailAuthUser], interval: float = DEFAULT_POLL_INTERVAL):
+        """Run cycles for all users every ``interval`` seconds, till interrupted."""
+        while True:
+            self.run_once(users)
+            time.sleep(interval)
+
+
+def run_pipeline(config: dict, users: List[EmailAuthUser]):
+    """Run pipeline for the users till interrupted."""
+    warm_up(config)
+    pool = get_pool(config)
+    pipeline = MailPipeline(
+        pool,
+        fetch=get_fetcher(config, parse=False),
+        chunk_size=config.get("fetch_chunk_size", DEFAULT_FETCH_CHUNK_SIZE),
+        workers=config.get("pipeline_workers"),
+        queue_size=config.get("pipeline_queue_size", DEFAULT_QUEUE_SIZE),
+        sync_store=get_sync_store(config),
+        batch_size=config.get("intent_batch_size", DEFAULT_INTENT_BATCH_SIZE),
+    )
+    pipeline.start()
+    try:
+        pipeline.run(users, config.get("poll_interval", DEFAULT_POLL_INTERVAL))
+    finally:
+        pipeline.stop()
+        pool.close_all()
+        WEIGHTS.flush()
+        RANK_CACHE.flush()
+        TRAINING_LEDGER.close()
+        if METRICS.enabled:
+            METRICS.log()
+
+
+if __name__ == "__main__":
+    CLIENT_CONFIG = get_config(CLIENT)
+    run_pipeline(CLIENT_CONFIG, get_users(CLIENT_CONFIG))
@@ -0,0 +1,206 @@
+"""Pool of authenticated IMAP sessions shared between client jobs."""
+import contextlib
+import logging
+import threading
+import time
+
+from typing import TYPE_CHECKING, Callable, Dict, Iterator, NamedTuple, Optional
+
+from imapclient import IMAPClient
+from imapclient.exceptions import IMAPClientAbortError, IMAPClientError
+
+from zippy.utils.log_handler import get_logger
+
+if TYPE_CHECKING:  # pragma: no cover
+    from zippy.client.main import EmailAuthUser  # noqa: F401
+
+# errors after which a session can not be trusted anymore, socket and SSL
+# errors are OSErrors. Commands answered with NO or BAD leave it usable.
+CONNECTION_ERRORS = (IMAPClientAbortError, OSError)
+
+DEFAULT_MAX_CONNECTIONS_PER_HOST: int = 10
+# RFC 3501 autologout timer is at least 30 minutes
+DEFAULT_MAX_IDLE_TIME: float = 25 * 60
+
+
+class PooledSession(NamedTuple):
+    """Authenticated session that is kept alive in the pool."""
+
+    client: IMAPClient
+    host: str
+    last_used: float
+
+
+def close_client(client: IMAPClient, logger: logging.Logger):
+    """Logout from the server, shutting down the socket if logout fails."""
+    try:
+        client.logout()
+    except (IMAPClientError, OSError):
+        logger.debug("Logout failed, shutting down the connection.")
+        try:
+            client.shutdown()
+        except OSError:
+            # must have already shutdown
+            pass
+
+
+class IMAPConnectionPool:
+    """Keep one authenticated session per user alive between jobs.
+
+    Parameters
+    ----------
+    connect: Callable
+        Returns a new, logged in ``IMAPClient`` for the given user
+    host: str
+        Hostname of the mail server, used to cap open connections
+    max_connections_per_host: int, optional
+        Maximum number of open connections to the ``host``
+    max_idle_time: float, optional
+        Sessions idle longer than this (in seconds) are reconnected without
+        checking, as the server most likely has already logged them out
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        connect: Callable[["EmailAuthUser"], IMAPClient],
+        host: str,
+        max_connections_per_host: int = DEFAULT_MAX_CONNECTIONS_PER_HOST,
+        max_idle_time: float = DEFAULT_MAX_IDLE_TIME,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        if max_connections_per_host < 1:
+            raise ValueError("'max_connections_per_host' should be at least 1.")
+        self.connect = connect
+        self.host = host
+        self.max_connections_per_host = max_connections_per_host
+        self.max_idle_time = max_idle_time
+        self.logger = logger or get_logger("client")
+
+        self._idle: Dict[str, PooledSession] = {}
+        self._in_use: Dict[str, str] = {}
+        self._open: Dict[str, int] = {}
+        self._condition = threading.Condition()
+
+    def __len__(self) -> int:
+        """Return number of open connections."""
+        with self._condition:
+            return sum(self._open.values())
+
+    def _evict_idle(self, host: str) -> Optional[PooledSession]:
+        """Remove least recently used idle session of the host to free a slot."""
+        candidates = [
+            (session.last_used, key)
+            for key, session in self._idle.items()
+            if session.host == host
+        ]
+        if not candidates:
+            return None
+        _, key = min(candidates)
+        self._open[host] -= 1
+        return self._idle.pop(key)
+
+    def _reserve(self, key: str) -> Optional[PooledSession]:
+        """Wait for the user's session or a free slot for a new connection."""
+        host = self.host
+        evicted: Optional[PooledSession] = None
+        with self._condition:
+            while True:
+                if key in self._in_use:
+                    # a session is never shared, wait for it to be released
+                    self._condition.wait()
+                    continue
+                if key in self._idle:
+                    self._in_use[key] = host
+                    return self._idle.pop(key)
+                if self._open.get(host, 0) >= self.max_connections_per_host:
+                    evicted = self._evict_idle(host)
+                    if evicted is None:
+                        self._condition.wait()
+                        continue
+                self._open[host] = self._open.get(host, 0) + 1
+                self._in_use[key] = host
+                break
+
+        if evicted is not None:
+            self.logger.debug("Closing least recently used session to %s.", host)
+            close_client(evicted.client, self.logger)
+        return None
+
+    def _is_alive(self, session: PooledSession) -> bool:
+        """Check with NOOP whether the session is still usable."""
+        if time.monotonic() - session.last_used > self.max_idle_time:
+            return False
+        try:
+            session.client.noop()
+        except (IMAPClientError, OSError):
+            return False
+        return True
+
+    def acquire(self, user: "EmailAuthUser") -> IMAPClient:
+        """Borrow the authenticated session of the user.
+
+        Reconnects if the kept session went stale. Blocks while the session of
+        the user is borrowed or while the host has no free connection slot.
+        """
+        key = user.email_address
+        session = self._reserve(key)
+        if session is not None:
+            if self._is_alive(session):
+                self.logger.debug("Reusing session for %s", user)
+                return session.client
+            self.logger.info("Session for %s went stale, reconnecting.", user)
+            close_client(session.client, self.logger)
+
+        try:
+            return self.connect(user)
+        except Exception:
+            self._forget(key)
+            raise
+
+    def release(self, user: "EmailAuthUser", client: IMAPClient, discard=False):
+        """Return the borrowed session, closing it if ``discard`` is set."""
+        key = user.email_address
+        if discard:
+            close_client(client, self.logger)
+            self._forget(key)
+            return
+
+        with self._condition:
+            host = self._in_use.pop(key)
+            self._idle[key] = PooledSession(client, host, time.monotonic())
+            self._condition.notify_all()
+
+    def _forget(self, key: str):
+        """Free the slot reserved for the user."""
+        with self._condition:
+            host = self._in_use.pop(key)
+            self._open[host] -= 1
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def session(self, user: "EmailAuthUser") -> Iterator[IMAPClient]:
+        """Borrow the session of the user for the duration of the block.
+
+        The session is discarded if the connection breaks inside the block.
+        """
+        client = self.acquire(user)
+        discard = False
+        try:
+            yield client
+        except CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            self.release(user, client, discard=discard)
+
+    def close_all(self):
+        """Logout from all idle sessions."""
+        with self._condition:
+            sessions = list(self._idle.values())
+            self._idle.clear()
+            for session in sessions:
+                self._open[session.host] -= 1
+        for session in sessions:
+            close_client(session.client, self.logger)
@@ -0,0 +1,252 @@
+"""Remember how mails were ranked, to not rank them again when seen again.
+
+Mails are flagged as processed once they were moved or ranked. When adding
+the flag fails, or a mail is restored from a folder or delivered twice, the
+same mail is found again and used to go through the whole ranking and intent
+pipeline again. The cache keeps the rank, priority, intent and threshold of
+every mail, keyed by the user it was sent to and its ``Message-ID``, or a hash
+of the whole mail if it has none, so the earlier decision is reused instead.
+
+The cache keeps ``max_size`` mails, evicting the least recently used ones
+first, and forgets mails ranked more than ``ttl`` seconds ago. It is written
+to ``ranks.json`` every ``flush_interval`` seconds and when the client stops,
+through a temporary file renamed over the old one, and read back the first
+time it is used. Workers of the supervisor share the file: a worker reads it
+again under a lock of the file before writing, and keeps the mails of the
+other workers.
+"""
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+
+from collections import OrderedDict
+from email.message import Message
+from typing import Dict, List, NamedTuple, Optional
+
+from zippy.utils.file_lock import file_lock
+from zippy.utils.log_handler import get_logger
+
+CACHE_DIR = pathlib.Path(__file__).parents[2] / "output" / "cache"
+CACHE_FILE: str = "ranks.json"
+SECONDS_PER_DAY: int = 24 * 60 * 60
+# mails kept, the least recently used are evicted first
+DEFAULT_RANK_CACHE_SIZE: int = 10000
+# seconds a rank is reused for, a week
+DEFAULT_RANK_CACHE_TTL: float = 7 * SECONDS_PER_DAY
+# seconds between writes of the cache
+DEFAULT_CACHE_FLUSH_INTERVAL: float = 60
+
+
+class CachedRank(NamedTuple):
+    """Outcome of ranking a mail."""
+
+    rank: float
+    important: bool
+    intent: bool
+    threshold: float
+
+
+def message_key(email_message: Message) -> str:
+    """Return key of the mail for the user it was sent to.
+
+    Mails are identified by their ``Message-ID``, or by a hash of the whole
+    mail if they have none.
+    """
+    message_id = email_message.get("Message-ID")
+    if message_id:
+        identifier = str(message_id).strip()
+    else:
+        identifier = hashlib.sha256(email_message.as_bytes()).hexdigest()
+    return f"{email_message.get('To', '')}\n{identifier}"
+
+
+class RankCache:
+    """Outcome of ranking every mail, by key of the mail.
+
+    Parameters
+    ----------
+    directory: pathlib.Path, optional
+        Directory to keep the file in
+    max_size: int, optional
+        Number of mails kept, ``0`` disables the cache
+    ttl: float, optional
+        Seconds a rank is reused for
+    flush_interval: float, optional
+        Seconds between writes of the cache
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path = CACHE_DIR,
+        max_size: int = DEFAULT_RANK_CACHE_SIZE,
+        ttl: float = DEFAULT_RANK_CACHE_TTL,
+        flush_interval: float = DEFAULT_CACHE_FLUSH_INTERVAL,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.directory = pathlib.Path(directory)
+        self.max_size = max_size
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._logger = logger
+        # rank and time it was stored at, least recently used first
+        self._entries: Dict[str, List] = OrderedDict()
+        self._loaded = False
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    @property
+    def logger(self) -> logging.Logger:
+        """Logger of the cache, the client one by default."""
+        if self._logger is None:
+            self._logger = get_logger("client")
+        return self._logger
+
+    @property
+    def path(self) -> pathlib.Path:
+        """Path of the file of the cache."""
+        return self.directory / CACHE_FILE
+
+    @property
+    def enabled(self) -> bool:
+        """Whether ranks are kept at all."""
+        return self.max_size > 0
+
+    def configure(self, config: dict) -> None:
+        """Set size, time to live and flush interval from the client config.
+
+        Raises
+        ------
+        ValueError
+            If the size is negative
+        """
+        max_size = config.get("rank_cache_size", DEFAULT_RANK_CACHE_SIZE)
+        if max_size < 0:
+            raise ValueError(f"Negative rank cache size: {max_size}")
+        self.max_size = max_size
+        # days in the config
+        self.ttl = (
+            config.get("rank_cache_ttl", DEFAULT_RANK_CACHE_TTL / SECONDS_PER_DAY)
+            * SECONDS_PER_DAY
+        )
+        self.flush_interval = config.get(
+            "rank_cache_flush_interval", DEFAULT_CACHE_FLUSH_INTERVAL
+        )
+
+    def __len__(self) -> int:
+        """Return number of mails kept."""
+        with self._lock:
+            self._load()
+            return len(self._entries)
+
+    def _read(self) -> Dict[str, List]:
+        """Return mails of the file, least recently used first."""
+        try:
+            with open(self.path, "r") as stream:
+                return json.load(stream)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            # corrupted file, mails are ranked again
+            self.logger.warning("Could not read rank cache %s", self.path)
+            return {}
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+        self._loaded = True
+        self._entries.update(self._read())
+        self._evict()
+
+    def _expired(self, stored_at: float) -> bool:
+        return time.time() - stored_at > self.ttl
+
+    def _evict(self) -> None:
+        """Forget expired mails and the least recently used beyond the size."""
+        expired = [
+            key
+            for key, (*_, stored_at) in self._entries.items()
+            if self._expired(stored_at)
+        ]
+        for key in expired:
+            del self._entries[key]
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        if expired:
+            self._dirty = True
+
+    def get(self, email_message: Message) -> Optional[CachedRank]:
+        """Return outcome of ranking the mail before, if still kept."""
+        if not self.enabled:
+            return None
+        key = message_key(email_message)
+        with self._lock:
+            self._load()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            *cached, stored_at = entry
+            if self._expired(stored_at):
+                del self._entries[key]
+                self._dirty = True
+                return None
+            self._entries.move_to_end(key)
+        return CachedRank(*cached)
+
+    def put(self, email_message: Message, cached: CachedRank) -> None:
+        """Keep outcome of ranking the mail, write the cache if due."""
+        if not self.enabled:
+            return
+        key = message_key(email_message)
+        entry = [
+            float(cached.rank),
+            bool(cached.important),
+            bool(cached.intent),
+            float(cached.threshold),
+            time.time(),
+        ]
+        with self._lock:
+            self._load()
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._dirty = True
+        self.flush_if_due()
+
+    def flush(self) -> None:
+        """Write the cache if it changed since it was read."""
+        with self._lock:
+            self._flushed_at = time.monotonic()
+            if not self._dirty:
+                return
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with file_lock(self.path.with_suffix(".lock")):
+                # keep mails written by other workers meanwhile, used before ours
+                entries = OrderedDict(self._read())
+                for key, entry in self._entries.items():
+                    entries.pop(key, None)
+                    entries[key] = entry
+                self._entries = entries
+                self._evict()
+                tmp_path = self.path.with_suffix(f".{os.getpid()}.tmp")
+                with open(tmp_path, "w") as stream:
+                    json.dump(self._entries, stream)
+                # never leave a half written file behind
+                os.replace(tmp_path, self.path)
+            self._dirty = False
+
+    def flush_if_due(self) -> None:
+        """Write the cache if ``flush_interval`` passed since last time."""
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+
+# ranks of the process, enabled by ``warm_up``
+RANK_CACHE = RankCache(max_size=0)
@@ -0,0 +1,236 @@
+#! /usr/bin/env python3
+"""Supervisor that spreads the users over worker processes, one per CPU core.
+
+Ranking is CPU bound and runs under the GIL, so a single process uses a single
+core however many users it serves. The supervisor splits the configured users
+over worker processes by a stable hash of their email address, so a user is
+always served by the same worker. Each worker runs the client in the
+configured ``mode``, polling, pushing, the asyncio engine or the pipeline.
+
+Crashed workers are started again, and when the configured users change, only
+the workers whose users changed are restarted.
+
+Weights, sync states and ledger entries of a user are only written by the
+worker of the user. Workers share the files of the global model, the rank
+cache and the training ledger, written so that no worker loses what the
+others wrote:
+
+- ranks of the global model are appended to ``global/rank_df.csv`` under a
+  lock of the file, in a single write, and the ranks a worker added are
+  merged into ``global/rank_quantiles.json`` under a lock of that file, see
+  :mod:`zippy.pipeline.model.weight_store`. Global thresholds follow the
+  ranks of every worker as of their last writes. Other tables of the global
+  model are only read by the workers;
+- the rank cache is read again and merged under a lock of its file before
+  it is written, see :mod:`zippy.client.rank_cache`;
+- the training ledger is a SQLite database, written a mail per transaction,
+  see :mod:`zippy.client.training_ledger`.
+"""
+
+import functools
+import logging
+import multiprocessing
+import os
+import signal
+import time
+import zlib
+
+from typing import Callable, Dict, List, Optional, Tuple
+
+from zippy.client.main import CLIENT, USERS, EmailAuthUser, get_users, run_client
+from zippy.client.pool import DEFAULT_MAX_CONNECTIONS_PER_HOST
+from zippy.utils.config import get_config
+from zippy.utils.log_handler import get_logger
+
+# fork would copy locks and threads of tensorflow into the workers
+DEFAULT_START_METHOD: str = "spawn"
+DEFAULT_CHECK_INTERVAL: float = 10
+DEFAULT_RESTART_DELAY: float = 30
+STOP_TIMEOUT: float = 10
+
+# pylint: disable=invalid-name
+ConfigLoader = Callable[[], dict]
+WorkerTarget = Callable[[dict, List[EmailAuthUser]], None]
+
+
+def shard_of(user: EmailAuthUser, workers: int) -> int:
+    """Return worker the user belongs to, the same in every process and run."""
+    return zlib.crc32(user.email_address.lower().encode()) % workers
+
+
+def shard_users(users: List[EmailAuthUser], workers: int) -> List[List[EmailAuthUser]]:
+    """Split users into a list per worker."""
+    shards: List[List[EmailAuthUser]] = [[] for _ in range(workers)]
+    for user in users:
+        shards[shard_of(user, workers)].append(user)
+    return shards
+
+
+def exit_worker(signum, frame):  # pylint: disable=unused-argument
+    """Leave the worker like an interrupt, so it cleans up on the way out."""
+    raise SystemExit(0)
+
+
+def run_worker(target: WorkerTarget, config: dict, users: List[EmailAuthUser]):
+    """Run the target in a worker, stopping it gracefully on ``SIGTERM``."""
+    signal.signal(signal.SIGTERM, exit_worker)
+    target(config, users)
+
+
+def worker_config(config: dict, workers: int) -> dict:
+    """Return config of a worker, sharing the connections to the host.
+
+    Users are left out, as every worker gets its own.
+    """
+    max_connections = config.get(
+        "max_connections_per_host", DEFAULT_MAX_CONNECTIONS_PER_HOST
+    )
+    worker = {key: value for key, value in config.items() if key != USERS}
+    worker["max_connections_per_host"] = max(1, max_connections // workers)
+    return worker
+
+
+class Supervisor:
+    """Run the users of the config on worker processes and keep them running.
+
+    Parameters
+    ----------
+    load_config: Callable, optional
+        Returns the client config, called on every check to notice changes
+    workers: int, optional
+        Number of worker processes, number of CPU cores by default
+    target: Callable, optional
+        Run by a worker with its config and users, ``run_client`` by default
+    check_interval: float, optional
+        Seconds between checks of the workers and the config
+    restart_delay: float, optional
+        Seconds at least between two starts of a crashed worker
+    start_method: str, optional
+        Method of ``multiprocessing`` to start the workers with
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        load_config: Optional[ConfigLoader] = None,
+        workers: Optional[int] = None,
+        target: WorkerTarget = run_client,
+        check_interval: float = DEFAULT_CHECK_INTERVAL,
+        restart_delay: float = DEFAULT_RESTART_DELAY,
+        start_method: str = DEFAULT_START_METHOD,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.load_config = load_config or functools.partial(get_config, CLIENT)
+        self.workers = workers or os.cpu_count() or 1
+        self.target = target
+        self.check_interval = check_interval
+        self.restart_delay = restart_delay
+        self.context = multiprocessing.get_context(start_method)
+        self.logger = logger or get_logger(CLIENT)
+        self.processes: Dict[int, multiprocessing.process.BaseProcess] = {}
+        self._assigned: Dict[int, Tuple[dict, List[EmailAuthUser]]] = {}
+        self._started_at: Dict[int, float] = {}
+
+    def _start_worker(self, number: int):
+        config, users = self._assigned[number]
+        process = self.context.Process(
+            target=run_worker,
+            args=(self.target, config, users),
+            name=f"zippy-worker-{number}",
+        )
+        process.start()
+        self.processes[number] = process
+        self._started_at[number] = time.monotonic()
+        self.logger.info(
+            "Started worker %s (pid: %s) for %s", number, process.pid, users
+        )
+
+    def _stop_worker(self, number: int):
+        process = self.processes.pop(number, None)
+        if process is None:
+            return
+        process.terminate()
+        process.join(STOP_TIMEOUT)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        self.logger.info("Stopped worker %s (pid: %s)", number, process.pid)
+
+    def assign(self, config: dict) -> List[int]:
+        """Assign users of the config to the workers, return changed workers."""
+        shards = shard_users(get_users(config), self.workers)
+        config = worker_config(config, self.workers)
+        changed = []
+        for number, users in enumerate(shards):
+            assigned = (config, users) if users else None
+            if self._assigned.get(number) != assigned:
+                changed.append(number)
+                if assigned is None:
+                    self._assigned.pop(number, None)
+                else:
+                    self._assigned[number] = assigned
+        return changed
+
+    def start(self):
+        """Start workers for the users of the config."""
+        self.assign(self.load_config())
+        for number in sorted(self._assigned):
+            self._start_worker(number)
+
+    def check(self):
+        """Rebalance users if the config changed and restart crashed workers."""
+        try:
+            config = self.load_config()
+            changed = self.assign(config)
+        except (KeyError, OSError, ValueError):
+            # keep the workers running till the config is fixed
+            self.logger.exception("Could not load config, keeping the workers.")
+            changed = []
+
+        for number in changed:
+            self.logger.info("Users of worker %s changed, restarting it.", number)
+            self._stop_worker(number)
+            if number in self._assigned:
+                self._start_worker(number)
+
+        for number, process in list(self.processes.items()):
+            if process.is_alive():
+                continue
+            if time.monotonic() - self._started_at[number] < self.restart_delay:
+                continue
+            self.logger.warning(
+                "Worker %s (pid: %s) exited with %s, restarting it.",
+                number,
+                process.pid,
+                process.exitcode,
+            )
+            self.processes.pop(number)
+            self._start_worker(number)
+
+    def stop(self):
+        """Stop all workers."""
+        for number in list(self.processes):
+            self._stop_worker(number)
+
+    def run(self):
+        """Supervise the workers till interrupted."""
+        self.start()
+        try:
+            while True:
+                time.sleep(self.check_interval)
+                self.check()
+        finally:
+            self.stop()
+
+
+def run_supervisor(config: dict):
+    """Run workers for the configured users till interrupted."""
+    Supervisor(
+        workers=config.get("workers"),
+        check_interval=config.get("supervisor_check_interval", DEFAULT_CHECK_INTERVAL),
+    ).run()
+
+
+if __name__ == "__main__":
+    run_supervisor(get_config(CLIENT))
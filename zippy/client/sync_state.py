@@ -0,0 +1,215 @@
+"""Remember how far mailboxes were processed, to search only for what changed.
+
+For every user and folder, ``UIDVALIDITY``, the highest processed uid and,
+with ``CONDSTORE``, the ``HIGHESTMODSEQ`` of the last cycle are persisted. A
+cycle then searches only mails with a newer uid or modseq, and skips the
+search altogether when ``UIDNEXT``/``HIGHESTMODSEQ`` show that nothing
+changed. The whole folder is searched again only when ``UIDVALIDITY``
+changes.
+
+The state only moves past mails that were moved or flagged. A mail whose
+action failed holds back the uid and modseq of the folder, so it is searched
+again by the next cycle, along with the mails after it that were not handled.
+"""
+import json
+import logging
+import os
+import pathlib
+import threading
+
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from imapclient import IMAPClient
+
+from zippy.utils.log_handler import get_logger
+
+SYNC_DIR = pathlib.Path(__file__).parents[2] / "output" / "sync"
+
+CONDSTORE_CAPABILITY: str = "CONDSTORE"
+ENABLE_CAPABILITY: str = "ENABLE"
+
+
+class SyncState(NamedTuple):
+    """Sync state of a folder."""
+
+    uidvalidity: int
+    last_uid: int = 0
+    highestmodseq: Optional[int] = None
+
+
+def enable_condstore(client: IMAPClient, logger: logging.Logger) -> bool:
+    """Enable CONDSTORE, so that server reports HIGHESTMODSEQ on select.
+
+    Should be called right after login, before selecting any folder.
+    """
+    if not (
+        client.has_capability(CONDSTORE_CAPABILITY)
+        and client.has_capability(ENABLE_CAPABILITY)
+    ):
+        return False
+    enabled = CONDSTORE_CAPABILITY.encode() in client.enable(CONDSTORE_CAPABILITY)
+    logger.debug("CONDSTORE enabled: %s", enabled)
+    return enabled
+
+
+class SyncStateStore:
+    """Persist sync states of all folders of a user in a json file.
+
+    Parameters
+    ----------
+    directory: pathlib.Path, optional
+        Directory to keep the files in
+    """
+
+    def __init__(self, directory: pathlib.Path = SYNC_DIR) -> None:
+        self.directory = pathlib.Path(directory)
+        self._lock = threading.Lock()
+
+    def _path(self, user: str) -> pathlib.Path:
+        return self.directory / f"{user}.json"
+
+    def _load(self, user: str) -> Dict[str, dict]:
+        try:
+            with open(self._path(user), "r") as stream:
+                return json.load(stream)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            # corrupted file, start over with a full search
+            return {}
+
+    def get(self, user: str, folder: str) -> Optional[SyncState]:
+        """Return sync state of the folder, if any."""
+        with self._lock:
+            state = self._load(user).get(folder)
+        if state is None:
+            return None
+        return SyncState(**state)
+
+    def set(self, user: str, folder: str, state: SyncState):
+        """Save sync state of the folder."""
+        with self._lock:
+            states = self._load(user)
+            states[folder] = state._asdict()
+            self.directory.mkdir(parents=True, exist_ok=True)
+            path = self._path(user)
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w") as stream:
+                json.dump(states, stream)
+            # never leave a half written file behind
+            os.replace(tmp_path, path)
+
+
+class MailboxSync:
+    """Search only changes of a folder since the last cycle.
+
+    Parameters
+    ----------
+    store: SyncStateStore
+        Store to persist the sync state in
+    user: str
+        Email address of the user
+    folder: str, optional
+        Folder to search
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        store: SyncStateStore,
+        user: str,
+        folder: str = "INBOX",
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.store = store
+        self.user = user
+        self.folder = folder
+        self.logger = logger or get_logger("client")
+        self._stored: Optional[SyncState] = None
+        self._state: Optional[SyncState] = None
+        self._highestmodseq: Optional[int] = None
+        self._found: List[int] = []
+        self._handled: Set[int] = set()
+
+    def search(self, client: IMAPClient, criteria: bytes) -> List[int]:
+        """Select the folder and search mails matching criteria that changed."""
+        status = client.select_folder(self.folder, readonly=True)
+        uidvalidity = status[b"UIDVALIDITY"]
+        uidnext = status.get(b"UIDNEXT")
+        highestmodseq = status.get(b"HIGHESTMODSEQ")
+
+        state = self._stored = self.store.get(self.user, self.folder)
+        if state is None or state.uidvalidity != uidvalidity:
+            self.logger.info(
+                "No valid sync state of %s for %s, searching all mails.",
+                self.folder,
+                self.user,
+            )
+            state = SyncState(uidvalidity)
+            uids = client.search(criteria)
+        elif highestmodseq is not None and state.highestmodseq is not None:
+            if highestmodseq == state.highestmodseq:
+                uids = []
+            else:
+                # new mails get a higher modseq as well
+                uids = client.search(
+                    criteria + b" MODSEQ %d" % (state.highestmodseq + 1)
+                )
+        elif uidnext is not None and uidnext <= state.last_uid + 1:
+            uids = []
+        else:
+            uids = client.search(criteria + b" UID %d:*" % (state.last_uid + 1))
+            # "n:*" matches the last mail even if its uid is less than n
+            uids = [uid for uid in uids if uid > state.last_uid]
+
+        uids = sorted(uids)
+        self._state = state
+        self._highestmodseq = highestmodseq
+        self._found = uids
+        self._handled = set()
+        self.logger.debug("Found %s changed mails for %s", len(uids), self.user)
+        return uids
+
+    def _last_uid(self) -> int:
+        """Return highest uid up to which every mail found was handled."""
+        assert self._state is not None
+        last_uid = self._state.last_uid
+        for uid in self._found:
+            if uid not in self._handled:
+                break
+            last_uid = max(last_uid, uid)
+        return last_uid
+
+    def checkpoint(self, uids: List[int]):
+        """Save progress after the mails were moved or flagged."""
+        if self._state is None or not uids:
+            return
+        self._handled.update(uids)
+        last_uid = self._last_uid()
+        if last_uid == self._state.last_uid:
+            return
+        # modseq is kept, so unprocessed mails are searched again if interrupted
+        self._state = self._state._replace(last_uid=last_uid)
+        self.store.set(self.user, self.folder, self._state)
+        self._stored = self._state
+
+    def commit(self):
+        """Save state of the folder once the cycle is over.
+
+        ``HIGHESTMODSEQ`` of the folder is only saved if every mail found was
+        handled, the uid up to the first one that was not.
+        """
+        if self._state is None:
+            return
+        highestmodseq = self._state.highestmodseq
+        if self._handled.issuperset(self._found):
+            highestmodseq = self._highestmodseq
+        state = self._state._replace(
+            last_uid=self._last_uid(), highestmodseq=highestmodseq
+        )
+        if state != self._stored:
+            self.store.set(self.user, self.folder, state)
+        self._state = None
+        self._found = []
+        self._handled = set()
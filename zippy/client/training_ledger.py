@@ -0,0 +1,240 @@
+"""Remember which mails the weights were trained on, to train on them once.
+
+Mails are flagged as processed on the server once ranked, so they are not
+found again, but moved mails are never flagged and flags can fail to be
+added. A mail found again used to update the weights again. The ledger keeps
+the ``Message-ID`` of every mail trained on, by user, in a SQLite database,
+and mails already in it are skipped by
+:func:`~zippy.client.main.online_train_all`. Mails without a ``Message-ID``
+are identified by a hash of their sender, subject, date and content.
+
+Nearly every mail is new, so the database is only asked about mails a Bloom
+filter of the user says it may hold. The filter never misses a mail that was
+added, so new mails are told apart in memory, without a query.
+
+Workers of the supervisor share the database. Every mail is written in a
+transaction of its own, right after the weights were trained on it, so the
+database is only locked for the time of an insert and a worker stopped
+midway keeps the mails it trained on. A user is always served by the same
+worker, so the filter of a user, read from the database once, holds every
+mail of the user.
+"""
+import hashlib
+import logging
+import math
+import pathlib
+import sqlite3
+import threading
+import time
+
+from typing import Dict, Iterator, Optional, Tuple
+
+import pandas as pd
+
+from zippy.utils.log_handler import get_logger
+
+LEDGER_DIR = pathlib.Path(__file__).parents[2] / "output" / "ledger"
+LEDGER_FILE: str = "trained.sqlite3"
+# mails a filter is sized for at first, it is rebuilt twice as big when full
+DEFAULT_FILTER_CAPACITY: int = 10000
+# share of new mails the filter mistakes for known ones, checked in the database
+DEFAULT_FALSE_POSITIVE_RATE: float = 0.001
+# seconds to wait for another worker to finish writing to the database
+DEFAULT_TIMEOUT: float = 30
+# columns identifying mails without Message-ID
+HASHED_COLUMNS: Tuple[str, ...] = ("From", "Subject", "Date", "content")
+
+
+def training_key(msg: pd.DataFrame) -> Tuple[str, str]:
+    """Return user the parsed mail was sent to and its identifier."""
+    for column in msg.columns:
+        if column.lower() == "message-id" and msg[column][0]:
+            return msg["To"][0], str(msg[column][0]).strip()
+    digest = hashlib.sha256()
+    for column in HASHED_COLUMNS:
+        if column in msg:
+            digest.update(str(msg[column][0]).encode())
+        digest.update(b"\0")
+    return msg["To"][0], digest.hexdigest()
+
+
+class BloomFilter:
+    """Set of strings that may answer yes for strings never added.
+
+    Parameters
+    ----------
+    capacity: int
+        Number of strings for which the rate of false positives holds
+    false_positive_rate: float, optional
+        Share of strings never added that are found anyway
+    """
+
+    def __init__(
+        self, capacity: int, false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE
+    ) -> None:
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        capacity = max(capacity, 1)
+        self.size = math.ceil(
+            -capacity * math.log(false_positive_rate) / math.log(2) ** 2
+        )
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str) -> Iterator[int]:
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for index in range(self.hashes):
+            yield (first + index * second) % self.size
+
+    def add(self, item: str) -> None:
+        """Add the string."""
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        """Return whether the string may have been added."""
+        return all(
+            self.bits[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    @property
+    def full(self) -> bool:
+        """Whether more strings were added than it was sized for."""
+        return self.count > self.capacity
+
+
+class TrainingLedger:
+    """Mails trained on, by user.
+
+    Parameters
+    ----------
+    directory: pathlib.Path, optional
+        Directory to keep the database in
+    enabled: bool, optional
+        Keep mails and skip the known ones, or train on every mail
+    capacity: int, optional
+        Mails the filter of a user is sized for at first
+    false_positive_rate: float, optional
+        Share of new mails the filters send to the database
+    timeout: float, optional
+        Seconds to wait for another process writing to the database
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path = LEDGER_DIR,
+        enabled: bool = True,
+        capacity: int = DEFAULT_FILTER_CAPACITY,
+        false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE,
+        timeout: float = DEFAULT_TIMEOUT,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.directory = pathlib.Path(directory)
+        self.enabled = enabled
+        self.capacity = capacity
+        self.false_positive_rate = false_positive_rate
+        self.timeout = timeout
+        self._logger = logger
+        self._connection: Optional[sqlite3.Connection] = None
+        self._filters: Dict[str, BloomFilter] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def logger(self) -> logging.Logger:
+        """Logger of the ledger, the client one by default."""
+        if self._logger is None:
+            self._logger = get_logger("client")
+        return self._logger
+
+    def configure(self, config: dict) -> None:
+        """Enable the ledger from the client config."""
+        self.enabled = bool(config.get("training_ledger", True))
+
+    @property
+    def path(self) -> pathlib.Path:
+        """Path of the database."""
+        return self.directory / LEDGER_FILE
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """Connection to the database, created the first time."""
+        if self._connection is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            # mails are trained on by worker threads, one at a time, and every
+            # statement is committed at once, not to lock out other processes
+            connection = sqlite3.connect(
+                str(self.path),
+                timeout=self.timeout,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS trained ("
+                "user TEXT NOT NULL, message_id TEXT NOT NULL, trained_at REAL, "
+                "PRIMARY KEY (user, message_id))"
+            )
+            self._connection = connection
+        return self._connection
+
+    def _filter(self, user: str) -> BloomFilter:
+        """Return filter of the mails of the user, read from the database."""
+        bloom = self._filters.get(user)
+        if bloom is not None and not bloom.full:
+            return bloom
+        cursor = self.connection.execute(
+            "SELECT message_id FROM trained WHERE user = ?", (user,)
+        )
+        message_ids = [message_id for (message_id,) in cursor]
+        capacity = max(self.capacity, 2 * len(message_ids))
+        bloom = self._filters[user] = BloomFilter(capacity, self.false_positive_rate)
+        for message_id in message_ids:
+            bloom.add(message_id)
+        return bloom
+
+    def _contains(self, user: str, message_id: str) -> bool:
+        if message_id not in self._filter(user):
+            return False
+        cursor = self.connection.execute(
+            "SELECT 1 FROM trained WHERE user = ? AND message_id = ?",
+            (user, message_id),
+        )
+        return cursor.fetchone() is not None
+
+    def trained(self, msg: pd.DataFrame) -> bool:
+        """Return whether the weights were trained on the parsed mail."""
+        if not self.enabled:
+            return False
+        user, message_id = training_key(msg)
+        with self._lock:
+            return self._contains(user, message_id)
+
+    def add(self, msg: pd.DataFrame) -> None:
+        """Remember that the weights were trained on the parsed mail, at once."""
+        if not self.enabled:
+            return
+        user, message_id = training_key(msg)
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR IGNORE INTO trained VALUES (?, ?, ?)",
+                (user, message_id, time.time()),
+            )
+            self._filter(user).add(message_id)
+
+    def close(self) -> None:
+        """Close the database."""
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+            self._filters.clear()
+
+
+# mails trained on by the process, enabled by ``warm_up``
+TRAINING_LEDGER = TrainingLedger(enabled=False)
@@ -0,0 +1,112 @@
+"""Analyzer splitting texts into terms, shared by ranking and training.
+
+Terms of subjects and contents used to be listed by fitting a
+``CountVectorizer`` on every text, which builds a vocabulary and a sparse
+matrix for a single email, and changes the vectorizer shared by every
+thread. The analyzer splits texts the same way, lowercased words of at least
+two letters or digits without stop words, but keeps no state: the stop words
+and the pattern of words are compiled once and every call only reads them.
+"""
+import functools
+import re
+
+from collections import Counter
+from typing import Any, FrozenSet, Iterable, List
+
+import pandas as pd
+
+# words of at least two letters or digits, like CountVectorizer
+TOKEN_PATTERN: str = r"(?u)\b\w\w+\b"
+EMPTY_VOCABULARY = "empty vocabulary; perhaps the documents only contain stop words"
+
+
+def load_stop_words(language: str = "english") -> FrozenSet[str]:
+    """Return stop words of the language, downloading them if missing."""
+    # nltk imports scipy and sklearn, only needed once the words are read
+    import nltk  # pylint: disable=import-outside-toplevel
+
+    try:
+        words = nltk.corpus.stopwords.words(language)
+    except LookupError:
+        nltk.download("stopwords")
+        words = nltk.corpus.stopwords.words(language)
+    return frozenset(words)
+
+
+class TextAnalyzer:
+    """Split texts into terms and count them.
+
+    Parameters
+    ----------
+    stop_words: Iterable[str], optional
+        Words left out of the terms
+    token_pattern: str, optional
+        Regular expression of a word
+    lowercase: bool, optional
+        Lowercase texts before splitting them
+    """
+
+    def __init__(
+        self,
+        stop_words: Iterable[str] = (),
+        token_pattern: str = TOKEN_PATTERN,
+        lowercase: bool = True,
+    ) -> None:
+        self.stop_words = frozenset(stop_words)
+        self.lowercase = lowercase
+        self._find_words = re.compile(token_pattern).findall
+
+    def tokens(self, text: Any) -> List[str]:
+        """Return terms of the text, in order, like ``CountVectorizer``."""
+        if isinstance(text, bytes):
+            text = text.decode("utf-8")
+        elif not isinstance(text, str):
+            # missing subjects or contents are read as NaN
+            raise ValueError("np.nan is an invalid document, expected byte or unicode")
+        if self.lowercase:
+            text = text.lower()
+        stop_words = self.stop_words
+        return [word for word in self._find_words(text) if word not in stop_words]
+
+    def counts(self, text: Any) -> Counter:
+        """Return count of every term of the text."""
+        return Counter(self.tokens(text))
+
+    def counts_batch(self, texts: Iterable[Any]) -> List[Counter]:
+        """Return count of every term of every text."""
+        tokens = self.tokens
+        return [Counter(tokens(text)) for text in texts]
+
+    def vocabulary(self, texts: Iterable[Any]) -> List[str]:
+        """Return sorted terms of the texts, like ``get_feature_names``.
+
+        Raises ``ValueError`` if the texts have no terms, like ``fit``.
+        """
+        terms = set()
+        for text in texts:
+            terms.update(self.tokens(text))
+        if not terms:
+            raise ValueError(EMPTY_VOCABULARY)
+        return sorted(terms)
+
+    def term_matrix(self, texts: Iterable[Any]) -> pd.DataFrame:
+        """Return count of every term, a row per text and a column per term.
+
+        The same table as the dense result of ``fit_transform`` with the
+        terms as columns. Raises ``ValueError`` if the texts have no terms.
+        """
+        counts = self.counts_batch(texts)
+        terms = sorted(set().union(*counts))
+        if not terms:
+            raise ValueError(EMPTY_VOCABULARY)
+        return pd.DataFrame(
+            [[count.get(term, 0) for term in terms] for count in counts],
+            columns=terms,
+            dtype="int64",
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def get_analyzer() -> TextAnalyzer:
+    """Return analyzer of the process, without English stop words."""
+    return TextAnalyzer(load_stop_words("english"))
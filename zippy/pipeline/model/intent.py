@@ -0,0 +1,192 @@
+"""Registry that keeps the intent model and its tokenizer loaded.
+
+Loading the bi-LSTM model rebuilds its whole graph, so it is done once per
+process instead of once per message. The first prediction of a model is slow
+as well, so every loaded version is warmed up before it is used. When the
+model or the tokenizer on disk changes, the new version is loaded and warmed
+up beside the one in use, and swapped in once ready.
+
+The model is run by keras by default, or by the TFLite interpreter with the
+``tflite`` backend, see :mod:`zippy.pipeline.model.tflite`.
+"""
+import logging
+import os
+import pathlib
+import pickle
+import threading
+import time
+
+from typing import Any, Callable, NamedTuple, Optional, Tuple
+
+from zippy.pipeline.model.tokenizer import FrozenTokenizer
+from zippy.utils.log_handler import get_logger
+
+INTENT_DIR = pathlib.Path(__file__).parents[3] / "output/models/intent"
+INTENT_MODEL = INTENT_DIR / "intent-bi-lstm-highest.h5"
+TOKENIZER = INTENT_DIR / "tokenizer.pickle"
+
+SEQUENCE_LENGTH: int = 50
+# seconds between checks of the files on disk for a new version
+DEFAULT_CHECK_INTERVAL: float = 60
+
+KERAS_BACKEND = "keras"
+TFLITE_BACKEND = "tflite"
+
+
+def import_tensorflow() -> Any:
+    """Import tensorflow on first use, without its C++ logs."""
+    os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+    import tensorflow  # pylint: disable=import-outside-toplevel
+
+    return tensorflow
+
+
+def load_keras_model(path: pathlib.Path) -> Any:
+    """Load a keras model without compiling it, it is only used to predict."""
+    # tensorflow is only imported by workers using the keras backend
+    return import_tensorflow().keras.models.load_model(path, compile=False)
+
+
+def load_tokenizer(path: pathlib.Path) -> FrozenTokenizer:
+    """Load pickled keras tokenizer and freeze it."""
+    with open(path, "rb") as handle:
+        return FrozenTokenizer.from_tokenizer(pickle.load(handle), SEQUENCE_LENGTH)
+
+
+class IntentModel(NamedTuple):
+    """Loaded version of the intent model with its tokenizer."""
+
+    model: Any
+    tokenizer: FrozenTokenizer
+    version: Tuple[float, float]
+
+
+class IntentModelRegistry:
+    """Load the intent model once and reload it when the files change.
+
+    Parameters
+    ----------
+    model_path: pathlib.Path, optional
+        Path of the keras model
+    tokenizer_path: pathlib.Path, optional
+        Path of the pickled tokenizer
+    check_interval: float, optional
+        Seconds between checks of the files for a new version
+    load_model: Callable, optional
+        Loads the model from a path
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        model_path: pathlib.Path = INTENT_MODEL,
+        tokenizer_path: pathlib.Path = TOKENIZER,
+        check_interval: float = DEFAULT_CHECK_INTERVAL,
+        load_model: Callable[[pathlib.Path], Any] = load_keras_model,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.model_path = pathlib.Path(model_path)
+        self.tokenizer_path = pathlib.Path(tokenizer_path)
+        self.check_interval = check_interval
+        self.load_model = load_model
+        self._logger = logger
+        self._current: Optional[IntentModel] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def logger(self) -> logging.Logger:
+        """Logger of the registry, the client one by default."""
+        if self._logger is None:
+            self._logger = get_logger("client")
+        return self._logger
+
+    def configure(self, config: dict) -> None:
+        """Set backend of the model from the client config."""
+        self.use_backend(config.get("intent_backend", KERAS_BACKEND))
+
+    def use_backend(self, backend: str) -> None:
+        """Run the model with ``keras`` or ``tflite``, before it is loaded.
+
+        The ``tflite`` backend loads the converted model next to the keras one.
+        """
+        if backend == KERAS_BACKEND:
+            model_path, load_model = INTENT_MODEL, load_keras_model
+        elif backend == TFLITE_BACKEND:
+            # pylint: disable=import-outside-toplevel
+            from zippy.pipeline.model.tflite import TFLITE_MODEL, load_tflite_model
+
+            model_path, load_model = TFLITE_MODEL, load_tflite_model
+        else:
+            raise ValueError(f"Unknown intent backend: {backend}")
+        self.model_path = model_path
+        self.load_model = load_model
+
+    def _version(self) -> Tuple[float, float]:
+        return (
+            self.model_path.stat().st_mtime,
+            self.tokenizer_path.stat().st_mtime,
+        )
+
+    def load(self) -> IntentModel:
+        """Load and warm up the version of the files on disk."""
+        started = time.monotonic()
+        version = self._version()
+        tokenizer = load_tokenizer(self.tokenizer_path)
+        model = self.load_model(self.model_path)
+        # first prediction builds the graph, do it before a message waits for it
+        model.predict_on_batch(tokenizer.encode([""]))
+        self.logger.info(
+            "Loaded intent model %s in %.2f seconds.",
+            self.model_path.name,
+            time.monotonic() - started,
+        )
+        return IntentModel(model, tokenizer, version)
+
+    def get(self) -> IntentModel:
+        """Return loaded model, reloading it if the files changed."""
+        current = self._current
+        if current is None:
+            with self._lock:
+                if self._current is None:
+                    try:
+                        self._current = self.load()
+                    except FileNotFoundError as exc_info:
+                        raise SystemExit(
+                            f"Pre-trained intent model or tokenizer not found: "
+                            f"{exc_info.filename}. Please check models directory."
+                        )
+                    self._checked_at = time.monotonic()
+                return self._current
+
+        if time.monotonic() - self._checked_at >= self.check_interval:
+            self._reload_if_changed()
+        return self._current
+
+    def _reload_if_changed(self):
+        if not self._lock.acquire(blocking=False):
+            # another thread is reloading, go on with the current version
+            return
+        try:
+            self._checked_at = time.monotonic()
+            try:
+                changed = self._version() != self._current.version
+            except OSError:
+                # file is being replaced, check again next time
+                return
+            if not changed:
+                return
+            try:
+                intent_model = self.load()
+            except Exception:  # pylint: disable=broad-except
+                # a half written file should not stop ranking
+                self.logger.exception("Could not reload intent model, keeping it.")
+                return
+            self._current = intent_model
+        finally:
+            self._lock.release()
+
+
+# intent model of the process
+INTENT_MODELS = IntentModelRegistry()
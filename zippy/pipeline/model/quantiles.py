@@ -0,0 +1,236 @@
+"""Streaming quantiles of the ranks of emails.
+
+The rank threshold of a user is a quantile, the median by default, of the
+ranks of all emails of the user. Instead of keeping every rank, the sketch
+counts ranks in buckets whose bounds grow geometrically, so a quantile is
+found within ``relative_accuracy`` of the exact one, whatever the number of
+ranks, and any quantile can be read from the same sketch.
+
+With a ``half_life``, a rank counts half as much as one of an email
+``half_life`` seconds younger, so the threshold follows recent emails. New
+ranks get a growing weight instead of decaying every count, which keeps
+adding a rank in constant time.
+
+Sketches of the same ranks seen by several processes are merged by adding
+their counts, so every process can keep a sketch of the ranks it added and
+merge it into the saved one.
+"""
+import json
+import math
+import os
+import pathlib
+
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+DEFAULT_RELATIVE_ACCURACY: float = 0.01
+# weights of new ranks are scaled back to 1 once they halved this many times
+MAX_HALVINGS: float = 64
+
+
+class QuantileSketch:
+    """Quantiles of a stream of numbers, within a relative accuracy.
+
+    Parameters
+    ----------
+    relative_accuracy: float, optional
+        Largest error of a quantile, relative to its value
+    half_life: float, optional
+        Seconds after which the weight of a number halves, no decay if not
+        given
+    """
+
+    def __init__(
+        self,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+        half_life: Optional[float] = None,
+    ) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.half_life = half_life
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive: Dict[int, float] = {}
+        self.negative: Dict[int, float] = {}
+        self.zero = 0.0
+        self.count = 0.0
+        # time at which numbers have a weight of 1
+        self.origin: Optional[float] = None
+        self._quantiles: Dict[float, float] = {}
+
+    def _key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def _value(self, key: int) -> float:
+        return 2 * self.gamma**key / (self.gamma + 1)
+
+    def _weight(self, at: Optional[float]) -> float:
+        if self.half_life is None or at is None:
+            return 1.0
+        if self.origin is None:
+            self.origin = at
+        halvings = (at - self.origin) / self.half_life
+        if halvings > MAX_HALVINGS:
+            self._scale(2.0**-halvings)
+            self.origin = at
+            return 1.0
+        return 2.0**halvings
+
+    def _scale(self, factor: float):
+        for buckets in (self.positive, self.negative):
+            for key in list(buckets):
+                buckets[key] *= factor
+                if not buckets[key]:
+                    del buckets[key]
+        self.zero *= factor
+        self.count *= factor
+
+    def add(self, value: float, at: Optional[float] = None) -> None:
+        """Add a number, seen at the given time in seconds.
+
+        Missing and infinite numbers are left out, like pandas does for NaN.
+        """
+        if value is None or not math.isfinite(value):
+            return
+        weight = self._weight(at)
+        if value > 0:
+            key = self._key(value)
+            self.positive[key] = self.positive.get(key, 0.0) + weight
+        elif value < 0:
+            key = self._key(-value)
+            self.negative[key] = self.negative.get(key, 0.0) + weight
+        else:
+            self.zero += weight
+        self.count += weight
+        self._quantiles.clear()
+
+    def merge(self, other: "QuantileSketch") -> None:
+        """Add the numbers of another sketch of the same accuracy."""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches of different accuracies")
+        if other.count <= 0:
+            return
+        factor = 1.0
+        if self.half_life is not None and other.origin is not None:
+            if self.origin is None:
+                self.origin = other.origin
+            halvings = (other.origin - self.origin) / self.half_life
+            if halvings > MAX_HALVINGS:
+                # weights of the other sketch are the recent ones
+                self._scale(2.0**-halvings)
+                self.origin = other.origin
+            else:
+                factor = 2.0**halvings
+        for buckets, other_buckets in (
+            (self.positive, other.positive),
+            (self.negative, other.negative),
+        ):
+            for key, weight in other_buckets.items():
+                buckets[key] = buckets.get(key, 0.0) + weight * factor
+        self.zero += other.zero * factor
+        self.count += other.count * factor
+        self._quantiles.clear()
+
+    def _buckets(self) -> Iterator[Tuple[float, float]]:
+        """Yield value and weight of the buckets, smallest value first."""
+        for key in sorted(self.negative, reverse=True):
+            yield -self._value(key), self.negative[key]
+        if self.zero:
+            yield 0.0, self.zero
+        for key in sorted(self.positive):
+            yield self._value(key), self.positive[key]
+
+    def quantile(self, q: float) -> float:
+        """Return the quantile, NaN if no number was added.
+
+        Like ``pd.Series.quantile``, the quantile between two numbers is
+        interpolated linearly, so the median of an even count of numbers is
+        the mean of the middle ones.
+        """
+        if q in self._quantiles:
+            return self._quantiles[q]
+        if self.count <= 0:
+            return math.nan
+        position = q * (self.count - 1) if self.count > 1 else 0.0
+        below = math.floor(position)
+        lower = upper = math.nan
+        seen = 0.0
+        for value, weight in self._buckets():
+            seen += weight
+            if math.isnan(lower) and seen > below:
+                lower = value
+            if seen > below + 1:
+                upper = value
+                break
+        if math.isnan(upper):
+            upper = lower
+        value = lower + (upper - lower) * (position - below)
+        self._quantiles[q] = value
+        return value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the sketch as JSON serializable values."""
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "half_life": self.half_life,
+            "positive": {str(key): weight for key, weight in self.positive.items()},
+            "negative": {str(key): weight for key, weight in self.negative.items()},
+            "zero": self.zero,
+            "count": self.count,
+            "origin": self.origin,
+        }
+
+    @classmethod
+    def from_dict(
+        cls, data: Dict[str, Any], half_life: Optional[float] = None
+    ) -> "QuantileSketch":
+        """Return sketch saved by ``to_dict``, with a new half life if given."""
+        sketch = cls(
+            data["relative_accuracy"],
+            data["half_life"] if half_life is None else half_life,
+        )
+        sketch.positive = {int(key): weight for key, weight in data["positive"].items()}
+        sketch.negative = {int(key): weight for key, weight in data["negative"].items()}
+        sketch.zero = data["zero"]
+        sketch.count = data["count"]
+        sketch.origin = data["origin"]
+        return sketch
+
+    @classmethod
+    def from_values(
+        cls,
+        values: Iterable[float],
+        times: Optional[Iterable[Optional[float]]] = None,
+        relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+        half_life: Optional[float] = None,
+    ) -> "QuantileSketch":
+        """Return sketch of the numbers, seen at the given times if any."""
+        sketch = cls(relative_accuracy, half_life)
+        if times is None:
+            for value in values:
+                sketch.add(value)
+        else:
+            for value, at in zip(values, times):
+                sketch.add(value, at)
+        return sketch
+
+
+def read_sketch(
+    path: pathlib.Path, half_life: Optional[float] = None
+) -> Optional[QuantileSketch]:
+    """Return sketch saved in the JSON file, None if there is none or unreadable."""
+    try:
+        with open(path) as sketch_file:
+            return QuantileSketch.from_dict(json.load(sketch_file), half_life)
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError, AttributeError):
+        # corrupted file, the sketch is built again from the ranks
+        return None
+
+
+def write_sketch(sketch: QuantileSketch, path: pathlib.Path) -> None:
+    """Save the sketch in a JSON file, replacing it at once."""
+    # a file per process, so processes never write into the same one
+    partial_path = pathlib.Path(path).with_suffix(f".{os.getpid()}.partial")
+    with open(partial_path, "w") as sketch_file:
+        json.dump(sketch.to_dict(), sketch_file)
+    os.replace(partial_path, path)
@@ -1,104 +1,60 @@
 """Module to apply the rank algorithm to emails."""
 
-import os
-import pathlib
-import pickle
+import logging
 
-import nltk
 import numpy as np
 import pandas as pd
 
-from sklearn.feature_extraction.text import CountVectorizer
-from tensorflow import keras
-
 from zippy.pipeline.data import parse_email
+from zippy.pipeline.features.analyzer import get_analyzer
+from zippy.pipeline.model.intent import INTENT_MODELS
+from zippy.pipeline.model.text_index import CHAR_MATCH, TOKEN_MATCH
+from zippy.pipeline.model.weight_store import MODEL_DIR, SPARSE_ENGINE, WEIGHTS
+from zippy.utils.metrics import METRICS
 
-os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
-
-SIMPLE_MODEL = pathlib.Path(__file__).parents[3] / "output/models/simplerank"
-INTENT_MODEL = (
-    pathlib.Path(__file__).parents[3] / "output/models/intent/intent-bi-lstm-highest.h5"
-)
-try:
-    with open(INTENT_MODEL.parents[0] / "tokenizer.pickle", "rb") as handle:
-        TOKENIZER = pickle.load(handle)
-except FileNotFoundError:
-    raise SystemExit("Pre-trained tokenizer not found. Please check models directory.")
+# configured by ``get_logger`` once the client starts, not on import
+LOGGER = logging.getLogger("client")
 
-try:
-    VEC = CountVectorizer(stop_words=nltk.corpus.stopwords.words("english"))
-except LookupError:
-    nltk.download("stopwords")
-    VEC = CountVectorizer(stop_words=nltk.corpus.stopwords.words("english"))
+SIMPLE_MODEL = MODEL_DIR
+# number of emails the intent is predicted of at once
+DEFAULT_INTENT_BATCH_SIZE = 32
 
 
 def create_user_model(user):
     """Initialize directory and user models for given user."""
-    user_model_dir = SIMPLE_MODEL / user
-    user_model_dir.mkdir()
-
-    from_wt = pd.DataFrame(columns=["From", "weight"])
-    from_wt.to_csv(user_model_dir / "from_weight.csv", index=False)
-
-    thread_sender_wt = pd.DataFrame(columns=["From", "freq", "weight"])
-    thread_sender_wt.to_csv(user_model_dir / "thread_senders_weight.csv", index=False)
-
-    thread_wt = pd.DataFrame(
-        columns=["freq", "time_span", "weight", "min_time", "thread"]
-    )
-    thread_wt.to_csv(user_model_dir / "thread_weights.csv", index=False)
-
-    thread_term_wt = pd.DataFrame(columns=["term", "weight"])
-    thread_term_wt.to_csv(user_model_dir / "thread_term_weights.csv", index=False)
-
-    msg_term_wt = pd.DataFrame(columns=["freq", "term", "weight"])
-    msg_term_wt.to_csv(user_model_dir / "msg_terms_weight.csv", index=False)
-
-    previous_ranks = pd.DataFrame(
-        columns=["date", "from", "rank", "subject", "priority", "intent"]
-    )
-    previous_ranks.to_csv(user_model_dir / "rank_df.csv", index=False)
+    *weights, _ = WEIGHTS.create(user).rank_weights(WEIGHTS.threshold_quantile)
     threshold = 0
 
-    return (
-        from_wt,
-        thread_sender_wt,
-        thread_wt,
-        thread_term_wt,
-        msg_term_wt,
-        threshold,
-    )
+    return (*weights, threshold)
 
 
 def get_sequence(message, tokenizer):
     """Return the text as a sequence vector."""
-    tokenizer.fit_on_texts([message])
-    sequences = tokenizer.texts_to_sequences([message])
-    sequence = keras.preprocessing.sequence.pad_sequences(sequences, maxlen=50)
-    return sequence
+    return tokenizer.encode([message])
 
 
 def load_weights(user: str = "global"):
-    """Load weights from the CSV."""
-    from_wt = pd.read_csv(SIMPLE_MODEL / user / "from_weight.csv")
-    thread_sender_wt = pd.read_csv(SIMPLE_MODEL / user / "thread_senders_weight.csv")
-    thread_wt = pd.read_csv(SIMPLE_MODEL / user / "thread_weights.csv")
-    thread_term_wt = pd.read_csv(SIMPLE_MODEL / user / "thread_term_weights.csv")
-    msg_term_wt = pd.read_csv(SIMPLE_MODEL / user / "msg_terms_weight.csv")
-    previous_ranks = pd.read_csv(SIMPLE_MODEL / user / "rank_df.csv")
-    threshold = previous_ranks["rank"].median()
-    return (
-        from_wt,
-        thread_sender_wt,
-        thread_wt,
-        thread_term_wt,
-        msg_term_wt,
-        threshold,
-    )
+    """Load weights of the user, read from the CSV on first use only."""
+    return WEIGHTS.get(user).rank_weights(WEIGHTS.threshold_quantile)
+
+
+def get_weights(search_term, weight_df, term=True, index=None, mode=CHAR_MATCH):
+    """Get weights from thread subject or frequent terms.
 
+    Terms or subjects are looked up in the index if given. In ``token`` mode, only rows
+    with one of the terms match, instead of rows sharing a character with
+    them.
+    """
+    if index is not None:
+        if term:
+            return index.weight(search_term, weight_df, mode)
+        return index.weight(search_term, weight_df)
+    if term and mode == TOKEN_MATCH:
+        match_weights = weight_df.weight[weight_df.term.isin(list(search_term))]
+        if len(match_weights) < 1:
+            return 1
+        return match_weights.mean()
 
-def get_weights(search_term, weight_df, term=True):
-    """Get weights from thread subject or frequent terms."""
     search_term = str(search_term)
     search_length = len(search_term)
     if search_length > 0:
@@ -118,8 +74,10 @@ def get_weights(search_term, weight_df, term=True):
     return 1
 
 
-def get_weights_from_sender(message, from_weight):
-    """Get weights from email sender."""
+def get_weights_from_sender(message, from_weight, senders=None):
+    """Get weights from email sender, looked up in the index if given."""
+    if senders is not None:
+        return senders.weight(message["From"][0], from_weight)
     from_wt = from_weight[from_weight["From"] == message["From"][0]]
     len_from = len(from_wt)
     if len_from > 0:
@@ -127,26 +85,35 @@ def get_weights_from_sender(message, from_weight):
     return 1
 
 
-def get_weights_from_thread(msg, thread_weights, count_vector):
+def get_weights_from_thread(
+    msg,
+    thread_weights,
+    analyzer,
+    senders=None,
+    terms=None,
+    term_match=CHAR_MATCH,
+    subjects=None,
+):
     """Get weights for threads."""
     # using senders weights from threads
     senders_weight, thread_weights, thread_term_weights = thread_weights
-    senders_wt = senders_weight[senders_weight["From"] == msg["From"][0]]
-    len_senders = len(senders_wt)
-    if len_senders > 0:
-        msg_thread_from_wt = senders_wt.weight
-    else:
-        msg_thread_from_wt = 1
+    with METRICS.timer("rank.thread_senders_weight"):
+        msg_thread_from_wt = get_weights_from_sender(msg, senders_weight, senders)
 
     # Then, from thread activity
     subject = msg["Subject"][0]
-    msg_thread_activity_wt = get_weights(subject, thread_weights, term=False)
+    with METRICS.timer("rank.thread_weights"):
+        msg_thread_activity_wt = get_weights(
+            subject, thread_weights, term=False, index=subjects
+        )
 
     # Then, weights based on terms in threads
     try:
-        count_vector.fit_transform(list(msg["Subject"]))
-        msg_thread_terms = count_vector.get_feature_names()
-        msg_thread_term_wt = get_weights(msg_thread_terms, thread_term_weights)
+        with METRICS.timer("rank.thread_term_weights"):
+            msg_thread_terms = analyzer.vocabulary(list(msg["Subject"]))
+            msg_thread_term_wt = get_weights(
+                msg_thread_terms, thread_term_weights, index=terms, mode=term_match
+            )
     except ValueError:
         # Some subjects from the test set result in empty vocabulary
         msg_thread_term_wt = 1
@@ -154,12 +121,15 @@ def get_weights_from_thread(msg, thread_weights, count_vector):
     return (msg_thread_from_wt, msg_thread_activity_wt, msg_thread_term_wt)
 
 
-def get_weights_from_terms(msg, msg_term_weights, count_vector):
+def get_weights_from_terms(
+    msg, msg_term_weights, analyzer, terms=None, term_match=CHAR_MATCH
+):
     """Get weights from message terms."""
     try:
-        count_vector.fit_transform(list(msg["content"]))
-        msg_terms = count_vector.get_feature_names()
-        msg_terms_wt = get_weights(msg_terms, msg_term_weights)
+        msg_terms = analyzer.vocabulary(list(msg["content"]))
+        msg_terms_wt = get_weights(
+            msg_terms, msg_term_weights, index=terms, mode=term_match
+        )
     except ValueError:
         # Some subjects from the test set result in empty vocabulary
         msg_terms_wt = 1
@@ -169,29 +139,58 @@ def get_weights_from_terms(msg, msg_term_weights, count_vector):
 def calculate_rank(msg, weights=None):
     """Calculate the rank score."""
     # load weights if not passed.
-    if not weights:
-        if (SIMPLE_MODEL / msg["To"][0]).exists():
-            weights = load_weights(msg["To"][0])
+    user = None
+    with METRICS.timer("rank.load_weights"):
+        if not weights:
+            user = msg["To"][0]
+            if WEIGHTS.exists(user):
+                weights = load_weights(user)
+            else:
+                weights = create_user_model(user)
+        elif weights == "global":
+            user = "global"
+            weights = load_weights(user)
         else:
-            weights = create_user_model(msg["To"][0])
-    elif weights == "global":
-        weights = load_weights("global")
-    else:
-        weights = weights
+            weights = weights
+
+    # indexes of the weights of the store
+    senders, terms, subjects = {}, {}, None
+    if user is not None:
+        user_weights = WEIGHTS.get(user)
+        senders, terms = user_weights.senders, user_weights.terms
+        subjects = user_weights.threads
 
     msg["Date"] = pd.to_datetime(msg["Date"], infer_datetime_format=True)
     from_weight, *threads, msg_term_weights, threshold = weights
     # First, using the from weights
-    msg_from_wt = get_weights_from_sender(msg, from_weight)
+    with METRICS.timer("rank.from_weight"):
+        msg_from_wt = get_weights_from_sender(
+            msg, from_weight, senders.get("from_weight")
+        )
     # Secondly, from threads
     if msg["is_thread"][0]:
-        threads = get_weights_from_thread(msg, threads, VEC)
+        threads = get_weights_from_thread(
+            msg,
+            threads,
+            get_analyzer(),
+            senders.get("thread_senders_weight"),
+            terms.get("thread_term_weights"),
+            WEIGHTS.term_match,
+            subjects,
+        )
         msg_thread_from_wt, msg_thread_activity_wt, msg_thread_term_wt = threads
     else:
         msg_thread_from_wt, msg_thread_activity_wt, msg_thread_term_wt = 1, 1, 1
 
     # Then, weights based on terms in message
-    msg_terms_wt = get_weights_from_terms(msg, msg_term_weights, VEC)
+    with METRICS.timer("rank.msg_terms_weight"):
+        msg_terms_wt = get_weights_from_terms(
+            msg,
+            msg_term_weights,
+            get_analyzer(),
+            terms.get("msg_terms_weight"),
+            WEIGHTS.term_match,
+        )
 
     # Calculating Rank
     rank = (
@@ -201,23 +200,21 @@ def calculate_rank(msg, weights=None):
         * float(msg_thread_term_wt)
         * float(msg_terms_wt)
     )
-    print(
-        "Weights are from: {0},\n\tthread_from: {1},\n\tthread: {2}, \n\tthread_term: {3}, \n\tmsg_term: {4}".format(
-            msg_from_wt,
-            msg_thread_from_wt,
-            msg_thread_activity_wt,
-            msg_thread_term_wt,
-            msg_terms_wt,
-        )
+    LOGGER.debug(
+        "Weights are from: %s, thread_from: %s, thread: %s, thread_term: %s, "
+        "msg_term: %s",
+        msg_from_wt,
+        msg_thread_from_wt,
+        msg_thread_activity_wt,
+        msg_thread_term_wt,
+        msg_terms_wt,
     )
 
     return [rank, threshold]
 
 
-def rank_message(message):
-    """Rank the email and determine if email should be prioritized."""
-    msg = pd.DataFrame(parse_email.get_from_message(message))
-
+def combined_rank(msg):
+    """Return rank and threshold of user and global weights together."""
     user_model_rank, user_model_threshold = calculate_rank(msg)
     global_model_rank, global_model_threshold = calculate_rank(msg, weights="global")
 
@@ -226,15 +223,98 @@ def rank_message(message):
     threshold = user_model_threshold + 0.1 * global_model_threshold
 
     # rank = 1 / (1 + np.exp(-weighted_rank/weighted_threshold))
+    return rank, threshold
+
+
+def combined_ranks(msgs):
+    """Return rank and threshold of every email, scored together.
+
+    The same as ``combined_rank`` for every email, scored by a
+    :class:`~zippy.pipeline.model.scoring.SparseScorer` per user.
+    """
+    # scipy is only imported by workers using the sparse engine
+    # pylint: disable=import-outside-toplevel
+    from zippy.pipeline.model.scoring import SparseScorer
+
+    user_thresholds = []
+    messages_of_users = {}
+    for position, msg in enumerate(msgs):
+        user = msg["To"][0]
+        if WEIGHTS.exists(user):
+            user_thresholds.append(load_weights(user)[-1])
+        else:
+            user_thresholds.append(create_user_model(user)[-1])
+        messages_of_users.setdefault(user, []).append(position)
+        msg["Date"] = pd.to_datetime(msg["Date"])
+    global_threshold = load_weights("global")[-1]
+
+    user_ranks = np.empty(len(msgs))
+    with METRICS.timer("rank.sparse"):
+        for user, positions in messages_of_users.items():
+            scorer = SparseScorer(WEIGHTS.get(user), WEIGHTS.term_match, get_analyzer())
+            user_ranks[positions] = scorer.rank(
+                [msgs[position] for position in positions]
+            )
+        scorer = SparseScorer(WEIGHTS.get(), WEIGHTS.term_match, get_analyzer())
+        global_ranks = scorer.rank(msgs)
+
+    return [
+        (user_rank + global_rank, user_threshold + 0.1 * global_threshold)
+        for user_rank, global_rank, user_threshold in zip(
+            user_ranks.tolist(), global_ranks.tolist(), user_thresholds
+        )
+    ]
+
+
+def predict_intent(model, sequences, batch_size=DEFAULT_INTENT_BATCH_SIZE):
+    """Return intent scores of the sequences, predicting a batch at once."""
+    scores = []
+    for start in range(0, len(sequences), batch_size):
+        end = start + batch_size
+        scores.append(np.asarray(model.predict_on_batch(sequences[start:end])))
+    return np.concatenate(scores)
+
+
+def rank_messages(messages, batch_size=DEFAULT_INTENT_BATCH_SIZE):
+    """Rank the emails, predicting their intent together.
+
+    Returns the same as ``rank_message`` for every email, in the same order.
+    """
+    intent = INTENT_MODELS.get()
+    with METRICS.timer("rank.parse"):
+        msgs = [
+            pd.DataFrame(parse_email.get_from_message(message)) for message in messages
+        ]
+    if WEIGHTS.rank_engine == SPARSE_ENGINE and msgs:
+        ranks = combined_ranks(msgs)
+    else:
+        ranks = [combined_rank(msg) for msg in msgs]
+    ranked = [(msg, rank, threshold) for msg, (rank, threshold) in zip(msgs, ranks)]
+
+    if not ranked:
+        return []
+    with METRICS.timer("intent.tokenize"):
+        sequences = intent.tokenizer.encode([msg["Subject"][0] for msg, _, _ in ranked])
+    with METRICS.timer("intent.predict"):
+        intent_scores = predict_intent(intent.model, sequences, batch_size)
+    return [
+        [msg, rank, rank > threshold, np.mean(intent_score) > 0.5, threshold]
+        for (msg, rank, threshold), intent_score in zip(ranked, intent_scores)
+    ]
+
+
+def rank_message(message):
+    """Rank the email and determine if email should be prioritized."""
+    with METRICS.timer("rank.parse"):
+        msg = pd.DataFrame(parse_email.get_from_message(message))
 
-    intent_model = keras.models.load_model(INTENT_MODEL)
+    rank, threshold = combined_rank(msg)
 
-    # content: str = msg["content"][0]
+    intent = INTENT_MODELS.get()
 
-    # parts = (*content.splitlines(), msg["Subject"][0])
-    # intent_score = intent_model.predict(
-    #     [get_sequence(part, TOKENIZER) for part in parts]
-    # )
-    intent_score = intent_model.predict(get_sequence(msg["Subject"][0], TOKENIZER))
+    with METRICS.timer("intent.tokenize"):
+        sequence = get_sequence(msg["Subject"][0], intent.tokenizer)
+    with METRICS.timer("intent.predict"):
+        intent_score = predict_intent(intent.model, sequence)
 
     return [msg, rank, rank > threshold, np.mean(intent_score) > 0.5, threshold]
@@ -0,0 +1,169 @@
+"""Score emails with a sparse matrix of the rows of the weights they match.
+
+The rank of an email is the product of five weights: of its sender, of its
+sender in threads, of its thread, of the terms of its subject and of the
+terms of its content. Each one is the mean weight of the rows of a table the
+email matches, ``1`` if it matches none, see
+:func:`~zippy.pipeline.model.rank_message.calculate_rank`.
+
+The scorer turns emails into a binary matrix with a row per email and a
+column per row of the five tables. A single sparse product of the matrix
+with the weights, with ones where a weight is known and with ones gives, for
+every table, the sum of the weights an email matched and their counts, so
+their mean. The five means are multiplied in log space: the rank is the
+exponential of the sum of their logs, with the sign of the negative ones.
+Senders match a single row, so their factor is the log weight of the row.
+
+Ranks are the ones of ``calculate_rank`` up to the rounding of floats: sums
+of many weights and logs are not rounded in the same order as products.
+"""
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from scipy import sparse
+
+from zippy.pipeline.features.analyzer import TextAnalyzer, get_analyzer
+from zippy.pipeline.model.text_index import CHAR_MATCH, TOKEN_MATCH
+from zippy.pipeline.model.weight_store import UserWeights
+
+# tables of the weights of an email, in the order they are multiplied
+GROUPS: Tuple[str, ...] = (
+    "from_weight",
+    "thread_senders_weight",
+    "thread_weights",
+    "thread_term_weights",
+    "msg_terms_weight",
+)
+
+
+def log_ranks(factors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return log of the absolute product of every row and its sign."""
+    with np.errstate(divide="ignore"):
+        logs = np.log(np.abs(factors)).sum(axis=1)
+    negative = np.count_nonzero(factors < 0, axis=1) % 2 == 1
+    return logs, np.where(negative, -1.0, 1.0)
+
+
+class SparseScorer:
+    """Rank emails with a snapshot of the weights of a user.
+
+    Parameters
+    ----------
+    user_weights: UserWeights
+        Weights of the user, or of the global model
+    term_match: str, optional
+        How terms of emails match the terms of the tables, either ``char`` or
+        ``token``
+    analyzer: TextAnalyzer, optional
+        Splits subjects and contents into terms
+    """
+
+    def __init__(
+        self,
+        user_weights: UserWeights,
+        term_match: str = CHAR_MATCH,
+        analyzer: Optional[TextAnalyzer] = None,
+    ) -> None:
+        self.term_match = term_match
+        self.analyzer = analyzer or get_analyzer()
+        with user_weights.lock:
+            self.tables = {name: user_weights[name] for name in GROUPS}
+        self.senders = user_weights.senders
+        self.terms = user_weights.terms
+        self.threads = user_weights.threads
+        self.sizes = {name: len(table) for name, table in self.tables.items()}
+        for name, index in self.terms.items():
+            self.sizes[name] = min(self.sizes[name], index.size)
+        self.offsets: Dict[str, int] = {}
+        offset = 0
+        for name in GROUPS:
+            self.offsets[name] = offset
+            offset += self.sizes[name]
+        self.columns = self._columns(offset)
+
+    def _columns(self, size: int) -> sparse.csr_matrix:
+        """Return weights, known weights and ones of every row, by table."""
+        groups = len(GROUPS)
+        rows, columns, values = [], [], []
+        for group, name in enumerate(GROUPS):
+            start, end = self.offsets[name], self.sizes[name]
+            weights = np.asarray(self.tables[name]["weight"].iloc[:end], dtype=float)
+            known = ~np.isnan(weights)
+            positions = np.arange(start, start + len(weights))
+            for column, column_values in enumerate(
+                (np.where(known, weights, 0.0), known.astype(float), 1.0)
+            ):
+                rows.append(positions)
+                columns.append(np.full(len(weights), column * groups + group))
+                values.append(np.broadcast_to(column_values, weights.shape))
+        return sparse.csr_matrix(
+            (np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+            shape=(size, 3 * groups),
+        )
+
+    def _sender(self, name: str, sender: Any) -> List[int]:
+        table = self.tables[name]
+        label = self.senders[name].get(sender, table)
+        if label is None:
+            return []
+        return [table.index.get_loc(label)]
+
+    def _terms(self, name: str, texts: List[Any]) -> List[int]:
+        try:
+            terms = self.analyzer.vocabulary(texts)
+        except ValueError:
+            # texts without terms weigh 1
+            return []
+        index, size = self.terms[name], self.sizes[name]
+        if self.term_match == TOKEN_MATCH:
+            return index.match_terms(terms, size)
+        return np.flatnonzero(index.match_chars(str(terms), size)).tolist()
+
+    def _thread(self, subject: Any) -> List[int]:
+        subject = str(subject)
+        if not subject:
+            return []
+        return self.threads.contains(subject, self.sizes["thread_weights"])
+
+    def _matches(self, msg: pd.DataFrame) -> Iterator[Tuple[str, List[int]]]:
+        """Yield positions of the rows the email matches, by table."""
+        yield "from_weight", self._sender("from_weight", msg["From"][0])
+        if msg["is_thread"][0]:
+            sender = msg["From"][0]
+            yield "thread_senders_weight", self._sender("thread_senders_weight", sender)
+            yield "thread_weights", self._thread(msg["Subject"][0])
+            yield "thread_term_weights", self._terms(
+                "thread_term_weights", list(msg["Subject"])
+            )
+        yield "msg_terms_weight", self._terms("msg_terms_weight", list(msg["content"]))
+
+    def features(self, msgs: Sequence[pd.DataFrame]) -> sparse.csr_matrix:
+        """Return matrix with a row per email, set on the rows it matches."""
+        rows: List[int] = []
+        columns: List[int] = []
+        for row, msg in enumerate(msgs):
+            for name, positions in self._matches(msg):
+                offset = self.offsets[name]
+                columns.extend(offset + position for position in positions)
+                rows.extend(row for _ in positions)
+        return sparse.csr_matrix(
+            (np.ones(len(columns)), (rows, columns)),
+            shape=(len(msgs), self.columns.shape[0]),
+        )
+
+    def factors(self, features: sparse.csr_matrix) -> np.ndarray:
+        """Return the five weights of every email, a column per table."""
+        product = (features @ self.columns).toarray()
+        sums, known, matched = np.hsplit(product, 3)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # no known weight among the matched rows gives NaN, like pandas
+            factors = sums / known
+        factors[matched == 0] = 1.0
+        return factors
+
+    def rank(self, msgs: Sequence[pd.DataFrame]) -> np.ndarray:
+        """Return rank of every email."""
+        logs, signs = log_ranks(self.factors(self.features(msgs)))
+        return signs * np.exp(logs)
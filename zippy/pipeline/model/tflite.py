@@ -0,0 +1,257 @@
+"""TFLite backend of the intent model for CPU only machines.
+
+The keras model is exported with a fixed batch size and converted to a TFLite
+flatbuffer, optionally with dynamic range quantization of its weights to
+``int8``. The converted model is run by the TFLite interpreter, from the
+``tflite_runtime`` package if it is installed, so a worker does not need to
+import the whole of TensorFlow to rank emails.
+
+Convert the model and compare it with the keras one on held-out subjects:
+
+.. code-block:: console
+
+  $ python -m zippy.pipeline.model.tflite --quantize --holdout subjects.csv
+"""
+import argparse
+import pathlib
+import threading
+
+from typing import Any, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from zippy.pipeline.model.intent import (
+    INTENT_DIR,
+    INTENT_MODEL,
+    TOKENIZER,
+    import_tensorflow,
+    load_keras_model,
+    load_tokenizer,
+)
+from zippy.utils.log_handler import get_logger
+
+TFLITE_MODEL = INTENT_DIR / "intent-bi-lstm-highest.tflite"
+
+# rows of every call of the interpreter, the LSTM layers need a fixed shape
+DEFAULT_LITE_BATCH_SIZE: int = 8
+# intent score above which an email is considered to have an intent
+INTENT_THRESHOLD: float = 0.5
+
+
+def get_interpreter_class() -> Any:
+    """Return the lightest TFLite interpreter available."""
+    # pylint: disable=import-outside-toplevel,invalid-name
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        Interpreter = import_tensorflow().lite.Interpreter
+    return Interpreter
+
+
+def convert(
+    model_path: pathlib.Path = INTENT_MODEL,
+    output_path: pathlib.Path = TFLITE_MODEL,
+    batch_size: int = DEFAULT_LITE_BATCH_SIZE,
+    quantize: bool = False,
+) -> pathlib.Path:
+    """Convert the keras model to a TFLite flatbuffer.
+
+    Parameters
+    ----------
+    model_path: pathlib.Path, optional
+        Path of the keras model
+    output_path: pathlib.Path, optional
+        Path of the converted model
+    batch_size: int, optional
+        Number of sequences the converted model predicts at once
+    quantize: bool, optional
+        Store weights as ``int8`` with dynamic range quantization
+
+    Returns
+    -------
+    pathlib.Path
+        Path of the converted model
+    """
+    tf = import_tensorflow()
+
+    model = load_keras_model(model_path)
+    sequence_length = model.input_shape[-1]
+    # recurrent layers only convert to fused TFLite ops with static shapes
+    serve = tf.function(
+        lambda sequences: model(sequences, training=False),
+        input_signature=[tf.TensorSpec([batch_size, sequence_length], tf.int32)],
+    )
+    converter = tf.lite.TFLiteConverter.from_concrete_functions(
+        [serve.get_concrete_function()]
+    )
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    flatbuffer = converter.convert()
+
+    output_path = pathlib.Path(output_path)
+    partial_path = output_path.with_suffix(".partial")
+    partial_path.write_bytes(flatbuffer)
+    # the registry of a running client must never load a half written model
+    partial_path.replace(output_path)
+    return output_path
+
+
+class TFLiteModel:
+    """Predict intent scores with a converted model.
+
+    Has the ``predict_on_batch`` method of the keras model, for any number of
+    sequences. Calls of the interpreter are serialized, so a
+    model can be shared by threads.
+
+    Parameters
+    ----------
+    path: pathlib.Path, optional
+        Path of the converted model
+    num_threads: int, optional
+        Threads used by the interpreter for a call
+    """
+
+    def __init__(
+        self, path: pathlib.Path = TFLITE_MODEL, num_threads: Optional[int] = 1
+    ) -> None:
+        interpreter_class = get_interpreter_class()
+        self.path = pathlib.Path(path)
+        self.interpreter = interpreter_class(
+            model_path=str(self.path), num_threads=num_threads
+        )
+        self.interpreter.allocate_tensors()
+        input_details = self.interpreter.get_input_details()[0]
+        output_details = self.interpreter.get_output_details()[0]
+        self._input_index = input_details["index"]
+        self._output_index = output_details["index"]
+        self.batch_size, self.sequence_length = input_details["shape"]
+        self._batch = np.zeros(input_details["shape"], dtype=input_details["dtype"])
+        self._lock = threading.Lock()
+
+    def predict_on_batch(self, sequences: np.ndarray) -> np.ndarray:
+        """Return intent scores of the sequences."""
+        sequences = np.asarray(sequences)
+        rows = len(sequences)
+        batch = self._batch
+        scores = []
+        with self._lock:
+            for start in range(0, rows, self.batch_size):
+                end = min(start + self.batch_size, rows)
+                filled = end - start
+                batch[:filled] = sequences[start:end]
+                # rows after the last sequence keep old values, their scores
+                # are dropped
+                self.interpreter.set_tensor(self._input_index, batch)
+                self.interpreter.invoke()
+                scores.append(self.interpreter.get_tensor(self._output_index)[:filled])
+        if not scores:
+            return np.zeros((0, 1), dtype=np.float32)
+        return np.concatenate(scores)
+
+
+def load_tflite_model(path: pathlib.Path) -> TFLiteModel:
+    """Load a converted intent model."""
+    if not pathlib.Path(path).exists():
+        # the interpreter raises a ValueError, the registry expects this
+        raise FileNotFoundError(2, "No such file or directory", str(path))
+    return TFLiteModel(path)
+
+
+class ParityReport(NamedTuple):
+    """Differences of the intent scores of two models."""
+
+    size: int
+    max_abs_diff: float
+    mean_abs_diff: float
+    # share of sequences whose intent is decided the same way
+    agreement: float
+
+
+def check_parity(
+    reference: Any,
+    candidate: Any,
+    sequences: np.ndarray,
+    threshold: float = INTENT_THRESHOLD,
+) -> ParityReport:
+    """Compare the intent scores of two models on the same sequences.
+
+    Parameters
+    ----------
+    reference: Any
+        Model whose scores are expected, usually the keras model
+    candidate: Any
+        Model to check, usually the converted one
+    sequences: np.ndarray
+        Encoded held-out subjects
+    threshold: float, optional
+        Score above which an email has an intent
+
+    Returns
+    -------
+    ParityReport
+        Differences of the scores
+    """
+    expected = np.asarray(reference.predict_on_batch(sequences)).ravel()
+    scores = np.asarray(candidate.predict_on_batch(sequences)).ravel()
+    if not len(expected):
+        return ParityReport(0, 0.0, 0.0, 1.0)
+    diff = np.abs(expected - scores)
+    agreement = np.mean((expected > threshold) == (scores > threshold))
+    return ParityReport(
+        len(expected), float(diff.max()), float(diff.mean()), float(agreement)
+    )
+
+
+def read_holdout(path: pathlib.Path, column: str = "Subject") -> Sequence[str]:
+    """Read held-out subjects from a CSV file."""
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+
+    return pd.read_csv(path)[column].fillna("").astype(str).tolist()
+
+
+def main(args: Optional[Sequence[str]] = None) -> None:
+    """Convert the intent model and check it against the keras one."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--model", type=pathlib.Path, default=INTENT_MODEL)
+    parser.add_argument("--output", type=pathlib.Path, default=TFLITE_MODEL)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_LITE_BATCH_SIZE)
+    parser.add_argument(
+        "--quantize", action="store_true", help="Quantize weights to int8."
+    )
+    parser.add_argument(
+        "--holdout", type=pathlib.Path, help="CSV file of held-out subjects."
+    )
+    parser.add_argument("--column", default="Subject", help="Column of subjects.")
+    options = parser.parse_args(args)
+
+    logger = get_logger("client")
+    output = convert(
+        options.model, options.output, options.batch_size, options.quantize
+    )
+    logger.info(
+        "Converted %s to %s (%s bytes).",
+        options.model.name,
+        output,
+        output.stat().st_size,
+    )
+    if options.holdout is None:
+        return
+
+    sequences = load_tokenizer(TOKENIZER).encode(
+        read_holdout(options.holdout, options.column)
+    )
+    report = check_parity(
+        load_keras_model(options.model), TFLiteModel(output), sequences
+    )
+    logger.info(
+        "Checked %s subjects: max difference %.6f, mean difference %.6f, "
+        "same intent for %.2f%%.",
+        report.size,
+        report.max_abs_diff,
+        report.mean_abs_diff,
+        100 * report.agreement,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Frozen copy of the keras tokenizer the intent model was trained with.
+
+Encoding with the keras tokenizer requires fitting it on every text first,
+which keeps growing its vocabulary and counts in a long running client. The
+frozen tokenizer only encodes: word indices are computed once from the
+pickled tokenizer and texts are encoded and pre-padded straight into an
+``int32`` array, the same as ``texts_to_sequences`` and ``pad_sequences`` of
+the unfitted tokenizer would.
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_SEQUENCE_LENGTH: int = 50
+
+
+class FrozenTokenizer:
+    """Encode texts with a fixed vocabulary.
+
+    Parameters
+    ----------
+    word_index: Dict[str, int]
+        Index of every word
+    num_words: int, optional
+        Only words with a lower index are kept, all if not given
+    oov_token: str, optional
+        Word whose index is used for unknown words, these are left out if not
+        given
+    filters: str, optional
+        Characters that separate words like ``split`` does
+    lower: bool, optional
+        Lowercase texts before splitting
+    split: str, optional
+        Separator of words
+    char_level: bool, optional
+        Every character is a word
+    sequence_length: int, optional
+        Length of encoded sequences, longer ones keep their end, shorter ones
+        are padded with zeros in front
+    analyzer: Callable, optional
+        Splits texts into words instead of ``filters`` and ``split``
+    """
+
+    def __init__(
+        self,
+        word_index: Dict[str, int],
+        num_words: Optional[int] = None,
+        oov_token: Optional[str] = None,
+        filters: str = "",
+        lower: bool = True,
+        split: str = " ",
+        char_level: bool = False,
+        sequence_length: int = DEFAULT_SEQUENCE_LENGTH,
+        analyzer: Optional[Callable[[str], List[str]]] = None,
+    ) -> None:
+        self.lower = lower
+        self.split = split
+        self.char_level = char_level
+        self.analyzer = analyzer
+        self.sequence_length = sequence_length
+        self._filters = str.maketrans({char: split for char in filters})
+
+        oov_index = word_index.get(oov_token) if oov_token is not None else None
+        self.oov_index = oov_index
+        self.vocabulary: Dict[str, Optional[int]] = {}
+        for word, index in word_index.items():
+            if num_words and index >= num_words:
+                index = oov_index
+            self.vocabulary[word] = index
+
+    @classmethod
+    def from_tokenizer(
+        cls, tokenizer: Any, sequence_length: int = DEFAULT_SEQUENCE_LENGTH
+    ) -> "FrozenTokenizer":
+        """Freeze a keras tokenizer, as is."""
+        return cls(
+            dict(tokenizer.word_index),
+            num_words=tokenizer.num_words,
+            oov_token=tokenizer.oov_token,
+            filters=tokenizer.filters,
+            lower=tokenizer.lower,
+            split=tokenizer.split,
+            char_level=tokenizer.char_level,
+            sequence_length=sequence_length,
+            analyzer=getattr(tokenizer, "analyzer", None),
+        )
+
+    def words(self, text: str) -> List[str]:
+        """Split text into words, like the keras tokenizer."""
+        if self.analyzer is not None and not self.char_level:
+            return self.analyzer(text)
+        if self.lower:
+            text = text.lower()
+        if self.char_level:
+            return list(text)
+        return [
+            word for word in text.translate(self._filters).split(self.split) if word
+        ]
+
+    def indices(self, text: str) -> List[int]:
+        """Return indices of the known words of the text."""
+        vocabulary = self.vocabulary
+        oov_index = self.oov_index
+        indices = []
+        for word in self.words(text):
+            index = vocabulary.get(word, oov_index)
+            if index is not None:
+                indices.append(index)
+        return indices
+
+    def encode(
+        self, texts: Sequence[str], out: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Encode texts into pre-padded rows of an ``int32`` array.
+
+        If ``out`` is given, its first rows are filled and returned instead of
+        allocating a new array.
+        """
+        rows = len(texts)
+        length = self.sequence_length
+        if out is None:
+            out = np.zeros((rows, length), dtype=np.int32)
+        else:
+            out = out[:rows]
+            out.fill(0)
+        for row, text in enumerate(texts):
+            indices = self.indices(text)[-length:]
+            if indices:
+                start = length - len(indices)
+                out[row, start:] = indices
+        return out
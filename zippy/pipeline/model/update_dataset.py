@@ -1,75 +1,87 @@
 """Module for online training new email messages."""
 
-import pathlib
+import logging
 
-import nltk
 import numpy as np
 import pandas as pd
 
-from sklearn.feature_extraction.text import CountVectorizer
+from zippy.pipeline.features.analyzer import get_analyzer
+from zippy.pipeline.model.weight_store import WEIGHTS
+from zippy.utils.metrics import METRICS
 
-from zippy.utils.log_handler import get_logger
+# configured by ``get_logger`` once the client starts, not on import
+LOGGER = logging.getLogger("client")
 
-LOGGER = get_logger("client")
 
-MODEL_DIR = pathlib.Path(__file__).parents[3] / "output/models/simplerank"
+def load_weights(user="global"):
+    """Load weights of the user, read from the CSV on first use only."""
+    return WEIGHTS.get(user).train_weights()
 
-try:
-    VEC = CountVectorizer(stop_words=nltk.corpus.stopwords.words("english"))
-except LookupError:
-    nltk.download("stopwords")
-    VEC = CountVectorizer(stop_words=nltk.corpus.stopwords.words("english"))
 
+def update_sender_weight(sender, weights, senders=None):
+    """Increase weight of a known sender, return whether the sender is known.
 
-def load_weights(user="global"):
-    """Load weights from the CSV."""
-    from_wt = pd.read_csv(MODEL_DIR / user / "from_weight.csv")
-    thread_sender_wt = pd.read_csv(MODEL_DIR / user / "thread_senders_weight.csv")
-    thread_wt = pd.read_csv(MODEL_DIR / user / "thread_weights.csv")
-    thread_term_wt = pd.read_csv(MODEL_DIR / user / "thread_term_weights.csv")
-    msg_term_wt = pd.read_csv(MODEL_DIR / user / "msg_terms_weight.csv")
-    rank_df = pd.read_csv(MODEL_DIR / user / "rank_df.csv")
-    return (from_wt, thread_sender_wt, thread_wt, thread_term_wt, msg_term_wt, rank_df)
-
-
-def update_from_weights(email, from_weight):
-    """Update weights of email senders."""
-    if email["From"][0] in from_weight.From.values:
-        index = from_weight[from_weight.From == email["From"][0]].index.values
-        current_weight = from_weight.loc[index, "weight"].values
-        from_weight.at[index, "weight"] = np.log(np.exp(current_weight) + 1)
+    The sender is looked up in the index if given, else in every row.
+    """
+    if senders is not None:
+        label = senders.get(sender, weights)
+        if label is None:
+            return False
+        weights.at[label, "weight"] = np.log(np.exp(weights.at[label, "weight"]) + 1)
+        return True
+    if sender not in weights.From.values:
+        return False
+    index = weights[weights.From == sender].index.values
+    current_weight = weights.loc[index, "weight"].values
+    weights.at[index, "weight"] = np.log(np.exp(current_weight) + 1)
+    return True
+
+
+@METRICS.timed("train.update_from_weights")
+def update_from_weights(email, from_weight, senders=None):
+    """Update weights of email senders, return the updated table."""
+    if update_sender_weight(email["From"][0], from_weight, senders):
         LOGGER.info("Weights for %s updated.", email["From"][0])
     else:
         row = {"From": email["From"][0], "weight": np.log(2)}
         from_weight = from_weight.append(row, ignore_index=True)
         LOGGER.info("New sender %s added.", email["From"][0])
-    from_weight.to_csv(MODEL_DIR / email["To"][0] / "from_weight.csv", index=False)
+    return from_weight
 
 
-def update_thread_senders_weights(email, thread_senders_weights):
-    """Update weights of email senders using new threads."""
-    if email["From"][0] in thread_senders_weights.From.values:
-        index = thread_senders_weights[
-            thread_senders_weights.From == email["From"][0]
-        ].index.values
-        current_weight = thread_senders_weights.loc[index, "weight"].values
-        thread_senders_weights.at[index, "weight"] = np.log(np.exp(current_weight) + 1)
+@METRICS.timed("train.update_thread_senders_weights")
+def update_thread_senders_weights(email, thread_senders_weights, senders=None):
+    """Update weights of email senders using new threads, return the table."""
+    if update_sender_weight(email["From"][0], thread_senders_weights, senders):
         LOGGER.info("Weights for %s in threads updated.", email["From"][0])
     else:
         row = {"From": email["From"][0], "weight": np.log(2)}
         thread_senders_weights = thread_senders_weights.append(row, ignore_index=True)
         LOGGER.info("New sender %s added to threads weights.", email["From"][0])
-    thread_senders_weights.to_csv(
-        MODEL_DIR / email["To"][0] / "thread_senders_weight.csv", index=False
-    )
+    return thread_senders_weights
+
 
+def find_thread(thread_weights, subject, subjects=None):
+    """Return labels of the rows of the thread, looked up in the index if given."""
+    if subjects is not None:
+        return thread_weights.index[
+            subjects.lookup(subject, len(thread_weights))
+        ].values
+    return thread_weights[thread_weights.thread == subject].index.values
 
-def update_thread_weights(email, thread_weights):
-    """Update thread weights using new threads."""
-    if email["Subject"][0] in thread_weights.thread.values:
-        index = thread_weights[
-            thread_weights.thread == email["Subject"][0]
-        ].index.values
+
+def thread_weights_containing(thread_weights, term, subjects=None):
+    """Return weights of threads whose subject contains the term."""
+    if subjects is not None:
+        return thread_weights.weight.iloc[subjects.contains(term, len(thread_weights))]
+    return thread_weights.weight[thread_weights.thread.str.contains(term, regex=False)]
+
+
+@METRICS.timed("train.update_thread_weights")
+def update_thread_weights(email, thread_weights, subjects=None):
+    """Update thread weights using new threads, return the updated table."""
+    index = find_thread(thread_weights, email["Subject"][0], subjects)
+    if len(index) > 0:
         current_freq = thread_weights.loc[index, "freq"].values
         if current_freq < 2.0:
             thread_weights.at[index, "freq"] = current_freq + 1.0
@@ -94,39 +106,37 @@ def update_thread_weights(email, thread_weights):
         }
         thread_weights = thread_weights.append(row, ignore_index=True)
         LOGGER.info("New thread %s added.", email["Subject"][0])
-    thread_weights.to_csv(
-        MODEL_DIR / email["To"][0] / "thread_weights.csv", index=False
-    )
+    return thread_weights
 
 
-def update_thread_terms_weights(email, thread_term_weights, thread_weights, thread_tdm):
-    """Update threads weights using new terms in thread subjects."""
+@METRICS.timed("train.update_thread_terms_weights")
+def update_thread_terms_weights(
+    email, thread_term_weights, thread_weights, thread_tdm, subjects=None
+):
+    """Update threads weights using new terms in thread subjects, return them."""
     for term in thread_tdm.columns:
         if term in thread_term_weights.term.values:
             index = thread_term_weights[thread_term_weights.term == term].index.values
-            updated_weight = thread_weights.weight[
-                thread_weights.thread.str.contains(term, regex=False)
-            ].mean()
+            updated_weight = thread_weights_containing(
+                thread_weights, term, subjects
+            ).mean()
             if isinstance(updated_weight, np.float):
                 updated_weight = 1.0
             thread_term_weights.at[index, "weight"] = updated_weight
             LOGGER.info("Weight for term %s from thread subject updated.", term)
         else:
-            weight = thread_weights.weight[
-                thread_weights.thread.str.contains(term, regex=False)
-            ].mean()
+            weight = thread_weights_containing(thread_weights, term, subjects).mean()
             if np.isnan(weight):
                 weight = 1.0
             row = {"term": term, "weight": weight}
             thread_term_weights = thread_term_weights.append(row, ignore_index=True)
             LOGGER.info("New term %s added from thread subject.", term)
-    thread_term_weights.to_csv(
-        MODEL_DIR / email["To"][0] / "thread_term_weights.csv", index=False
-    )
+    return thread_term_weights
 
 
+@METRICS.timed("train.update_msg_terms_weights")
 def update_msg_terms_weights(email, msg_term_weights, msg_tdm):
-    """Update weights using new terms in email content."""
+    """Update weights using new terms in email content, return the table."""
     for term in msg_tdm.columns:
         if term in msg_term_weights.term.values:
             index = msg_term_weights[msg_term_weights.term == term].index.values
@@ -146,13 +156,12 @@ def update_msg_terms_weights(email, msg_term_weights, msg_tdm):
             }
             msg_term_weights = msg_term_weights.append(row, ignore_index=True)
             LOGGER.info("New term %s added from email content.")
-    msg_term_weights.to_csv(
-        MODEL_DIR / email["To"][0] / "msg_terms_weight.csv", index=False
-    )
+    return msg_term_weights
 
 
+@METRICS.timed("train.add_new_email")
 def add_new_email(email, rank_df, rank, priority, intent):
-    """Add new emails after ranking."""
+    """Add new emails after ranking, return the updated table."""
     date = pd.to_datetime(email["Date"][0], infer_datetime_format=True)
     row = {
         "date": str(date),
@@ -166,52 +175,84 @@ def add_new_email(email, rank_df, rank, priority, intent):
     LOGGER.info(
         "New email from %s added to rank dataset with rank %s", row["from"], rank
     )
-    rank_df.to_csv(MODEL_DIR / email["To"][0] / "rank_df.csv", index=False)
+    return rank_df
 
 
 def online_training(email, rank, priority, intent):
     """Online training for new emails."""
-    from_weight, *threads, msg_term_weights, rank_df = load_weights(email["To"][0])
-    (thread_from_wt, thread_activity_wt, thread_term_wt) = (
+    user_weights = WEIGHTS.get(email["To"][0])
+    with METRICS.timer("train.user"), user_weights.lock:
+        train_user(user_weights, email, rank, priority, intent)
+
+    # Adding emails to global model
+    global_weights = WEIGHTS.get()
+    with METRICS.timer("train.global"), global_weights.lock:
+        global_weights.update(
+            "rank_df",
+            add_new_email(
+                email=email,
+                rank_df=global_weights["rank_df"],
+                rank=rank,
+                priority=priority,
+                intent=intent,
+            ),
+        )
+
+    WEIGHTS.flush_if_due()
+
+
+def train_user(user_weights, email, rank, priority, intent):
+    """Update weights of the user with a new email."""
+    from_weight, *threads, msg_term_weights, rank_df = user_weights.train_weights()
+    thread_from_wt, thread_activity_wt, thread_term_wt = (
         threads[0],
         threads[1],
         threads[2],
     )
 
-    update_from_weights(email, from_weight)
+    senders = user_weights.senders
+    user_weights.update(
+        "from_weight",
+        update_from_weights(email, from_weight, senders["from_weight"]),
+    )
 
-    update_thread_senders_weights(email, thread_from_wt)
+    user_weights.update(
+        "thread_senders_weight",
+        update_thread_senders_weights(
+            email, thread_from_wt, senders["thread_senders_weight"]
+        ),
+    )
 
-    update_thread_weights(email, thread_activity_wt)
+    user_weights.update(
+        "thread_weights",
+        update_thread_weights(email, thread_activity_wt, user_weights.threads),
+    )
 
     try:
-        thread_term_vector = VEC.fit_transform(email["Subject"])
-        thread_tdm = pd.DataFrame(
-            thread_term_vector.toarray(), columns=VEC.get_feature_names()
-        )
-        update_thread_terms_weights(
-            email, thread_term_wt, thread_activity_wt, thread_tdm
+        thread_tdm = get_analyzer().term_matrix(email["Subject"])
+        user_weights.update(
+            "thread_term_weights",
+            update_thread_terms_weights(
+                email,
+                thread_term_wt,
+                thread_activity_wt,
+                thread_tdm,
+                user_weights.threads,
+            ),
         )
     except ValueError:
         # Some subjects from the test set result in empty vocabulary
         LOGGER.warning("Empty Subject. No changes were made.")
 
     try:
-        msg_term_vector = VEC.fit_transform(email["content"])
-        msg_tdm = pd.DataFrame(
-            msg_term_vector.toarray(), columns=VEC.get_feature_names()
+        msg_tdm = get_analyzer().term_matrix(email["content"])
+        user_weights.update(
+            "msg_terms_weight",
+            update_msg_terms_weights(email, msg_term_weights, msg_tdm),
         )
-        update_msg_terms_weights(email, msg_term_weights, msg_tdm)
     except ValueError:
         LOGGER.warning("Empty email message. No changes were made.")
 
-    add_new_email(email, rank_df, rank, priority, intent)
-
-    # Adding emails to global model
-    add_new_email(
-        email=email,
-        rank_df=load_weights()[5],
-        rank=rank,
-        priority=priority,
-        intent=intent,
+    user_weights.update(
+        "rank_df", add_new_email(email, rank_df, rank, priority, intent)
     )
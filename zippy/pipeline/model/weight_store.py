@@ -0,0 +1,455 @@
+"""Weights of the users and the global model, kept in memory.
+
+Ranking an email used to read the six CSV files of the user and of the global
+model, and training on it read those of the user again. The store reads the
+files of a user once per process. Ranking takes a snapshot of the tables and
+training changes copies of them, then replaces the tables it changed, so
+both share one view of the weights without parsing files, and a snapshot is
+never changed while ranking reads it, even from another thread.
+
+Changed tables are written back every ``flush_interval`` seconds and when the
+process exits. Tables are written to a temporary file first and renamed, so a
+crash never leaves a half written table. Ranks of emails are only ever added,
+so new rows are appended to ``rank_df.csv`` instead of rewriting it, which
+keeps rows added by other processes to the global one.
+
+Weights of senders are looked up by a hash index of the sender address,
+instead of comparing the address with every row of the table. Terms are
+matched through a :class:`~zippy.pipeline.model.text_index.TermIndex` and
+subjects of threads through a
+:class:`~zippy.pipeline.model.text_index.ThreadIndex`.
+
+The rank threshold is a quantile of the ranks of the emails of the user, kept
+by a :class:`~zippy.pipeline.model.quantiles.QuantileSketch` saved in
+``rank_quantiles.json`` next to the tables. The sketch is built from
+``rank_df.csv`` the first time only, after which ranks are never read back:
+the store only keeps the ranks added since the last write.
+
+Workers of the supervisor share the weights of the global model. Each one
+keeps a sketch of the ranks it added since its last write and merges it into
+``rank_quantiles.json`` under a lock of the file, then reads back the merged
+sketch, so thresholds follow the ranks of every worker as of their last
+writes. Ranks are appended to ``rank_df.csv`` under a lock of the file too.
+Every other table of the global model is written by replacing it with the
+version of the worker writing it.
+"""
+
+import atexit
+import logging
+import os
+import pathlib
+import threading
+import time
+
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import pandas as pd
+
+from zippy.pipeline.model.quantiles import QuantileSketch, read_sketch, write_sketch
+from zippy.pipeline.model.text_index import (
+    CHAR_MATCH,
+    TERM_MATCHES,
+    TermIndex,
+    ThreadIndex,
+)
+from zippy.utils.file_lock import file_lock
+from zippy.utils.log_handler import get_logger
+from zippy.utils.metrics import METRICS
+
+MODEL_DIR = pathlib.Path(__file__).parents[3] / "output/models/simplerank"
+GLOBAL = "global"
+
+# columns of every table, named after its file
+TABLES: Dict[str, List[str]] = {
+    "from_weight": ["From", "weight"],
+    "thread_senders_weight": ["From", "freq", "weight"],
+    "thread_weights": ["freq", "time_span", "weight", "min_time", "thread"],
+    "thread_term_weights": ["term", "weight"],
+    "msg_terms_weight": ["freq", "term", "weight"],
+    "rank_df": ["date", "from", "rank", "subject", "priority", "intent"],
+}
+# tables whose rows are never changed, only added
+APPEND_ONLY: Set[str] = {"rank_df"}
+# tables with a weight per sender, indexed by sender
+SENDER_TABLES: Set[str] = {"from_weight", "thread_senders_weight"}
+# tables with a weight per term, indexed by term
+TERM_TABLES: Set[str] = {"thread_term_weights", "msg_terms_weight"}
+# seconds between writes of changed tables
+DEFAULT_FLUSH_INTERVAL: float = 60
+# sketch of the ranks, saved next to the tables
+QUANTILES = "rank_quantiles"
+# quantile of the ranks used as threshold
+DEFAULT_THRESHOLD_QUANTILE: float = 0.5
+# rank emails of a batch one by one, or at once with sparse matrices
+PANDAS_ENGINE = "pandas"
+SPARSE_ENGINE = "sparse"
+RANK_ENGINES = (PANDAS_ENGINE, SPARSE_ENGINE)
+SECONDS_PER_DAY: int = 24 * 60 * 60
+
+
+def timestamps(dates: pd.Series) -> List[Optional[float]]:
+    """Return seconds since the epoch of the dates, None if not a date."""
+    times = pd.to_datetime(dates, utc=True, errors="coerce")
+    return [None if pd.isna(time_) else time_.timestamp() for time_ in times]
+
+
+class SenderIndex:
+    """Row of every sender of a table of weights.
+
+    Rows are only ever added to the end of the tables, so the index is kept
+    up to date by indexing the rows added since the last time.
+
+    Parameters
+    ----------
+    table: pd.DataFrame, optional
+        Table to index
+    column: str, optional
+        Column of the sender addresses
+    """
+
+    def __init__(self, table: Optional[pd.DataFrame] = None, column: str = "From"):
+        self.column = column
+        self.rows: Dict[str, Any] = {}
+        self.size = 0
+        if table is not None:
+            self.extend(table)
+
+    def extend(self, table: pd.DataFrame) -> None:
+        """Index rows added to the end of the table."""
+        if len(table) < self.size:
+            # rows were removed, index the table again
+            self.rows.clear()
+            self.size = 0
+        start = self.size
+        for label, sender in table[self.column].iloc[start:].items():
+            # the first row of a sender is the one updated by training
+            self.rows.setdefault(sender, label)
+        self.size = len(table)
+
+    def get(self, sender: str, table: pd.DataFrame) -> Optional[Any]:
+        """Return label of the row of the sender in the table, if any.
+
+        The table can be an older version than the index, from before rows
+        were added.
+        """
+        label = self.rows.get(sender)
+        if label is None or label not in table.index:
+            return None
+        return label
+
+    def weight(self, sender: str, table: pd.DataFrame, default: Any = 1) -> Any:
+        """Return weight of the sender in the table, ``default`` if unknown."""
+        label = self.get(sender, table)
+        if label is None:
+            return default
+        return table.at[label, "weight"]
+
+
+class UserWeights:
+    """Tables of weights of a user.
+
+    Parameters
+    ----------
+    user: str
+        Email address of the user, or ``global``
+    tables: Dict[str, pd.DataFrame]
+        Table of every name of ``TABLES``
+    quantiles: QuantileSketch, optional
+        Sketch of the ranks, built from ``rank_df`` if not given
+    half_life: float, optional
+        Seconds after which a rank counts half as much, when building the
+        sketch
+    """
+
+    def __init__(
+        self,
+        user: str,
+        tables: Dict[str, pd.DataFrame],
+        quantiles: Optional[QuantileSketch] = None,
+        half_life: Optional[float] = None,
+    ) -> None:
+        self.user = user
+        self.tables = tables
+        # held while tables are changed or written
+        self.lock = threading.RLock()
+        self.dirty: Set[str] = set()
+        self.flushed_rows = {name: len(tables[name]) for name in APPEND_ONLY}
+        self.senders = {name: SenderIndex(tables[name]) for name in SENDER_TABLES}
+        self.terms = {name: TermIndex(tables[name]) for name in TERM_TABLES}
+        self.threads = ThreadIndex(tables["thread_weights"])
+        if quantiles is None:
+            quantiles = QuantileSketch(half_life=half_life)
+            self._add_ranks(tables["rank_df"], quantiles)
+            self.dirty.add(QUANTILES)
+        self.quantiles = quantiles
+        # ranks added since the sketch was last written, merged into the file
+        self.new_quantiles = QuantileSketch(half_life=quantiles.half_life)
+
+    @staticmethod
+    def _add_ranks(rows: pd.DataFrame, *sketches: QuantileSketch):
+        ranks = pd.to_numeric(rows["rank"], errors="coerce")
+        if sketches[0].half_life is None:
+            times = [None] * len(ranks)
+        else:
+            times = timestamps(rows["date"])
+        for rank, at in zip(ranks, times):
+            for sketch in sketches:
+                sketch.add(rank, at)
+
+    def __getitem__(self, name: str) -> pd.DataFrame:
+        """Return table of the name."""
+        return self.tables[name]
+
+    def update(self, name: str, table: pd.DataFrame) -> None:
+        """Replace a table with its updated version."""
+        with self.lock:
+            if name in self.senders:
+                self.senders[name].extend(table)
+            if name in self.terms:
+                self.terms[name].extend(table)
+            if name == "thread_weights":
+                self.threads.extend(table)
+            if name == "rank_df":
+                start = len(self.tables[name])
+                self._add_ranks(table.iloc[start:], self.quantiles, self.new_quantiles)
+                self.dirty.add(QUANTILES)
+            self.tables[name] = table
+            self.dirty.add(name)
+
+    def rank_weights(self, quantile: float = DEFAULT_THRESHOLD_QUANTILE) -> Tuple:
+        """Return weights used to rank, like ``rank_message.load_weights``.
+
+        The threshold is the quantile of the ranks, read from the sketch.
+        """
+        with self.lock:
+            tables = self.tables.copy()
+            with METRICS.timer("rank.threshold"):
+                threshold = self.quantiles.quantile(quantile)
+        return (
+            tables["from_weight"],
+            tables["thread_senders_weight"],
+            tables["thread_weights"],
+            tables["thread_term_weights"],
+            tables["msg_terms_weight"],
+            threshold,
+        )
+
+    def train_weights(self) -> Tuple[pd.DataFrame, ...]:
+        """Return tables updated by training, like ``update_dataset.load_weights``.
+
+        Training changes rows in place, so it gets copies of the tables, put
+        back with :meth:`update`. Ranks are only ever added to new tables.
+        """
+        with self.lock:
+            return tuple(
+                self.tables[name] if name in APPEND_ONLY else self.tables[name].copy()
+                for name in TABLES
+            )
+
+
+class WeightStore:
+    """Keep weights of the users in memory and write changes back.
+
+    Parameters
+    ----------
+    directory: pathlib.Path, optional
+        Directory with a directory of tables per user
+    flush_interval: float, optional
+        Seconds between writes of changed tables
+    term_match: str, optional
+        How terms of emails match the terms of the tables, either ``char`` or
+        ``token``, see :mod:`zippy.pipeline.model.text_index`
+    threshold_quantile: float, optional
+        Quantile of the ranks used as threshold
+    half_life: float, optional
+        Seconds after which a rank counts half as much in the threshold, no
+        decay if not given
+    rank_engine: str, optional
+        How a batch of emails is ranked, either ``pandas`` or ``sparse``, see
+        :mod:`zippy.pipeline.model.scoring`
+    logger: logging.Logger, optional
+        Logger to use
+    """
+
+    def __init__(
+        self,
+        directory: pathlib.Path = MODEL_DIR,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        term_match: str = CHAR_MATCH,
+        threshold_quantile: float = DEFAULT_THRESHOLD_QUANTILE,
+        half_life: Optional[float] = None,
+        rank_engine: str = PANDAS_ENGINE,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.directory = pathlib.Path(directory)
+        self.flush_interval = flush_interval
+        self.term_match = term_match
+        self.threshold_quantile = threshold_quantile
+        self.half_life = half_life
+        self.rank_engine = rank_engine
+        self._logger = logger
+        self._users: Dict[str, UserWeights] = {}
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    @property
+    def logger(self) -> logging.Logger:
+        """Logger of the store, the client one by default."""
+        if self._logger is None:
+            self._logger = get_logger("client")
+        return self._logger
+
+    def configure(self, config: dict) -> None:
+        """Set options of the store from the client config.
+
+        Raises
+        ------
+        ValueError
+            If an option has an unknown value
+        """
+        term_match = config.get("term_match", CHAR_MATCH)
+        if term_match not in TERM_MATCHES:
+            raise ValueError(f"Unknown term match: {term_match}")
+        threshold_quantile = config.get(
+            "threshold_quantile", DEFAULT_THRESHOLD_QUANTILE
+        )
+        if not 0 <= threshold_quantile <= 1:
+            raise ValueError(f"Threshold quantile not in [0, 1]: {threshold_quantile}")
+        # days in the config
+        half_life = config.get("threshold_half_life")
+        if half_life is not None and half_life <= 0:
+            raise ValueError(f"Threshold half life not positive: {half_life}")
+        rank_engine = config.get("rank_engine", PANDAS_ENGINE)
+        if rank_engine not in RANK_ENGINES:
+            raise ValueError(f"Unknown rank engine: {rank_engine}")
+
+        self.flush_interval = config.get(
+            "weights_flush_interval", DEFAULT_FLUSH_INTERVAL
+        )
+        self.term_match = term_match
+        self.threshold_quantile = threshold_quantile
+        self.half_life = None if half_life is None else half_life * SECONDS_PER_DAY
+        self.rank_engine = rank_engine
+
+    def exists(self, user: str) -> bool:
+        """Return whether the user has weights."""
+        return user in self._users or (self.directory / user).exists()
+
+    def get(self, user: str = GLOBAL) -> UserWeights:
+        """Return weights of the user, reading them on first use."""
+        user_weights = self._users.get(user)
+        if user_weights is None:
+            with self._lock:
+                user_weights = self._users.get(user)
+                if user_weights is None:
+                    user_weights = self._read(user)
+                    self._users[user] = user_weights
+        return user_weights
+
+    def _read(self, user: str) -> UserWeights:
+        directory = self.directory / user
+        path = directory / f"{QUANTILES}.json"
+        quantiles = read_sketch(path, self.half_life)
+        if quantiles is None and path.exists():
+            self.logger.warning("Could not read %s, building it from the ranks.", path)
+        tables = {}
+        for name, columns in TABLES.items():
+            if name == "rank_df" and quantiles is not None:
+                # ranks are in the sketch, only new ones are kept
+                tables[name] = pd.DataFrame(columns=columns)
+            else:
+                tables[name] = pd.read_csv(directory / f"{name}.csv")
+        return UserWeights(user, tables, quantiles, self.half_life)
+
+    def create(self, user: str) -> UserWeights:
+        """Start empty weights for a new user and write them."""
+        with self._lock:
+            (self.directory / user).mkdir()
+            user_weights = UserWeights(
+                user,
+                {
+                    name: pd.DataFrame(columns=columns)
+                    for name, columns in TABLES.items()
+                },
+                half_life=self.half_life,
+            )
+            user_weights.dirty.update(TABLES)
+            self._users[user] = user_weights
+        self._flush_user(user_weights)
+        return user_weights
+
+    def _write(self, user_weights: UserWeights, name: str):
+        if name == QUANTILES:
+            self._write_quantiles(user_weights)
+            return
+        path = self.directory / user_weights.user / f"{name}.csv"
+        table = user_weights.tables[name]
+        if name in APPEND_ONLY:
+            self._append(path, table, user_weights.flushed_rows[name])
+            # written rows are only needed again by the sketch, which has them
+            user_weights.tables[name] = table.iloc[0:0]
+            user_weights.flushed_rows[name] = 0
+        else:
+            self._replace(path, table)
+
+    @staticmethod
+    def _replace(path: pathlib.Path, table: pd.DataFrame):
+        partial_path = path.with_suffix(".partial")
+        table.to_csv(partial_path, index=False)
+        os.replace(partial_path, path)
+
+    def _append(self, path: pathlib.Path, table: pd.DataFrame, start: int):
+        """Append rows of the table from ``start`` on, under a lock of the file."""
+        with file_lock(path.with_suffix(".lock")):
+            if not path.exists():
+                self._replace(path, table)
+                return
+            # one write of all rows, lines of other workers are never split
+            with open(path, "a") as stream:
+                stream.write(table.iloc[start:].to_csv(header=False, index=False))
+
+    def _write_quantiles(self, user_weights: UserWeights):
+        """Merge new ranks into the saved sketch and keep the merged one."""
+        path = self.directory / user_weights.user / f"{QUANTILES}.json"
+        with file_lock(path.with_suffix(".lock")):
+            quantiles = read_sketch(path, self.half_life)
+            if quantiles is None:
+                # first sketch of the user, built from all its ranks
+                quantiles = user_weights.quantiles
+            else:
+                quantiles.merge(user_weights.new_quantiles)
+            write_sketch(quantiles, path)
+        user_weights.quantiles = quantiles
+        user_weights.new_quantiles = QuantileSketch(half_life=quantiles.half_life)
+
+    def _flush_user(self, user_weights: UserWeights):
+        with user_weights.lock:
+            for name in sorted(user_weights.dirty):
+                try:
+                    self._write(user_weights, name)
+                except OSError:
+                    self.logger.exception(
+                        "Could not write %s of %s.", name, user_weights.user
+                    )
+                    continue
+                user_weights.dirty.discard(name)
+
+    def flush(self, user: Optional[str] = None) -> None:
+        """Write changed tables of the user, or of every user."""
+        self._flushed_at = time.monotonic()
+        if user is not None:
+            users = [self._users[user]] if user in self._users else []
+        else:
+            users = list(self._users.values())
+        for user_weights in users:
+            self._flush_user(user_weights)
+
+    def flush_if_due(self) -> None:
+        """Write changed tables if ``flush_interval`` passed since last time."""
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+
+
+# weights of the process
+WEIGHTS = WeightStore()
+atexit.register(WEIGHTS.flush)
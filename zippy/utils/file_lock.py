@@ -0,0 +1,17 @@
+"""Lock of a file shared by the worker processes of the supervisor."""
+import contextlib
+import fcntl
+import pathlib
+
+from typing import Iterator
+
+
+@contextlib.contextmanager
+def file_lock(path: pathlib.Path) -> Iterator[None]:
+    """Hold an exclusive lock of the file, shared by every process."""
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
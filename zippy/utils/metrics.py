@@ -0,0 +1,242 @@
+"""Timings of the stages of ranking and training on emails.
+
+Stages are timed with :meth:`Metrics.timer` or :meth:`Metrics.timed`, and the
+durations of every stage are counted in a :class:`Histogram` with buckets of
+doubling width. The histograms are written to the client log every
+``log_interval`` seconds, or read with :meth:`Metrics.to_dict` to be served
+as JSON.
+
+Metrics are disabled by default: a timer is then a shared object doing
+nothing and a timed function only checks a flag before it is called.
+"""
+import bisect
+import functools
+import logging
+import threading
+import time
+
+from typing import Any, Callable, Dict, NamedTuple, Optional, Sequence, Tuple, TypeVar
+
+from zippy.utils.log_handler import get_logger
+
+# upper bounds of the buckets of durations in seconds, from 10us to 168s
+BUCKETS: Tuple[float, ...] = tuple(1e-5 * 2**power for power in range(25))
+# seconds between writes of the histograms to the log
+DEFAULT_LOG_INTERVAL: float = 300
+
+Function = TypeVar("Function", bound=Callable[..., Any])
+
+
+class Summary(NamedTuple):
+    """Count and durations of a stage, in seconds."""
+
+    count: int
+    total: float
+    mean: float
+    p50: float
+    p90: float
+    p99: float
+    max: float
+
+
+class Histogram:
+    """Count of durations in buckets of doubling width.
+
+    Parameters
+    ----------
+    bounds: Sequence[float], optional
+        Upper bound of every bucket, in increasing order, a last bucket holds
+        longer durations
+    """
+
+    def __init__(self, bounds: Sequence[float] = BUCKETS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        """Count a duration."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        """Return upper bound of the bucket of the quantile, 0 if empty."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self) -> Summary:
+        """Return count and durations of the histogram."""
+        return Summary(
+            self.count,
+            self.total,
+            self.total / self.count if self.count else 0.0,
+            self.quantile(0.5),
+            self.quantile(0.9),
+            self.quantile(0.99),
+            self.max,
+        )
+
+
+class _NullTimer:
+    """Timer of disabled metrics, doing nothing."""
+
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    """Time the block it is entered for."""
+
+    __slots__ = ("metrics", "name", "started")
+
+    def __init__(self, metrics: "Metrics", name: str) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.started = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.metrics.observe(self.name, time.perf_counter() - self.started)
+
+
+class Metrics:
+    """Histograms of the durations of every stage.
+
+    Parameters
+    ----------
+    enabled: bool, optional
+        Record durations, or do nothing
+    log_interval: float, optional
+        Seconds between writes of the histograms to the log
+    logger: logging.Logger, optional
+        Logger to write the histograms to
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        log_interval: float = DEFAULT_LOG_INTERVAL,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
+        self.enabled = enabled
+        self.log_interval = log_interval
+        self._logger = logger
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+        self._logged_at = time.monotonic()
+
+    @property
+    def logger(self) -> logging.Logger:
+        """Logger of the metrics, the client one by default."""
+        if self._logger is None:
+            self._logger = get_logger("client")
+        return self._logger
+
+    def configure(self, config: dict) -> None:
+        """Enable metrics and set their log interval from the client config."""
+        self.enabled = bool(config.get("metrics", False))
+        self.log_interval = config.get("metrics_log_interval", DEFAULT_LOG_INTERVAL)
+
+    def observe(self, name: str, seconds: float) -> None:
+        """Count a duration of the stage."""
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, name: str) -> Any:
+        """Return context manager timing the stage, if enabled."""
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name)
+
+    def timed(self, name: str) -> Callable[[Function], Function]:
+        """Return decorator timing calls of a function as the stage."""
+
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started)
+
+            return wrapper
+
+        return decorator
+
+    def summaries(self) -> Dict[str, Summary]:
+        """Return summary of every stage, by name."""
+        with self._lock:
+            return {
+                name: histogram.summary()
+                for name, histogram in sorted(self._histograms.items())
+            }
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        """Return summaries and buckets of every stage, JSON serializable."""
+        with self._lock:
+            return {
+                name: dict(
+                    histogram.summary()._asdict(),
+                    buckets=dict(zip(map(str, histogram.bounds), histogram.counts)),
+                    longer=histogram.counts[-1],
+                )
+                for name, histogram in sorted(self._histograms.items())
+            }
+
+    def reset(self) -> None:
+        """Forget every duration."""
+        with self._lock:
+            self._histograms.clear()
+
+    def log(self) -> None:
+        """Write summary of every stage to the log, slowest in total first."""
+        self._logged_at = time.monotonic()
+        summaries = sorted(self.summaries().items(), key=lambda item: -item[1].total)
+        for name, summary in summaries:
+            self.logger.info(
+                "%s: count=%d total=%.3fs mean=%.2fms p50=%.2fms p90=%.2fms "
+                "p99=%.2fms max=%.2fms",
+                name,
+                summary.count,
+                summary.total,
+                summary.mean * 1000,
+                summary.p50 * 1000,
+                summary.p90 * 1000,
+                summary.p99 * 1000,
+                summary.max * 1000,
+            )
+
+    def log_if_due(self) -> None:
+        """Write summaries if enabled and ``log_interval`` passed since last time."""
+        if self.enabled and time.monotonic() - self._logged_at >= self.log_interval:
+            self.log()
+
+
+# metrics of the process
+METRICS = Metrics()